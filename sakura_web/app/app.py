@@ -1,85 +1,184 @@
-import nfc
+import argparse
+import os
+import sys
 import time
-import pandas as pd
+import uid_registry
+from collections import namedtuple
+from app_helpers import encode_uri_record, generate_url
 
-# 初始化空的 DataFrame，存儲編號和 UID 的對應關係
-columns = ['Number', 'UID']
-df = pd.DataFrame(columns=columns)
+# metrics.py 在 prototype 裡 (verification server 也用同一套)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+import metrics
+
+# 持久化的 UID -> 流水號對應表 (O(1) 查詢，重開程式後流水號也不會重複)
+# 第一次用到才打開，import app 不會在目前目錄建 csv
+_registry = None
+
+# 預先編碼時 UID 的佔位字串: 和 7-byte UID 一樣是 14 個字元，NDEF 長度欄位不用改
+UID_PLACEHOLDER = "#" * 14
+
+# 寫卡每個階段的延遲: 等卡片 -> 查/分配流水號 -> 寫入 -> 讀回驗證 -> 等卡片移開
+WRITE_STAGES = ("wait", "assign", "write", "verify", "release")
+WRITE_STAGE_SECONDS = {stage: metrics.REGISTRY.histogram("sakura_nfc_write_stage_seconds", stage=stage)
+                       for stage in WRITE_STAGES}
+
+def get_registry():
+    """
+    取得 (必要時打開) uid_registry.REGISTRY_FILE 的 UIDRegistry
+    """
+    global _registry
+    if _registry is None:
+        _registry = uid_registry.UIDRegistry(uid_registry.REGISTRY_FILE)
+    return _registry
 
 def generate_number():
     """
-    根據 DataFrame 自動生成流水號
+    取得下一個新 UID 會拿到的流水號
     """
-    if df.empty:
-        return 1  # 如果 DataFrame 為空，從 1 開始
-    return df['Number'].max() + 1  # 否則取最大編號 + 1
+    return get_registry().peek_next_number()
 
 def add_uid_to_dataframe(uid):
     """
-    檢查 UID 是否已存在，否則新增到 DataFrame
+    檢查 UID 是否已存在，否則分配新流水號並寫入 registry
     """
-    global df
-
-    # 檢查 UID 是否已存在
-    if uid in df['UID'].values:
-        number = df.loc[df['UID'] == uid, 'Number'].iloc[0]
-        print(f"UID 已存在，對應編號為：{number}")
-        return number
-    else:
-        # 生成新流水號並新增至 DataFrame
-        number = generate_number()
-        new_row = {'Number': number, 'UID': uid}
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+    number, is_new = get_registry().get_or_allocate(uid)
+    if is_new:
         print(f"生成新編號：{number} 並綁定 UID：{uid}")
-        return number
+    else:
+        print(f"UID 已存在，對應編號為：{number}")
+    return number
 
-def generate_url(number, uid):
+def export_dataframe():
     """
-    根據編號和 UID 生成靜態子網域 URL
+    匯出 Number / UID 對應表為 pandas DataFrame (報表用)
     """
-    STATIC_SUBDOMAIN_TEMPLATE = "https://nfc.sakurahighschool.com/s/{number}?uid={uid}"
-    return STATIC_SUBDOMAIN_TEMPLATE.format(number=number, uid=uid)
+    return get_registry().to_dataframe()
 
-def on_connect(tag):
+class PreparedRecord(namedtuple("PreparedRecord", ["number", "head", "tail"])):
     """
-    當 NFC 晶片連接時執行的邏輯
+    下一張新卡的流水號和已經編碼好的 NDEF message (UID 前後兩段)
     """
-    try:
-        # 獲取 UID
-        uid = tag.identifier.hex().upper()
-        print(f"檢測到 UID：{uid}")
-
-        # 檢查 UID 並獲取編號
-        number = add_uid_to_dataframe(uid)
 
-        # 生成 URL
-        unique_url = generate_url(number, uid)
-        print(f"生成的靜態子網域 URL：{unique_url}")
+    def encode(self, uid):
+        if len(uid) == len(UID_PLACEHOLDER):
+            return self.head + uid.encode() + self.tail
+        # 4-byte / 10-byte UID: URL 長度不同，整個重新編碼
+        return encode_uri_record(generate_url(self.number, uid))
 
-        # 寫入 URL 到 NFC 晶片
-        if tag.ndef:
-            record = nfc.ndef.UriRecord(unique_url)
-            tag.ndef.records = [record]
-            print("成功將 URL 寫入到 NFC 晶片！")
-        else:
-            print("此卡片不支援 NDEF 格式")
-    except Exception as e:
-        print(f"寫入失敗：{str(e)}")
-    return False
+def prepare_record(number):
+    """
+    在等卡片的時候先把下一個流水號的 URL 編碼成 NDEF bytes
+    """
+    message = encode_uri_record(generate_url(number, UID_PLACEHOLDER))
+    head, _, tail = message.partition(UID_PLACEHOLDER.encode())
+    return PreparedRecord(number, head, tail)
 
-def write_to_nfc():
+class WriteLoop:
     """
-    自動化寫入 NFC 晶片的主函數
+    nfcpy 寫卡迴圈。
+
+    下一張卡的流水號和 NDEF bytes 在等卡片時就準備好，卡片靠近後只剩
+    綁定流水號、寫入和讀回驗證 (同一次 field session)。on-connect 回傳
+    True 讓 clf.connect() 一直等到卡片移開才返回，所以移開後馬上重新等待
+    下一張，不用固定 sleep。每個階段的延遲記錄在 WRITE_STAGE_SECONDS。
     """
-    with nfc.ContactlessFrontend('usb') as clf:
+
+    def __init__(self, clf, registry):
+        self.clf = clf
+        self.registry = registry
+        self.prepared = None
+        self.written = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._armed = self._connected = None
+
+    def run(self):
         while True:
+            if self.prepared is None:
+                self.prepared = prepare_record(self.registry.peek_next_number())
             print("請將卡片靠近讀寫器...")
+            self._armed = time.perf_counter()
             try:
-                # 等待 NFC 晶片靠近並執行 on_connect
-                clf.connect(rdwr={'on-connect': on_connect})
+                # 回傳 None: Ctrl+C 中斷
+                if self.clf.connect(rdwr={"on-connect": self.on_connect, "on-release": self.on_release}) is None:
+                    break
             except Exception as e:
                 print(f"讀取器錯誤：{str(e)}")
-            time.sleep(1)  # 防止快速重複操作
+                time.sleep(1)  # 讀取器出錯時不要空轉
+
+    def on_connect(self, tag):
+        """
+        當 NFC 晶片連接時執行的邏輯
+        """
+        self._connected = time.perf_counter()
+        WRITE_STAGE_SECONDS["wait"].record(self._connected - self._armed)
+        try:
+            self.write(tag)
+        except Exception as e:
+            self.failed += 1
+            print(f"寫入失敗：{str(e)}")
+        return True
+
+    def on_release(self, tag):
+        WRITE_STAGE_SECONDS["release"].record(time.perf_counter() - self._connected)
+
+    def write(self, tag):
+        uid = tag.identifier.hex().upper()
+        if not tag.ndef:
+            raise ValueError(f"此卡片 {uid} 不支援 NDEF 格式")
+        last = time.perf_counter()
+
+        # 新卡拿預先準備的流水號; 已登記的卡沿用原本的編號重新寫入，準備好的留給下一張
+        number = self.registry.bind(uid, self.prepared.number)
+        if number == self.prepared.number:
+            message = self.prepared.encode(uid)
+            self.prepared = None
+        else:
+            message = encode_uri_record(generate_url(number, uid))
+        if len(message) > tag.ndef.capacity:
+            raise ValueError(f"URL 太長：{len(message)} bytes > {tag.ndef.capacity}")
+        now = time.perf_counter()
+        WRITE_STAGE_SECONDS["assign"].record(now - last)
+        last = now
+
+        tag.ndef.octets = message
+        now = time.perf_counter()
+        WRITE_STAGE_SECONDS["write"].record(now - last)
+        last = now
+
+        # has_changed 會重新讀取晶片上的 NDEF，和剛寫入的內容比對
+        if tag.ndef.has_changed:
+            raise IOError(f"UID {uid} 讀回驗證失敗")
+        WRITE_STAGE_SECONDS["verify"].record(time.perf_counter() - last)
+
+        self.written += 1
+        print(f"成功將編號 {number} 寫入 UID {uid} ({self.cards_per_minute():.1f} cards/min)")
+
+    def cards_per_minute(self):
+        return self.written * 60.0 / max(time.monotonic() - self._started, 1e-9)
+
+    def print_report(self):
+        print(f"--- {self.written} written, {self.failed} failed, {self.cards_per_minute():.1f} cards/min ---")
+        for stage in WRITE_STAGES:
+            summary = WRITE_STAGE_SECONDS[stage].summary()
+            if summary["count"]:
+                print(f"  {stage:8} p50 {summary['p50'] * 1e3:8.1f} ms   p99 {summary['p99'] * 1e3:8.1f} ms"
+                      f"   ({summary['count']} cards)")
+
+def write_to_nfc(metrics_file=None):
+    """
+    自動化寫入 NFC 晶片的主函數
+    """
+    import nfc  # 只有真的接讀寫器時才需要 nfcpy (WriteLoop 的測試用假的 clf)
+
+    with nfc.ContactlessFrontend('usb') as clf:
+        loop = WriteLoop(clf, get_registry())
+        try:
+            loop.run()
+        finally:
+            loop.print_report()
+            if metrics_file:
+                metrics.dump(metrics_file)
 
 def login_app():
     # get email address and password
@@ -92,4 +191,8 @@ def signup_app():
     return True
 
 if __name__ == "__main__":
-    write_to_nfc()
+    parser = argparse.ArgumentParser(description="Write numbered SDM URLs to NFC tags with nfcpy.")
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help="write per-stage latency here on exit (.json or Prometheus text)")
+    args = parser.parse_args()
+    write_to_nfc(args.metrics_file)
@@ -0,0 +1,62 @@
+# NFC Forum URI record prefix codes (最長的 prefix 要先比對)
+URI_PREFIXES = [
+    (0x02, "https://www."),
+    (0x01, "http://www."),
+    (0x04, "https://"),
+    (0x03, "http://"),
+]
+
+def generate_url(number, uid):
+    """
+    根據編號和 UID 生成靜態子網域 URL
+    """
+    STATIC_SUBDOMAIN_TEMPLATE = "https://nfc.sakurahighschool.com/s/{number}?uid={uid}"
+    return STATIC_SUBDOMAIN_TEMPLATE.format(number=number, uid=uid)
+
+def encode_uri_record(url):
+    """
+    將 URL 編碼成單一 NDEF URI record (MB=ME=1, TNF=well-known, type 'U')
+    """
+    code, rest = 0x00, url
+    for prefix_code, prefix in URI_PREFIXES:
+        if url.startswith(prefix):
+            code, rest = prefix_code, url[len(prefix):]
+            break
+
+    payload = bytes([code]) + rest.encode()
+    if len(payload) <= 0xFF:
+        # Short record: 1-byte payload length
+        return bytes([0xD1, 0x01, len(payload)]) + b"U" + payload
+    return bytes([0xC1, 0x01]) + len(payload).to_bytes(4, "big") + b"U" + payload
+
+def build_ndef_file(url):
+    """
+    Type 4 Tag NDEF file 內容: NLEN (2 bytes) + NDEF message
+    """
+    message = encode_uri_record(url)
+    return len(message).to_bytes(2, "big") + message
+
+def decode_uri_record(message):
+    """
+    從 NDEF message 取出第一個 URI record 的 URL (沒有的話回傳 None)
+    """
+    if len(message) < 3:
+        return None
+    header = message[0]
+    type_length = message[1]
+    if header & 0x10:
+        payload_length, position = message[2], 3
+    else:
+        payload_length, position = int.from_bytes(message[2:6], "big"), 6
+    id_length = 0
+    if header & 0x08:
+        id_length = message[position]
+        position += 1
+    record_type = message[position:position + type_length]
+    position += type_length + id_length
+    payload = message[position:position + payload_length]
+    if record_type != b"U" or not payload:
+        return None
+
+    prefixes = {code: prefix for code, prefix in URI_PREFIXES}
+    return prefixes.get(payload[0], "") + payload[1:].decode()
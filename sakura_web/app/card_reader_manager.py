@@ -1,7 +1,22 @@
-from smartcard.System import readers
-from smartcard.util import toHexString, toBytes
+try:
+    from smartcard.System import readers
+    from smartcard.Exceptions import CardConnectionException, NoCardException
+    from smartcard.util import toHexString
+except ImportError:
+    # 沒裝 pyscard (例如 CI): 只能接模擬器 (card_simulator.install)
+    from card_simulator import CardConnectionException, NoCardException, readers, toHexString
 from Crypto.Cipher import AES
+from app_helpers import decode_uri_record, encode_uri_record
+from ntag424_crypto import (cbc_decrypt, cbc_encrypt, command_iv, command_mac, derive_session_keys, pad,
+                            response_iv, response_mac, rotate_left, unpad)
+from collections import Counter
 import os
+import sys
+import time
+
+# metrics.py 在 prototype 裡 (verification server 也用同一套)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+import metrics
 
 # Developer AES key (replace with your actual key)
 DEVELOPER_AES_KEY = bytes.fromhex("00000000000000000000000000000000")
@@ -25,105 +40,798 @@ class CardErrorHandler:
         0x91F0: "FILE_NOT_FOUND: Specified file number does not exist.",
     }
 
+    # ISO 7816-4 status words the card returns for ISO commands
+    ISO_CODES = {
+        0x9000: "SUCCESS: Normal processing.",
+        0x6700: "WRONG_LENGTH: Wrong length; no further indication.",
+        0x6982: "SECURITY_STATUS_NOT_SATISFIED: Security status not satisfied.",
+        0x6985: "CONDITIONS_NOT_SATISFIED: Conditions of use not satisfied.",
+        0x6986: "NO_FILE_SELECTED: Command not allowed, no EF selected.",
+        0x6A82: "FILE_NOT_FOUND: File or application not found.",
+        0x6A86: "INCORRECT_P1_P2: Incorrect parameters P1-P2.",
+        0x6B00: "WRONG_OFFSET: Wrong parameters P1-P2 (offset outside the EF).",
+        0x6D00: "INS_NOT_SUPPORTED: Instruction code not supported or invalid.",
+        0x6E00: "CLA_NOT_SUPPORTED: Class not supported.",
+    }
+
     @staticmethod
     def handle_error(sw1, sw2):
         """Handles the error based on SW1 and SW2 values."""
-        error_code = (sw1 << 8) | sw2  # Combine SW1 and SW2 into a single error code
-        message = CardErrorHandler.ERROR_CODES.get(error_code, f"UNKNOWN_ERROR: SW1={sw1:02X}, SW2={sw2:02X}")
-        return message
+        return str(status_word(sw1, sw2))
+
+
+class StatusWord:
+    """
+    A status word (SW1 SW2) with its name and description.
+
+    Instances for every known code are created once and shared, so checking the
+    status of a response allocates nothing; the message is only formatted when
+    an error is actually shown.
+    """
+
+    __slots__ = ("code", "sw1", "sw2", "name", "description", "ok")
+
+    def __init__(self, code, name, description):
+        self.code = code
+        self.sw1 = code >> 8
+        self.sw2 = code & 0xFF
+        self.name = name
+        self.description = description
+        self.ok = code in (0x9000, 0x9100)
+
+    def __repr__(self):
+        return f"StatusWord(0x{self.code:04X}, {self.name})"
+
+    def __str__(self):
+        return f"{self.name}: {self.description}"
+
+
+def _build_status_words():
+    table = {}
+    for code, message in {**CardErrorHandler.ISO_CODES, **CardErrorHandler.ERROR_CODES}.items():
+        name, description = message.split(": ", 1)
+        table[code] = StatusWord(code, name, description)
+    return table
+
+
+STATUS_WORDS = _build_status_words()
+
+SUCCESS = STATUS_WORDS[0x9000]
+OPERATION_OK = STATUS_WORDS[0x9100]
+INTEGRITY_ERROR = STATUS_WORDS[0x911E]
+AUTHENTICATION_DELAY = STATUS_WORDS[0x91AD]
+AUTHENTICATION_ERROR = STATUS_WORDS[0x91AE]
+ADDITIONAL_FRAME = STATUS_WORDS[0x91AF]
+
+
+def status_word(sw1, sw2):
+    """The shared StatusWord for SW1 SW2 (unknown codes get a new UNKNOWN_ERROR instance)."""
+    code = (sw1 << 8) | sw2
+    status = STATUS_WORDS.get(code)
+    if status is None:
+        status = StatusWord(code, "UNKNOWN_ERROR", f"SW1={sw1:02X}, SW2={sw2:02X}")
+    return status
+
+
+class CardError(Exception):
+    """A command answered with an error status word."""
+
+    def __init__(self, status, context="Command failed"):
+        super().__init__(status, context)
+        self.status = status
+        self.context = context
+
+    def __str__(self):
+        return f"{self.context} SW1={self.status.sw1:02X}, SW2={self.status.sw2:02X} {self.status}"
+
+
+class RetryPolicy:
+    """
+    Retry / exponential backoff for transient errors.
+
+    A command answered with one of `retry_statuses` (by default only
+    AUTHENTICATION_DELAY) is sent again after a delay; with `retry_rf_loss`, a
+    dropped RF link (CardConnectionException) reconnects and sends the command
+    again. The delay before retry n is base_delay * multiplier**n, capped at
+    max_delay; after `max_retries` retries the error is returned / raised.
+    """
+
+    def __init__(self, max_retries=5, base_delay=0.02, multiplier=2.0, max_delay=0.5,
+                 retry_statuses=(0x91AD,), retry_rf_loss=True, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_rf_loss = retry_rf_loss
+        self.sleep = sleep
+
+    def delay(self, attempt):
+        return min(self.base_delay * self.multiplier ** attempt, self.max_delay)
+
+    def backoff(self, attempt):
+        self.sleep(self.delay(attempt))
+
+
+# APDU instruction -> metrics label
+APDU_NAMES = {
+    0xA4: "SELECT",
+    0xB0: "READ_BINARY",
+    0xD6: "UPDATE_BINARY",
+    0xCA: "GET_DATA",
+    0x71: "AUTH_EV2_FIRST",
+    0x77: "AUTH_EV2_NON_FIRST",
+    0xAF: "ADDITIONAL_FRAME",
+    0x60: "GET_VERSION",
+    0x8D: "WRITE_DATA",
+    0xAD: "READ_DATA",
+    0xF6: "GET_FILE_COUNTERS",
+}
+
+APDU_SECONDS = {ins: metrics.REGISTRY.histogram("sakura_apdu_seconds", ins=name) for ins, name in APDU_NAMES.items()}
+
+
+# 不重試 (舊行為)
+NO_RETRY = RetryPolicy(max_retries=0, retry_statuses=(), retry_rf_loss=False)
 
 
 class CardReader:
-    def __init__(self):
+    # NTAG 424 DNA NDEF application and its ISO file IDs
+    NDEF_APPLICATION = [0xD2, 0x76, 0x00, 0x00, 0x85, 0x01, 0x01]
+    CC_FILE = [0xE1, 0x03]
+    NDEF_FILE = [0xE1, 0x04]
+    PROPRIETARY_FILE = [0xE1, 0x05]
+
+    def __init__(self, reader=None, retry_policy=None, verbose=True):
+        self.reader = reader
         self.connection = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.verbose = verbose
+        self.retries = Counter()       # 重試原因 (status 名稱 / "RF_LOSS") -> 次數
+        self.reconnects = 0
+        self.reconnect_listeners = []  # 重新連線後呼叫 (例如 CardSession 恢復 SELECT 狀態)
     
     def connect(self):
-        reader_list = readers()
-        if not reader_list:
-            raise Exception("No card reader found.")
-        
-        self.reader = reader_list[0]
+        """Connect to the card on the given reader (default: the first PC/SC reader)."""
+        if self.reader is None:
+            reader_list = readers()
+            if not reader_list:
+                raise Exception("No card reader found.")
+            self.reader = reader_list[0]
+
         self.connection = self.reader.createConnection()
         self.connection.connect()
-        print(f"Connected to Reader: {self.reader}")
+        if self.verbose:
+            print(f"Connected to Reader: {self.reader}")
     
-    def disconnect():
-        pass
+    def disconnect(self):
+        if self.connection:
+            self.connection.disconnect()
+            self.connection = None
+
+    def reconnect(self):
+        """Reconnect after the RF link was lost; the card comes back with nothing selected."""
+        self.disconnect()
+        self.connection = self.reader.createConnection()
+        self.connection.connect()
+        self.reconnects += 1
+        for listener in self.reconnect_listeners:
+            listener()
+
+    def transceive(self, apdu):
+        """One APDU round trip; returns (data, StatusWord) without raising on the status."""
+        if not self.connection:
+            raise Exception("No active connection to the card")
+        start = time.perf_counter()
+        response, sw1, sw2 = self.connection.transmit(list(apdu))
+        elapsed = time.perf_counter() - start
+        histogram = APDU_SECONDS.get(apdu[1])
+        if histogram is None:
+            histogram = metrics.REGISTRY.histogram("sakura_apdu_seconds", ins=f"{apdu[1]:02X}")
+        histogram.record(elapsed)
+        if self.verbose:
+            print(f"APDU command sent: {toHexString(list(apdu))}")
+        status = status_word(sw1, sw2)
+        if not status.ok and status is not ADDITIONAL_FRAME:
+            metrics.inc("sakura_apdu_status_total", status=status.name)
+        return response, status
+
+    def exchange(self, apdu, chain=False):
+        """
+        transceive() with the retry policy applied. With `chain`, ADDITIONAL_FRAME
+        responses are continued (90 AF) and the data of all frames returned together.
+        """
+        policy = self.retry_policy
+        attempt = 0
+        lost = False
+        while True:
+            try:
+                if lost:
+                    self.reconnect()
+                    lost = False
+                response, status = self.transceive(apdu)
+            except (CardConnectionException, NoCardException):
+                if not policy.retry_rf_loss or attempt >= policy.max_retries:
+                    raise
+                self.retries["RF_LOSS"] += 1
+                metrics.inc("sakura_apdu_retries_total", reason="RF_LOSS")
+                policy.backoff(attempt)
+                attempt += 1
+                lost = True
+                continue
+            if status.code in policy.retry_statuses and attempt < policy.max_retries:
+                self.retries[status.name] += 1
+                metrics.inc("sakura_apdu_retries_total", reason=status.name)
+                policy.backoff(attempt)
+                attempt += 1
+                continue
+            break
+
+        if chain and status is ADDITIONAL_FRAME:
+            response = list(response)
+            while status is ADDITIONAL_FRAME:
+                frame, status = self.exchange([0x90, 0xAF, 0x00, 0x00, 0x00])
+                response.extend(frame)
+        return response, status
     
     def send_apdu(self, apdu):
         """Send Application Data Unit command to the card"""
-        if not self.connection:
-            raise Exception("No active connection to the card")
+        response, status = self.exchange(apdu)
         
-        response, sw1, sw2 = self.connection.transmit(apdu)
-        print(f"APDU command sent: {toHexString(apdu)}")
-        
-        if sw1 == 0x91:
-            return response, sw1, sw2
-        else:
-            # Use the ErrorHandler class to get a detailed error message
-            error_message = CardErrorHandler.handle_error(sw1, sw2)
-            raise Exception(f"Command failed SW1={toHexString(sw1)}, SW2={toHexString(sw2)} {error_message}")
+        # 0x9000 (ISO 7816-4) / 0x9100 (native) 成功，0x91AF 還有下一個 frame；其他 0x91xx 都是錯誤
+        if status.ok or status is ADDITIONAL_FRAME:
+            return response, status.sw1, status.sw2
+        raise CardError(status)
+
+    def get_uid(self):
+        """Read the card UID through the reader (PC/SC GET DATA)."""
+        response, _, _ = self.send_apdu([0xFF, 0xCA, 0x00, 0x00, 0x00])
+        return toHexString(response).replace(" ", "")
+
+    def get_version(self):
+        """GetVersion (three frames chained with ADDITIONAL_FRAME)."""
+        response, status = self.exchange([0x90, 0x60, 0x00, 0x00, 0x00], chain=True)
+        if not status.ok:
+            raise CardError(status, "GetVersion failed")
+        return bytes(response)
+
+    def select_application(self, aid=NDEF_APPLICATION):
+        self.send_apdu([0x00, 0xA4, 0x04, 0x00, len(aid)] + aid + [0x00])
+
+    def select_file(self, file_id):
+        self.send_apdu([0x00, 0xA4, 0x00, 0x0C, 0x02] + file_id)
+
+    def read_binary(self, offset, length):
+        """ISO ReadBinary from the currently selected file."""
+        response, _, _ = self.send_apdu([0x00, 0xB0, offset >> 8, offset & 0xFF, length])
+        return response
+
+    def update_binary(self, offset, data):
+        """ISO UpdateBinary into the currently selected file."""
+        self.send_apdu([0x00, 0xD6, offset >> 8, offset & 0xFF, len(data)] + list(data))
 
 class Authentication:
-    def __init__(self, card_reader, aes_key):
+    """
+    EV2 secure-messaging session.
+
+    authenticate() runs AuthenticateEV2First once and keeps the session ENC/MAC
+    keys, the transaction identifier (TI) and the command counter; switch_key()
+    moves the session to another key with the shorter AuthenticateEV2NonFirst,
+    keeping TI and the counter. Native commands sent with send_command() are
+    protected in Plain / MAC / Full communication mode without re-authenticating;
+    if the RF link drops during a command, the session is re-opened and the
+    command sent again. `card_reader` is a CardReader or a CardSession.
+    """
+
+    PLAIN = 0x00
+    MAC = 0x01
+    FULL = 0x03
+
+    def __init__(self, card_reader, aes_key=DEVELOPER_AES_KEY, key_no=0):
         self.card_reader = card_reader
         self.aes_key = aes_key
-    
-    def authenticate(self):
-        """Authenticate as Developer with AES KEY"""
-        print("Authenticate as DEVELOPER...")
-        
-        # step 1: send AuthenticateEV2First command
-        AUTH_CMD_PART1 = [] 
-        
-        encrypted_rnd_b, sw1, sw2 = CardReader.send_apdu(self.card_reader, AUTH_CMD_PART1)
-        
-        if (sw1, sw2) != (0x90, 0x00):
-            raise Exception()
-        
+        self.key_no = key_no
+        self.reset()
+
+    @property
+    def authenticated(self):
+        return self.ti is not None
+
+    def reset(self):
+        """Forget the session (the card drops it on SELECT, errors and a new tap)."""
+        self.enc_key = None
+        self.mac_key = None
+        self.ti = None
+        self.cmd_ctr = 0
+
+    def authenticate(self, key_no=None, aes_key=None):
+        """AuthenticateEV2First: start a new session (new TI, command counter 0)."""
+        key_no = self.key_no if key_no is None else key_no
+        aes_key = self.aes_key if aes_key is None else aes_key
+        if self.card_reader.verbose:
+            print(f"Authenticate with key {key_no}...")
+        self.reset()
+        self._handshake(0x71, [key_no, 0x00], key_no, aes_key)
+
+    def switch_key(self, key_no, aes_key):
+        """AuthenticateEV2NonFirst: re-authenticate with another key inside the session."""
+        if not self.authenticated:
+            raise Exception("AuthenticateEV2NonFirst needs an active session")
+        self._handshake(0x77, [key_no], key_no, aes_key)
+
+    def _handshake(self, cmd, data, key_no, aes_key):
+        first = cmd == 0x71
+        # AUTHENTICATION_DELAY 由 exchange 的 retry policy 處理
+        response, status = self.card_reader.exchange([0x90, cmd, 0x00, 0x00, len(data)] + data + [0x00])
+        if status is not ADDITIONAL_FRAME:
+            self.reset()
+            raise CardError(status, "Authentication failed")
+
+        rnd_b = cbc_decrypt(aes_key, bytes(response))
+        rnd_a = os.urandom(16)
+        frame = cbc_encrypt(aes_key, rnd_a + rotate_left(rnd_b))
+        response, status = self.card_reader.exchange([0x90, 0xAF, 0x00, 0x00, len(frame)] + list(frame) + [0x00])
+        if status is not OPERATION_OK:
+            self.reset()
+            raise CardError(status, "Authentication failed")
+
+        plain = cbc_decrypt(aes_key, bytes(response))
+        rnd_a_rotated = plain[4:20] if first else plain[:16]
+        if rnd_a_rotated != rotate_left(rnd_a):
+            self.reset()
+            raise Exception("Authentication failed: card returned a wrong RndA'")
+
+        self.enc_key, self.mac_key = derive_session_keys(aes_key, rnd_a, rnd_b)
+        self.key_no, self.aes_key = key_no, aes_key
+        if first:
+            self.ti = plain[:4]
+            self.cmd_ctr = 0
+
+    def send_command(self, cmd, header=b"", data=b"", comm_mode=PLAIN, recover=True):
+        """Send a native command in the session; returns the (verified, decrypted) response data."""
+        if not self.authenticated:
+            raise Exception("Not authenticated")
+
+        payload = bytes(header)
+        if comm_mode == self.FULL and data:
+            payload += cbc_encrypt(self.enc_key, pad(data), command_iv(self.enc_key, self.ti, self.cmd_ctr))
+        else:
+            payload += bytes(data)
+        if comm_mode != self.PLAIN:
+            payload += command_mac(self.mac_key, cmd, self.cmd_ctr, self.ti, payload)
+
+        reconnects = self.card_reader.reconnects
+        response, status = self.card_reader.exchange([0x90, cmd, 0x00, 0x00, len(payload)] + list(payload) + [0x00],
+                                                     chain=True)
+        if self.card_reader.reconnects != reconnects and recover:
+            # RF link 斷過: 卡片的 session 已經不見了，重新驗證後再送一次
+            self.authenticate(self.key_no, self.aes_key)
+            return self.send_command(cmd, header, data, comm_mode, recover=False)
+        if status is not OPERATION_OK:
+            self.reset()
+            raise CardError(status, f"Command {cmd:02X} failed")
+
+        self.cmd_ctr = (self.cmd_ctr + 1) & 0xFFFF
+        response = bytes(response)
+        if comm_mode == self.PLAIN:
+            return response
+
+        response, mac = response[:-8], response[-8:]
+        if mac != response_mac(self.mac_key, 0x00, self.cmd_ctr, self.ti, response):
+            self.reset()
+            raise CardError(INTEGRITY_ERROR, f"Command {cmd:02X} failed: response MAC does not match")
+        if comm_mode == self.FULL and response:
+            response = unpad(cbc_decrypt(self.enc_key, response, response_iv(self.enc_key, self.ti, self.cmd_ctr)))
+        return response
+
+    def write_data(self, file_no, offset, data, comm_mode=FULL):
+        """Native WriteData (0x8D)."""
+        header = bytes([file_no]) + offset.to_bytes(3, "little") + len(data).to_bytes(3, "little")
+        self.send_command(0x8D, header, data, comm_mode)
+
+    def read_data(self, file_no, offset, length, comm_mode=FULL):
+        """Native ReadData (0xAD)."""
+        header = bytes([file_no]) + offset.to_bytes(3, "little") + length.to_bytes(3, "little")
+        return self.send_command(0xAD, header, b"", comm_mode)
+
+    def get_file_counters(self, file_no=0x02):
+        """SDM read counter of a file (GetFileCounters, always Full mode)."""
+        response = self.send_command(0xF6, bytes([file_no]), b"", self.FULL)
+        return int.from_bytes(response[:3], "little")
+
+class CardSession:
+    """
+    Card I/O session on top of CardReader that remembers the selected file.
+
+    SELECTs for the file that is already selected are skipped, and writes are
+    buffered per file so adjacent or overlapping ranges go out as one
+    UpdateBinary on flush(). `apdus_sent` / `apdus_saved` count the APDUs sent
+    and the round trips avoided.
+
+    `max_read` / `max_write` are the most data bytes the reader accepts in one
+    ReadBinary / UpdateBinary; larger transfers are split into chunks of that
+    size. With `extended_length`, chunks over the short-APDU limits (256 / 255)
+    are sent as extended-length APDUs.
+
+    After authenticate(), writes (and reads of files that are not in plain
+    communication mode) go out as native WriteData / ReadData inside one EV2
+    secure-messaging session, so a whole provisioning run costs one handshake.
+    """
+
+    SHORT_MAX_READ = 0x100   # short Le (00 = 256)
+    SHORT_MAX_WRITE = 0xFF   # short Lc
+    NATIVE_MAX_DATA = 0xD0   # WriteData / ReadData 一個 frame 的資料量 (Full mode 加密 + MAC 後仍 < 256)
+
+    # ISO file ID -> native file number / communication mode (出廠設定)
+    FILE_NUMBERS = {
+        tuple(CardReader.CC_FILE): 0x01,
+        tuple(CardReader.NDEF_FILE): 0x02,
+        tuple(CardReader.PROPRIETARY_FILE): 0x03,
+    }
+    FILE_COMM_MODES = {
+        tuple(CardReader.CC_FILE): Authentication.PLAIN,
+        tuple(CardReader.NDEF_FILE): Authentication.PLAIN,
+        tuple(CardReader.PROPRIETARY_FILE): Authentication.FULL,
+    }
+
+    def __init__(self, card_reader, max_read=SHORT_MAX_READ, max_write=SHORT_MAX_WRITE, extended_length=False,
+                 comm_modes=None):
+        self.card_reader = card_reader
+        self.extended_length = extended_length
+        self.max_read = max_read if extended_length else min(max_read, self.SHORT_MAX_READ)
+        self.max_write = max_write if extended_length else min(max_write, self.SHORT_MAX_WRITE)
+        self.selected_application = None
+        self.selected_file = None
+        self.pending_writes = {}  # file_id -> [(offset, bytes)]
+        self.apdus_sent = 0
+        self.apdus_saved = 0
+        self.comm_modes = dict(self.FILE_COMM_MODES if comm_modes is None else comm_modes)
+        self.auth = None
+        card_reader.reconnect_listeners.append(self._restore_selection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def send_apdu(self, apdu):
+        """Send through the reader; on any error the card state is no longer known."""
+        self.apdus_sent += 1
+        try:
+            return self.card_reader.send_apdu(apdu)
+        except Exception:
+            self.invalidate()
+            raise
+
+    def exchange(self, apdu, chain=False):
+        """CardReader.exchange (status word returned, not raised) with the same bookkeeping."""
+        self.apdus_sent += 1
+        try:
+            return self.card_reader.exchange(apdu, chain)
+        except Exception:
+            self.invalidate()
+            raise
+
+    @property
+    def reconnects(self):
+        return self.card_reader.reconnects
+
+    @property
+    def retries(self):
+        return self.card_reader.retries
+
+    @property
+    def verbose(self):
+        return self.card_reader.verbose
+
+    def _restore_selection(self):
+        """After a reconnect: the card lost its selection, SELECT again what was selected."""
+        application, file_id = self.selected_application, self.selected_file
+        self.invalidate()
+        if application is None:
+            return
+        _, status = self.card_reader.transceive([0x00, 0xA4, 0x04, 0x00, len(application)] + list(application) + [0x00])
+        self.apdus_sent += 1
+        if not status.ok:
+            return
+        self.selected_application = application
+        if file_id is not None:
+            _, status = self.card_reader.transceive([0x00, 0xA4, 0x00, 0x0C, 0x02] + list(file_id))
+            self.apdus_sent += 1
+            if status.ok:
+                self.selected_file = file_id
+
+    def invalidate(self):
+        """Forget the selection and the secure session (e.g. after an error, reconnect or new tap)."""
+        self.selected_application = None
+        self.selected_file = None
+        if self.auth is not None:
+            self.auth.reset()
+
+    @property
+    def authenticated(self):
+        return self.auth is not None and self.auth.authenticated
+
+    def authenticate(self, aes_key=DEVELOPER_AES_KEY, key_no=0):
+        """
+        Open the secure-messaging session, or reuse it: an active session with the
+        same key costs nothing, another key only an AuthenticateEV2NonFirst.
+        """
+        self.select_application()
+        if self.auth is None:
+            self.auth = Authentication(self, aes_key, key_no)
+        if not self.auth.authenticated:
+            self.auth.authenticate(key_no, aes_key)
+        elif (self.auth.key_no, self.auth.aes_key) != (key_no, aes_key):
+            self.auth.switch_key(key_no, aes_key)
+        else:
+            self.apdus_saved += 2  # 省下 AuthenticateEV2First 的兩段
+        return self.auth
+
+    def select_application(self, aid=CardReader.NDEF_APPLICATION):
+        if self.selected_application == tuple(aid):
+            self.apdus_saved += 1
+            return
+        if self.auth is not None:
+            self.auth.reset()  # 卡片在 SELECT application 時會清掉驗證狀態
+        self.send_apdu([0x00, 0xA4, 0x04, 0x00, len(aid)] + list(aid) + [0x00])
+        self.selected_application = tuple(aid)
+        self.selected_file = None
+
+    def select_file(self, file_id):
+        self.select_application()
+        if self.selected_file == tuple(file_id):
+            self.apdus_saved += 1
+            return
+        self.send_apdu([0x00, 0xA4, 0x00, 0x0C, 0x02] + list(file_id))
+        self.selected_file = tuple(file_id)
+
+    def read_binary(self, file_id, offset, length):
+        """
+        Read `length` bytes from a file in as few max_read chunks as possible,
+        flushing its buffered writes first so the read sees them.
+        """
+        self.flush(file_id)
+        if self.authenticated and self.comm_modes[tuple(file_id)] != Authentication.PLAIN:
+            return self._read_data(file_id, offset, length)
+        self.select_file(file_id)
+        data = []
+        while len(data) < length:
+            position = offset + len(data)
+            chunk = min(length - len(data), self.max_read)
+            if chunk > self.SHORT_MAX_READ:
+                le = [0x00, chunk >> 8, chunk & 0xFF]
+            else:
+                le = [chunk & 0xFF]
+            response, _, _ = self.send_apdu([0x00, 0xB0, position >> 8, position & 0xFF] + le)
+            if not response:
+                break  # 檔案結尾
+            data.extend(response)
+        return data
+
+    def update_binary(self, file_id, offset, data):
+        """Write to a file right away, in max_write chunks (native WriteData inside a secure session)."""
+        if self.authenticated:
+            return self._write_data(file_id, offset, data)
+        self.select_file(file_id)
+        for start in range(0, len(data), self.max_write):
+            chunk = list(data[start:start + self.max_write])
+            position = offset + start
+            if len(chunk) > self.SHORT_MAX_WRITE:
+                lc = [0x00, len(chunk) >> 8, len(chunk) & 0xFF]
+            else:
+                lc = [len(chunk)]
+            self.send_apdu([0x00, 0xD6, position >> 8, position & 0xFF] + lc + chunk)
+        return -(-len(data) // self.max_write)  # APDUs sent
+
+    def _read_data(self, file_id, offset, length):
+        file_no, comm_mode = self.FILE_NUMBERS[tuple(file_id)], self.comm_modes[tuple(file_id)]
+        data = []
+        while len(data) < length:
+            chunk = min(length - len(data), self.NATIVE_MAX_DATA)
+            data.extend(self.auth.read_data(file_no, offset + len(data), chunk, comm_mode))
+        return data
+
+    def _write_data(self, file_id, offset, data):
+        file_no, comm_mode = self.FILE_NUMBERS[tuple(file_id)], self.comm_modes[tuple(file_id)]
+        for start in range(0, len(data), self.NATIVE_MAX_DATA):
+            self.auth.write_data(file_no, offset + start, bytes(data[start:start + self.NATIVE_MAX_DATA]), comm_mode)
+        return -(-len(data) // self.NATIVE_MAX_DATA)
+
+    def write(self, file_id, offset, data):
+        """Buffer a write; it is sent on flush() (or before the next read of the same file)."""
+        self.pending_writes.setdefault(tuple(file_id), []).append((offset, bytes(data)))
+
+    def flush(self, file_id=None):
+        """Send buffered writes, merging adjacent / overlapping ranges of the same file."""
+        file_ids = list(self.pending_writes) if file_id is None else [tuple(file_id)]
+        for fid in file_ids:
+            writes = self.pending_writes.pop(fid, None)
+            if not writes:
+                continue
+            sent = sum(self.update_binary(list(fid), offset, data) for offset, data in self._merge(writes))
+            self.apdus_saved += max(0, len(writes) - sent)
+
+    @staticmethod
+    def _merge(writes):
+        """[(offset, data)] in write order -> merged non-adjacent ranges; later writes win."""
+        image = {}
+        for offset, data in writes:
+            for i, byte in enumerate(data):
+                image[offset + i] = byte
+
+        ranges = []
+        for position in sorted(image):
+            if ranges and ranges[-1][0] + len(ranges[-1][1]) == position:
+                ranges[-1][1].append(image[position])
+            else:
+                ranges.append((position, bytearray([image[position]])))
+        return ranges
+
+class NDEFFile:
+    """
+    Whole-file NDEF I/O for a Type 4 Tag NDEF file (NLEN + NDEF message).
+
+    read() fetches the 2-byte NLEN header, then the message in as few
+    maximum-size chunks as the session allows; when the file `size` is known
+    (e.g. from the CC file) NLEN comes with the first chunk instead. write()
+    compares the new message with the last one read or written and only sends
+    the byte ranges that changed; ranges separated by fewer than GAP_MERGE
+    unchanged bytes are sent together because a round trip costs more than
+    re-sending a few bytes. The update follows the Type 4 Tag procedure, so a
+    card pulled away mid-write holds an empty message rather than a torn one:
+    NLEN is set to 0 first, then the message is written, then the real NLEN.
+    """
+
+    GAP_MERGE = 8
+
+    def __init__(self, session, file_id=CardReader.NDEF_FILE, size=None):
+        self.session = session
+        self.file_id = file_id
+        self.size = size
+        self.image = None  # NLEN + message as last seen on the card
+        self.bytes_written = 0
+
+    def read(self):
+        """Read and return the NDEF message (without NLEN)."""
+        # 不知道檔案大小就只先讀 NLEN: 一次讀 max_read (extended Le) 可能超過檔案結尾
+        first = min(self.session.max_read, self.size) if self.size else 2
+        head = self.session.read_binary(self.file_id, 0, first)
+        nlen = int.from_bytes(bytes(head[:2]), "big")
+        image = bytearray(head[:2 + nlen])
+        if len(image) < 2 + nlen:
+            image.extend(self.session.read_binary(self.file_id, len(image), 2 + nlen - len(image)))
+        self.image = image
+        return bytes(image[2:])
+
+    def write(self, message):
+        """
+        Write an NDEF message, sending only what differs from the cached image.
+        Returns the (offset, bytes) writes in the order they were sent.
+        """
+        message = bytes(message)
+        nlen = len(message).to_bytes(2, "big")
+        old_image = self.image
+        if old_image is None:
+            ranges = [(2, message)] if message else []
+            old_nlen = None
+        else:
+            ranges = [(2 + offset, data) for offset, data in self.diff(old_image[2:], message)]
+            old_nlen = bytes(old_image[:2])
+            if not ranges and old_nlen == nlen:
+                return []
+
+        writes = []
+        if old_nlen != b"\x00\x00":
+            writes.append((0, b"\x00\x00"))  # 先把 NLEN 設成 0: 寫到一半被拿走也只是空的 message
+        writes.extend(ranges)
+        if message:
+            writes.append((0, nlen))
+        for offset, data in writes:
+            self.session.update_binary(self.file_id, offset, data)
+            self.bytes_written += len(data)
+        self.image = bytearray(nlen + message)
+        return writes
+
+    @classmethod
+    def diff(cls, old, new):
+        """Changed byte ranges [(offset, bytes)] needed to turn `old` into `new`."""
+        ranges = []
+        start = None
+        last_changed = None
+        for i, byte in enumerate(new):
+            if i < len(old) and old[i] == byte:
+                continue
+            if start is not None and i - last_changed - 1 < cls.GAP_MERGE:
+                last_changed = i
+                continue
+            if start is not None:
+                ranges.append((start, new[start:last_changed + 1]))
+            start = last_changed = i
+        if start is not None:
+            ranges.append((start, new[start:last_changed + 1]))
+        return ranges
+
 class CardDataManager:
-    def __init__(self):
-        pass
+    """
+    Reads and writes the prototype's card fields through a CardSession.
+
+    Once authenticate() has opened the secure session, every write_* runs inside
+    it; provision() writes all fields with a single handshake.
+    """
+
+    # Proprietary file (E105) layout, same as tests/tests.py
+    COUNTER_OFFSET = 0
+    TOKEN_ID_OFFSET = 8
+    TIMER_OFFSET = 12
     
-    def read_url():
-        pass
+    def __init__(self, session):
+        self.session = session
+        self.ndef = NDEFFile(session)
     
-    def read_token_id():
-        pass
+    def authenticate(self, aes_key=DEVELOPER_AES_KEY, key_no=0):
+        return self.session.authenticate(aes_key, key_no)
+
+    def provision(self, url, counter, token_id, timer, aes_key=DEVELOPER_AES_KEY):
+        """Write every field in one authenticated session."""
+        self.authenticate(aes_key)
+        self.write_url(url)
+        self.write_counter(counter)
+        self.write_token_id(token_id)
+        self.write_timer(timer)
+        self.session.flush()
+
+    def read_url(self):
+        return decode_uri_record(self.ndef.read())
     
-    def read_counter():
-        pass
+    def read_token_id(self):
+        return self._read_int(self.TOKEN_ID_OFFSET)
     
-    def read_timer():
-        pass
+    def read_counter(self):
+        return self._read_int(self.COUNTER_OFFSET)
     
-    def write_url():
-        pass
+    def read_timer(self):
+        return self._read_int(self.TIMER_OFFSET)
     
-    def write_token_id():
-        pass
+    def write_url(self, url):
+        """Write the URL record; only changed bytes are sent if the file was read before."""
+        self.ndef.write(encode_uri_record(url))
     
-    def write_counter():
-        pass
+    def write_token_id(self, token_id):
+        self.session.write(CardReader.PROPRIETARY_FILE, self.TOKEN_ID_OFFSET, token_id.to_bytes(4, "big"))
     
-    def write_timer():
-        pass
+    def write_counter(self, counter):
+        self.session.write(CardReader.PROPRIETARY_FILE, self.COUNTER_OFFSET, counter.to_bytes(4, "big"))
+    
+    def write_timer(self, timer):
+        self.session.write(CardReader.PROPRIETARY_FILE, self.TIMER_OFFSET, timer.to_bytes(4, "big"))
+
+    def _read_int(self, offset):
+        return int.from_bytes(bytes(self.session.read_binary(CardReader.PROPRIETARY_FILE, offset, 4)), "big")
     
     
 def main():
     # step 1: create connection to NFC card by the reader
-    connection = CardReader.connect()
-    
-    # step 2 (optional for now): authenticate as developer
-    # customer can only read the data and no permission to change data
-    Authentication.authenticate()
-    
-    # step 3: select NDEF file (the file stores url, counter, etc..)
-    
-    
+    card_reader = CardReader()
+    card_reader.connect()
+    session = CardSession(card_reader)
+    manager = CardDataManager(session)
+
+    try:
+        # step 2: authenticate as developer (once; every write below reuses the session)
+        # customer can only read the data and no permission to change data
+        manager.authenticate(DEVELOPER_AES_KEY)
+
+        # step 3: read the NDEF file and the proprietary file (url, counter, etc..)
+        print(f"URL: {manager.read_url()}")
+        print(f"Counter: {manager.read_counter()}, Token ID: {manager.read_token_id()}, Timer: {manager.read_timer()}")
+        print(f"SDM read counter: {session.auth.get_file_counters()}")
+    finally:
+        card_reader.disconnect()
+
 
 if __name__ == "__main__":
     main()
-    
-    
\ No newline at end of file
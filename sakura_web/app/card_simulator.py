@@ -0,0 +1,518 @@
+import os
+import threading
+import time
+from collections import deque
+
+from ntag424_crypto import (cbc_decrypt, cbc_encrypt, command_iv, command_mac, derive_session_keys, pad,
+                            response_iv, response_mac, rotate_left, unpad)
+
+try:
+    from smartcard.Exceptions import CardConnectionException, NoCardException
+    from smartcard.util import toHexString
+except ImportError:
+    # 沒裝 pyscard (例如 CI) 也能跑模擬器; card_reader_manager 等模組也改用這裡的定義
+    class CardConnectionException(Exception):
+        pass
+
+    class NoCardException(Exception):
+        pass
+
+    def toHexString(data):
+        """Same output as smartcard.util.toHexString: "00 A4 04 00"."""
+        return " ".join(f"{byte:02X}" for byte in data)
+
+NDEF_APPLICATION = bytes([0xD2, 0x76, 0x00, 0x00, 0x85, 0x01, 0x01])
+
+# ISO file ID -> (native file number, size in bytes)
+FILES = {
+    0xE103: (0x01, 32),   # Capability Container
+    0xE104: (0x02, 256),  # NDEF file
+    0xE105: (0x03, 128),  # Proprietary file
+}
+
+# Communication modes (factory file settings: CC / NDEF plain, proprietary file full)
+COMM_PLAIN = 0x00
+COMM_MAC = 0x01
+COMM_FULL = 0x03
+FILE_COMM_MODES = {0xE103: COMM_PLAIN, 0xE104: COMM_PLAIN, 0xE105: COMM_FULL}
+
+# Capability Container of a factory NTAG 424 DNA (NDEF file E104, 256 bytes, free read/write)
+DEFAULT_CC = bytes.fromhex("001720007F007F0406E104010000000406E10500808283").ljust(32, b"\x00")
+
+# Status words
+SW_OK = (0x90, 0x00)
+SW_WRONG_LENGTH = (0x67, 0x00)
+SW_FILE_NOT_FOUND = (0x6A, 0x82)
+SW_WRONG_OFFSET = (0x6B, 0x00)
+SW_INS_NOT_SUPPORTED = (0x6D, 0x00)
+SW_CLA_NOT_SUPPORTED = (0x6E, 0x00)
+SW_NO_FILE_SELECTED = (0x69, 0x86)
+
+OPERATION_OK = (0x91, 0x00)
+ILLEGAL_COMMAND_CODE = (0x91, 0x1C)
+INTEGRITY_ERROR = (0x91, 0x1E)
+NO_SUCH_KEY = (0x91, 0x40)
+LENGTH_ERROR = (0x91, 0x7E)
+PERMISSION_DENIED = (0x91, 0x9D)
+PARAMETER_ERROR = (0x91, 0x9E)
+AUTHENTICATION_DELAY = (0x91, 0xAD)
+AUTHENTICATION_ERROR = (0x91, 0xAE)
+ADDITIONAL_FRAME = (0x91, 0xAF)
+BOUNDARY_ERROR = (0x91, 0xBE)
+COMMAND_ABORTED = (0x91, 0xCA)
+FILE_NOT_FOUND = (0x91, 0xF0)
+
+# 連續驗證失敗幾次之後開始回 AUTHENTICATION_DELAY
+AUTH_FAILURES_BEFORE_DELAY = 3
+AUTH_DELAY_RESPONSES = 2
+
+APDU_LOG_SIZE = 1000  # SimulatedReader.log 保留最近幾個 APDU
+
+
+class SimulatedNTAG424:
+    """
+    Software NTAG 424 DNA.
+
+    Emulates what the prototype talks to: ISO SELECT of the NDEF application and
+    the E103/E104/E105 files, ISO ReadBinary / UpdateBinary (short and extended
+    length), AuthenticateEV2First / NonFirst, native ReadData / WriteData /
+    GetFileCounters with EV2 secure messaging (Plain / MAC / Full, per-file
+    `comm_modes`), GetVersion (ADDITIONAL_FRAME chaining), the SDM read counter,
+    and the 0x91xx status words of CardErrorHandler.ERROR_CODES. Status words
+    and RF loss can be injected to exercise error handling. ISO commands do not
+    check access rights.
+    """
+
+    def __init__(self, uid=None, keys=None, ndef_file_size=None):
+        self.uid = uid if uid is not None else bytes([0x04]) + os.urandom(6)
+        self.keys = list(keys) if keys is not None else [bytes(16)] * 5
+        self.files = {file_id: bytearray(size) for file_id, (_, size) in FILES.items()}
+        if ndef_file_size:
+            # 模擬較大的 NDEF 檔 (測試 extended-length APDU)
+            self.files[0xE104] = bytearray(ndef_file_size)
+        self.files[0xE103][:] = DEFAULT_CC
+        self.comm_modes = dict(FILE_COMM_MODES)
+        self.sdm_read_ctr = 0
+        self.lock = threading.Lock()
+
+        self._injected = []         # [(sw, remaining count)]
+        self._rf_loss = 0
+        self._auth_failures = 0
+        self._auth_delay = 0
+        self.reset()
+
+    ########## Field / session state ##########
+
+    def reset(self):
+        """Card leaves the field: selection and authentication are lost."""
+        self.application_selected = False
+        self.selected_file = None
+        self.pending = None         # 多段指令 (auth / GetVersion) 的下一步
+        self.session = None         # 驗證成功後的 {key_no, enc_key, mac_key, ti, cmd_ctr}
+
+    def tap(self):
+        """A new field activation: resets session state and advances the SDM read counter."""
+        with self.lock:
+            self.reset()
+            self.sdm_read_ctr = (self.sdm_read_ctr + 1) & 0xFFFFFF
+
+    def inject_status(self, sw, count=1):
+        """Answer the next `count` native commands with status word `sw` (e.g. 0x91AD)."""
+        self._injected.append(((sw >> 8, sw & 0xFF), count))
+
+    def inject_rf_loss(self, count=1):
+        """Drop the RF link for the next `count` APDUs."""
+        self._rf_loss += count
+
+    ########## APDU dispatch ##########
+
+    def process(self, apdu):
+        """Process one APDU; returns (data, sw1, sw2) like pyscard's transmit."""
+        with self.lock:
+            if self._rf_loss:
+                self._rf_loss -= 1
+                self.reset()
+                raise CardConnectionException("RF link lost")
+
+            apdu = bytes(apdu)
+            if len(apdu) < 4:
+                return self._reply(b"", SW_WRONG_LENGTH)
+
+            cla, ins = apdu[0], apdu[1]
+            if cla == 0x90:
+                if self._injected:
+                    sw, count = self._injected[0]
+                    self._injected[0] = (sw, count - 1)
+                    if count <= 1:
+                        self._injected.pop(0)
+                    self.pending = None
+                    return self._reply(b"", sw)
+                return self._native(ins, apdu)
+            if cla == 0x00:
+                return self._iso(ins, apdu)
+            if cla == 0xFF and ins == 0xCA:
+                return self._reply(self.uid, SW_OK)
+            return self._reply(b"", SW_CLA_NOT_SUPPORTED)
+
+    @staticmethod
+    def _reply(data, sw):
+        return list(data), sw[0], sw[1]
+
+    ########## ISO 7816-4 commands ##########
+
+    @staticmethod
+    def _parse_iso(apdu):
+        """Split body into (data, le), handling short and extended Lc / Le."""
+        body = apdu[4:]
+        if not body:
+            return b"", 0
+        if body[0] == 0x00 and len(body) >= 3:
+            # Extended length
+            if len(body) == 3:
+                return b"", int.from_bytes(body[1:3], "big") or 65536
+            lc = int.from_bytes(body[1:3], "big")
+            rest = body[3:3 + lc]
+            le_bytes = body[3 + lc:]
+            return rest, int.from_bytes(le_bytes, "big") if le_bytes else 0
+        if len(body) == 1:
+            return b"", body[0] or 256
+        lc = body[0]
+        rest = body[1:1 + lc]
+        le_bytes = body[1 + lc:]
+        return rest, (le_bytes[0] or 256) if le_bytes else 0
+
+    def _iso(self, ins, apdu):
+        self.pending = None
+        p1, p2 = apdu[2], apdu[3]
+        data, le = self._parse_iso(apdu)
+
+        if ins == 0xA4:  # SELECT
+            if p1 == 0x04:
+                if data != NDEF_APPLICATION:
+                    return self._reply(b"", SW_FILE_NOT_FOUND)
+                self.application_selected = True
+                self.selected_file = None
+                self.session = None  # 選擇 application 會清掉驗證狀態
+                return self._reply(b"", SW_OK)
+            if p1 == 0x00 and len(data) == 2:
+                file_id = int.from_bytes(data, "big")
+                if file_id not in self.files:
+                    return self._reply(b"", SW_FILE_NOT_FOUND)
+                self.selected_file = file_id
+                return self._reply(b"", SW_OK)
+            return self._reply(b"", SW_FILE_NOT_FOUND)
+
+        if ins in (0xB0, 0xD6):
+            if self.selected_file is None:
+                return self._reply(b"", SW_NO_FILE_SELECTED)
+            content = self.files[self.selected_file]
+            offset = (p1 << 8) | p2
+            if offset >= len(content):
+                return self._reply(b"", SW_WRONG_OFFSET)
+
+            if ins == 0xB0:  # ReadBinary
+                return self._reply(content[offset:offset + le], SW_OK)
+
+            # UpdateBinary
+            if offset + len(data) > len(content):
+                return self._reply(b"", SW_WRONG_OFFSET)
+            content[offset:offset + len(data)] = data
+            return self._reply(b"", SW_OK)
+
+        return self._reply(b"", SW_INS_NOT_SUPPORTED)
+
+    ########## Native (0x90 wrapped) commands ##########
+
+    def _native(self, ins, apdu):
+        if len(apdu) < 5:
+            return self._reply(b"", LENGTH_ERROR)
+        data = apdu[5:5 + apdu[4]]
+
+        if ins == 0xAF:
+            return self._additional_frame(data)
+        if self.pending is not None:
+            # 上一個多段指令還沒做完就送新的指令
+            self.pending = None
+            if ins not in (0x71, 0x77):
+                return self._reply(b"", COMMAND_ABORTED)
+
+        if ins in (0x71, 0x77):
+            return self._authenticate_part1(ins, data)
+        if ins == 0x60:
+            return self._get_version()
+        if ins == 0x8D:
+            return self._write_data(data)
+        if ins == 0xAD:
+            return self._read_data(data)
+        if ins == 0xF6:
+            return self._get_file_counters(data)
+        return self._reply(b"", ILLEGAL_COMMAND_CODE)
+
+    def _additional_frame(self, data):
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return self._reply(b"", ILLEGAL_COMMAND_CODE)
+        return pending(data)
+
+    def _authenticate_part1(self, ins, data):
+        first = ins == 0x71
+        if len(data) < (2 if first else 1):
+            return self._reply(b"", LENGTH_ERROR)
+        if not first and self.session is None:
+            return self._reply(b"", AUTHENTICATION_ERROR)
+        key_no = data[0]
+        if key_no >= len(self.keys):
+            return self._reply(b"", NO_SUCH_KEY)
+        if self._auth_delay:
+            self._auth_delay -= 1
+            return self._reply(b"", AUTHENTICATION_DELAY)
+
+        key = self.keys[key_no]
+        rnd_b = os.urandom(16)
+        self.session = None if first else self.session
+
+        def part2(frame):
+            if len(frame) != 32:
+                return self._reply(b"", LENGTH_ERROR)
+            plain = cbc_decrypt(key, frame)
+            rnd_a, rnd_b_rotated = plain[:16], plain[16:]
+            if rnd_b_rotated != rotate_left(rnd_b):
+                self.session = None
+                self._auth_failures += 1
+                if self._auth_failures >= AUTH_FAILURES_BEFORE_DELAY:
+                    self._auth_delay = AUTH_DELAY_RESPONSES
+                return self._reply(b"", AUTHENTICATION_ERROR)
+
+            self._auth_failures = 0
+            enc_key, mac_key = derive_session_keys(key, rnd_a, rnd_b)
+            if first:
+                ti = os.urandom(4)
+                self.session = {"key_no": key_no, "enc_key": enc_key, "mac_key": mac_key,
+                                "ti": ti, "cmd_ctr": 0}
+                response = ti + rotate_left(rnd_a) + bytes(6) + bytes(6)
+            else:
+                # NonFirst: TI 與 command counter 沿用
+                self.session.update(key_no=key_no, enc_key=enc_key, mac_key=mac_key)
+                response = rotate_left(rnd_a)
+            return self._reply(cbc_encrypt(key, response), OPERATION_OK)
+
+        self.pending = part2
+        return self._reply(cbc_encrypt(key, rnd_b), ADDITIONAL_FRAME)
+
+    def _get_version(self):
+        hardware = bytes([0x04, 0x04, 0x02, 0x30, 0x00, 0x11, 0x05])
+        software = bytes([0x04, 0x04, 0x02, 0x01, 0x02, 0x11, 0x05])
+        production = self.uid + bytes([0x00] * 5) + bytes([0x21, 0x25])
+
+        def last_part(_):
+            return self._reply(production, OPERATION_OK)
+
+        def second_part(_):
+            self.pending = last_part
+            return self._reply(software, ADDITIONAL_FRAME)
+
+        self.pending = second_part
+        return self._reply(hardware, ADDITIONAL_FRAME)
+
+    def _get_file_counters(self, data):
+        # GetFileCounters 固定是 Full mode
+        if self.session is None:
+            return self._reply(b"", AUTHENTICATION_ERROR)
+        command = self._unwrap(0xF6, data, 1, COMM_FULL)
+        if command is None:
+            return self._reply(b"", INTEGRITY_ERROR)
+        header, _ = command
+        if header[0] != FILES[0xE104][0]:
+            return self._reply(b"", FILE_NOT_FOUND)
+        counters = self.sdm_read_ctr.to_bytes(3, "little") + bytes(2)
+        return self._reply(self._wrap(counters, COMM_FULL), OPERATION_OK)
+
+    ########## Secure messaging ##########
+
+    def _file_by_number(self, file_no):
+        for file_id, (number, _) in FILES.items():
+            if number == file_no:
+                return file_id
+        return None
+
+    def _file_command(self, ins, data):
+        """Common part of ReadData / WriteData: (file_id, comm mode, offset, length, body) or an error status."""
+        if len(data) < 7:
+            return LENGTH_ERROR
+        file_id = self._file_by_number(data[0])
+        if file_id is None:
+            return FILE_NOT_FOUND
+        comm_mode = self.comm_modes[file_id]
+        if comm_mode != COMM_PLAIN and self.session is None:
+            return AUTHENTICATION_ERROR
+        command = self._unwrap(ins, data, 7, comm_mode)
+        if command is None:
+            return INTEGRITY_ERROR
+        header, body = command
+        offset = int.from_bytes(header[1:4], "little")
+        length = int.from_bytes(header[4:7], "little")
+        return file_id, comm_mode, offset, length, body
+
+    def _write_data(self, data):
+        command = self._file_command(0x8D, data)
+        if len(command) == 2:
+            return self._reply(b"", command)
+        file_id, comm_mode, offset, length, body = command
+        content = self.files[file_id]
+        if length != len(body):
+            return self._reply(b"", LENGTH_ERROR)
+        if offset + length > len(content):
+            return self._reply(b"", BOUNDARY_ERROR)
+        content[offset:offset + length] = body
+        return self._reply(self._wrap(b"", comm_mode), OPERATION_OK)
+
+    def _read_data(self, data):
+        command = self._file_command(0xAD, data)
+        if len(command) == 2:
+            return self._reply(b"", command)
+        file_id, comm_mode, offset, length, _ = command
+        content = self.files[file_id]
+        if length == 0:
+            length = len(content) - offset  # 0 = 讀到檔案結尾
+        if offset + length > len(content):
+            return self._reply(b"", BOUNDARY_ERROR)
+        return self._reply(self._wrap(bytes(content[offset:offset + length]), comm_mode), OPERATION_OK)
+
+    def _unwrap(self, ins, data, header_length, comm_mode):
+        """
+        Verify (MAC / Full) and decrypt (Full) a command; returns (header, data),
+        or None on an integrity error, which also ends the session.
+        """
+        if comm_mode == COMM_PLAIN:
+            return data[:header_length], data[header_length:]
+
+        session = self.session
+        payload, mac = data[:-8], data[-8:]
+        if (len(payload) < header_length
+                or mac != command_mac(session["mac_key"], ins, session["cmd_ctr"], session["ti"], payload)):
+            self.session = None
+            return None
+        header, body = payload[:header_length], payload[header_length:]
+        if comm_mode == COMM_FULL and body:
+            iv = command_iv(session["enc_key"], session["ti"], session["cmd_ctr"])
+            try:
+                if len(body) % 16:
+                    raise ValueError("Not a whole number of blocks")
+                body = unpad(cbc_decrypt(session["enc_key"], body, iv))
+            except ValueError:
+                self.session = None
+                return None
+        return header, body
+
+    def _wrap(self, data, comm_mode):
+        """Advance the command counter and protect the response data per `comm_mode`."""
+        session = self.session
+        if session is None:
+            return data
+        session["cmd_ctr"] = (session["cmd_ctr"] + 1) & 0xFFFF
+        if comm_mode == COMM_PLAIN:
+            return data
+        if comm_mode == COMM_FULL and data:
+            iv = response_iv(session["enc_key"], session["ti"], session["cmd_ctr"])
+            data = cbc_encrypt(session["enc_key"], pad(data), iv)
+        return data + response_mac(session["mac_key"], 0x00, session["cmd_ctr"], session["ti"], data)
+
+
+class SimulatedConnection:
+    """Stand-in for a pyscard CardConnection."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.card = None
+
+    def connect(self, *args, **kwargs):
+        if self.reader.card is None:
+            raise NoCardException("No card in reader")
+        self.card = self.reader.card
+
+    def disconnect(self):
+        self.card = None
+
+    def getATR(self):
+        return [0x3B, 0x81, 0x80, 0x01, 0x80, 0x80]
+
+    def transmit(self, apdu, protocol=None):
+        card = self.card
+        if card is None or card is not self.reader.card:
+            raise CardConnectionException("Card removed")
+        if self.reader.latency:
+            time.sleep(self.reader.latency)
+        self.reader.apdu_count += 1
+        self.reader.log.append(list(apdu))
+        return card.process(apdu)
+
+
+class SimulatedReader:
+    """
+    Stand-in for a pyscard reader; `latency` is added to every APDU round trip
+    (seconds) and the most recent APDUs are kept in `log`.
+    """
+
+    def __init__(self, name="Simulated ACR122U", card=None, latency=0.0):
+        self.name = name
+        self.card = None
+        self.latency = latency
+        self.apdu_count = 0
+        self.log = deque(maxlen=APDU_LOG_SIZE)
+        if card is not None:
+            self.insert(card)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"SimulatedReader({self.name!r})"
+
+    def createConnection(self):
+        return SimulatedConnection(self)
+
+    def insert(self, card):
+        """Bring a card into the field."""
+        card.tap()
+        self.card = card
+
+    def remove(self):
+        """Take the card out of the field."""
+        if self.card is not None:
+            self.card.reset()
+        self.card = None
+
+
+########## Drop-in replacement for smartcard.System.readers ##########
+
+_readers = []
+
+
+def readers():
+    """Same signature as smartcard.System.readers, returning the simulated readers."""
+    return list(_readers)
+
+
+def add_reader(name=None, card=None, latency=0.0):
+    reader = SimulatedReader(name or f"Simulated ACR122U {len(_readers):02d}", card, latency)
+    _readers.append(reader)
+    return reader
+
+
+def remove_reader(reader):
+    _readers.remove(reader)
+
+
+def install(*modules):
+    """
+    Point `readers` in the given modules (e.g. card_reader_manager, provisioning_station)
+    at the simulator. Returns a function that restores the originals.
+    """
+    originals = [(module, module.readers) for module in modules]
+    for module in modules:
+        module.readers = readers
+
+    def restore():
+        for module, original in originals:
+            module.readers = original
+    return restore
@@ -0,0 +1,203 @@
+import re
+
+import numpy as np
+
+from app_helpers import URI_PREFIXES, build_ndef_file
+
+# {name} 或 {name:format spec}；spec 必須是固定寬度 (例如 08d, 014X)
+PLACEHOLDER = re.compile(r"\{(\w+)(?::([^}]*))?\}")
+FIXED_WIDTH_SPEC = re.compile(r"^0(\d+)([dxX])$")
+
+# 沒寫 spec 時的預設格式，和卡片的 SDM mirroring 及 prototype 的 SDM URL 一致
+# (uid 14 位大寫 hex, ctr 6 位大寫 hex, enc 16 位大寫 hex)
+DEFAULT_SPECS = {
+    "num": "08d",
+    "uid": "014X",
+    "ctr": "06X",
+    "enc": "016X",
+}
+
+# 卡片自己做 SDM mirroring 時寫進 NDEF 檔的格式 (NTAG 424 DNA, ASCII encoding)
+SDM_MIRROR_SPECS = {"uid": "014X", "ctr": "06X", "enc": "016X"}
+
+# ChangeFileSettings
+FILE_OPTION_SDM = 0x40              # SDM and mirroring enabled
+SDM_OPTION_UID = 0x80               # UID mirroring
+SDM_OPTION_READ_CTR = 0x40          # SDMReadCtr mirroring
+SDM_OPTION_ASCII = 0x01             # ASCII encoding of the mirrored data
+ACCESS_FREE = 0xE
+ACCESS_NONE = 0xF
+NDEF_FILE_NO = 0x02
+
+
+class NDEFTemplate:
+    """
+    NDEF file (NLEN + one URI record) compiled once from a URL template such as
+    "https://nfc.sakurahighschool.com/a/{num}?uid={uid}&ctr={ctr}&enc={enc}".
+
+    Every placeholder has a fixed width (see DEFAULT_SPECS), so the record
+    lengths never change and a card's file is produced by patching its fields
+    in place through a memoryview instead of re-encoding the URL. The field
+    offsets are also what ChangeFileSettings needs to make the card mirror
+    UID / SDMReadCtr / MAC into the file itself (sdm_offsets()).
+    """
+
+    def __init__(self, url_template, specs=None):
+        self.url_template = url_template
+        self.fields = {}  # name -> [(offset in file, width, spec)]
+
+        # 先把 placeholder 換成同寬度的 0 編碼一次，再算出每個欄位在檔案裡的 byte offset
+        pieces, slots, position = [], [], 0
+        for match in PLACEHOLDER.finditer(url_template):
+            name, spec = match.group(1), match.group(2)
+            spec = spec or (specs or {}).get(name) or DEFAULT_SPECS.get(name)
+            fixed = FIXED_WIDTH_SPEC.match(spec or "")
+            if not fixed:
+                raise ValueError(f"Placeholder {{{name}}} needs a fixed-width spec like 08d or 014X, got {spec!r}")
+            width = int(fixed.group(1))
+            pieces.append(url_template[position:match.start()])
+            slots.append((name, len("".join(pieces).encode()), width, spec))
+            pieces.append("0" * width)
+            position = match.end()
+        pieces.append(url_template[position:])
+        url = "".join(pieces)
+
+        self.image = bytearray(build_ndef_file(url))
+        self._view = memoryview(self.image)
+        # URI record 的 payload 在檔案最後: identifier code 之後是去掉 prefix 的 URL
+        prefix = next((prefix for _, prefix in URI_PREFIXES if url.startswith(prefix)), "")
+        base = len(self.image) - len(url.encode())
+        for name, url_offset, width, spec in slots:
+            offset = base + url_offset
+            if url_offset < len(prefix):
+                raise ValueError(f"Placeholder {{{name}}} cannot be inside the URI prefix {prefix!r}")
+            self.fields.setdefault(name, []).append((offset, width, spec))
+
+    def __len__(self):
+        return len(self.image)
+
+    @property
+    def message(self):
+        """The NDEF message without NLEN (a view of the current image)."""
+        return self._view[2:]
+
+    def patch(self, **values):
+        """
+        Write field values into the image in place and return a view of it
+        (valid until the next patch). Values are ints (formatted with the
+        field's spec), bytes (hex) or strings of exactly the field width.
+        """
+        view = self._view
+        for name, value in values.items():
+            slots = self.fields.get(name)
+            if slots is None:
+                raise KeyError(f"Template has no {{{name}}} field")
+            for offset, width, spec in slots:
+                view[offset:offset + width] = _encode_field(name, value, width, spec)
+        return view
+
+    def render(self, **values):
+        """patch() and return a copy of the file image."""
+        return bytes(self.patch(**values))
+
+    def render_many(self, **columns):
+        """
+        Files for a batch of cards as an (n, len) uint8 numpy array, one row
+        per card: the image is copied n times and each field is written as a
+        whole column. Columns are sequences of the values patch() accepts
+        (ints in decimal fields are converted digit by digit, without
+        formatting each value); every column must have the same length.
+        """
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError("render_many() needs columns of one common length")
+        count = lengths.pop()
+        files = np.tile(np.frombuffer(self.image, dtype=np.uint8), (count, 1))
+        for name, column in columns.items():
+            slots = self.fields.get(name)
+            if slots is None:
+                raise KeyError(f"Template has no {{{name}}} field")
+            for offset, width, spec in slots:
+                files[:, offset:offset + width] = _encode_column(name, column, width, spec)
+        return files
+
+    def offset(self, name):
+        """Offset of the (first) field `name` in the NDEF file."""
+        return self.fields[name][0][0]
+
+    def sdm_offsets(self):
+        """
+        UIDOffset / SDMReadCtrOffset / SDMMACInputOffset / SDMMACOffset for
+        ChangeFileSettings, relative to the start of the NDEF file (NLEN
+        included). The MAC is computed over no file data (input offset = MAC
+        offset), as in the prototype's SDMMAC. The fields must have the widths
+        the card mirrors (SDM_MIRROR_SPECS, e.g. specs=SDM_MIRROR_SPECS).
+        """
+        for name, spec in SDM_MIRROR_SPECS.items():
+            if name in self.fields and self.fields[name][0][1] != int(FIXED_WIDTH_SPEC.match(spec).group(1)):
+                raise ValueError(f"{{{name}}} must be {spec} wide for the card to mirror it")
+        offsets = {}
+        if "uid" in self.fields:
+            offsets["uid_offset"] = self.offset("uid")
+        if "ctr" in self.fields:
+            offsets["ctr_offset"] = self.offset("ctr")
+        if "enc" in self.fields:
+            offsets["mac_input_offset"] = offsets["mac_offset"] = self.offset("enc")
+        return offsets
+
+    def change_file_settings(self, file_no=NDEF_FILE_NO, comm_mode=0x00, access_rights=bytes([0x00, 0xE0]),
+                             ctr_ret_key=ACCESS_NONE, file_read_key=0x1):
+        """
+        Command data for ChangeFileSettings (0x5F) that enables SDM with plain
+        UID / SDMReadCtr mirroring (SDMMetaRead = free) and the SDMMAC at this
+        template's offsets: FileNo, FileOption, AccessRights, SDMOptions,
+        SDMAccessRights, then the 3-byte little-endian offsets.
+        """
+        offsets = self.sdm_offsets()
+        options = SDM_OPTION_ASCII
+        if "uid_offset" in offsets:
+            options |= SDM_OPTION_UID
+        if "ctr_offset" in offsets:
+            options |= SDM_OPTION_READ_CTR
+        data = bytearray([file_no, FILE_OPTION_SDM | comm_mode])
+        data += access_rights
+        data.append(options)
+        # SDMAccessRights: RFU | SDMCtrRet, SDMMetaRead | SDMFileRead
+        data += bytes([(0xF << 4) | ctr_ret_key, (ACCESS_FREE << 4) | file_read_key])
+        for name in ("uid_offset", "ctr_offset"):
+            if name in offsets:
+                data += offsets[name].to_bytes(3, "little")
+        if "mac_offset" in offsets and file_read_key != ACCESS_NONE:
+            data += offsets["mac_input_offset"].to_bytes(3, "little")
+            data += offsets["mac_offset"].to_bytes(3, "little")
+        return bytes(data)
+
+
+def _encode_field(name, value, width, spec):
+    if isinstance(value, int):
+        text = format(value, spec).encode()
+    elif isinstance(value, (bytes, bytearray)):
+        text = value.hex().encode()
+        text = text.upper() if spec.endswith("X") else text
+    else:
+        text = value.encode()
+    if len(text) != width:
+        raise ValueError(f"{{{name}}} value {value!r} does not fit in {width} characters")
+    return text
+
+
+def _encode_column(name, column, width, spec):
+    """A column of field values as an (n, width) uint8 array of ASCII characters."""
+    if spec.endswith("d") and all(value.__class__ is int for value in column):
+        values = np.asarray(column, dtype=np.uint64)
+        if len(values) and (values >= np.uint64(10) ** np.uint64(width)).any():
+            raise ValueError(f"{{{name}}} has values that do not fit in {width} digits")
+        powers = np.uint64(10) ** np.arange(width - 1, -1, -1, dtype=np.uint64)
+        return (values[:, None] // powers % np.uint64(10)).astype(np.uint8) + ord("0")
+    if all(value.__class__ is str for value in column):
+        text = "".join(column).encode()
+        if len(text) != width * len(column):
+            raise ValueError(f"{{{name}}} has values that are not {width} ASCII characters")
+    else:
+        text = b"".join(_encode_field(name, value, width, spec) for value in column)
+    return np.frombuffer(text, dtype=np.uint8).reshape(len(column), width)
@@ -0,0 +1,68 @@
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+
+# NTAG 424 DNA (NT4H2421Gx) AES secure-messaging primitives, shared by the
+# reader side (card_reader_manager) and the card simulator.
+
+ZERO_IV = bytes(16)
+
+
+def cbc_encrypt(key, data, iv=ZERO_IV):
+    return AES.new(key, AES.MODE_CBC, iv=iv).encrypt(data)
+
+
+def cbc_decrypt(key, data, iv=ZERO_IV):
+    return AES.new(key, AES.MODE_CBC, iv=iv).decrypt(data)
+
+
+def cmac(key, data):
+    return CMAC.new(key, msg=data, ciphermod=AES).digest()
+
+
+def truncate_mac(mac):
+    """MACt: the odd-indexed bytes of the 16-byte CMAC."""
+    return mac[1::2]
+
+
+def rotate_left(data):
+    return data[1:] + data[:1]
+
+
+def pad(data):
+    """ISO/IEC 9797-1 padding method 2 (always adds 0x80)."""
+    data = bytes(data) + b"\x80"
+    return data + bytes(-len(data) % 16)
+
+
+def unpad(data):
+    data = bytes(data).rstrip(b"\x00")
+    if not data.endswith(b"\x80"):
+        raise ValueError("Invalid padding")
+    return data[:-1]
+
+
+def derive_session_keys(key, rnd_a, rnd_b):
+    """SesAuthENCKey / SesAuthMACKey of an EV2 authentication (NT4H2421Gx 9.1.7)."""
+    context = (rnd_a[0:2] + bytes(a ^ b for a, b in zip(rnd_a[2:8], rnd_b[0:6]))
+               + rnd_b[6:16] + rnd_a[8:16])
+    enc_key = cmac(key, bytes([0xA5, 0x5A, 0x00, 0x01, 0x00, 0x80]) + context)
+    mac_key = cmac(key, bytes([0x5A, 0xA5, 0x00, 0x01, 0x00, 0x80]) + context)
+    return enc_key, mac_key
+
+
+def command_iv(enc_key, ti, cmd_ctr):
+    return cbc_encrypt(enc_key, bytes([0xA5, 0x5A]) + ti + cmd_ctr.to_bytes(2, "little") + bytes(8))
+
+
+def response_iv(enc_key, ti, cmd_ctr):
+    return cbc_encrypt(enc_key, bytes([0x5A, 0xA5]) + ti + cmd_ctr.to_bytes(2, "little") + bytes(8))
+
+
+def command_mac(mac_key, cmd, cmd_ctr, ti, payload):
+    """MACt over Cmd || CmdCtr || TI || CmdHeader || CmdData."""
+    return truncate_mac(cmac(mac_key, bytes([cmd]) + cmd_ctr.to_bytes(2, "little") + ti + bytes(payload)))
+
+
+def response_mac(mac_key, return_code, cmd_ctr, ti, payload):
+    """MACt over RC || CmdCtr || TI || RespData (CmdCtr already incremented)."""
+    return truncate_mac(cmac(mac_key, bytes([return_code]) + cmd_ctr.to_bytes(2, "little") + ti + bytes(payload)))
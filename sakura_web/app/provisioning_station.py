@@ -0,0 +1,243 @@
+import argparse
+import queue
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+try:
+    from smartcard.System import readers
+except ImportError:
+    from card_simulator import readers  # 沒裝 pyscard: 只有模擬的 reader
+
+import uid_registry
+from app_helpers import encode_uri_record, generate_url
+from card_reader_manager import CardReader, CardSession, NDEFFile, RetryPolicy
+import metrics  # card_reader_manager 已把 prototype 加進 sys.path
+
+# 一個 job = 預先分配好的流水號 + URL；URL 裡的 {uid} 在寫卡時才填入
+Assignment = namedtuple("Assignment", ["number", "url"])
+
+READER_POLL_INTERVAL = 1.0  # 多久檢查一次 PC/SC reader 清單 (hot-plug)
+CARD_POLL_INTERVAL = 0.05   # 等待卡片靠近 / 移開的輪詢間隔
+RATE_WINDOW = 60.0          # cards-per-minute 的滑動視窗 (秒)
+
+
+def generate_assignments(start_number, count):
+    """Pre-generate `count` consecutive assignments starting at `start_number`."""
+    for number in range(start_number, start_number + count):
+        yield Assignment(number, generate_url(number, "{uid}"))
+
+
+class ReaderStats:
+    """Per-reader provisioning counters with a sliding cards-per-minute window."""
+
+    def __init__(self):
+        self.written = 0
+        self.failed = 0
+        self.retries = Counter()  # 暫時性錯誤的重試次數 (AUTHENTICATION_DELAY, RF_LOSS ...)
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                self.written += 1
+                self._recent.append(now)
+            else:
+                self.failed += 1
+
+    def record_retries(self, retries):
+        with self._lock:
+            self.retries.update(retries)
+
+    def cards_per_minute(self):
+        cutoff = time.monotonic() - RATE_WINDOW
+        with self._lock:
+            while self._recent and self._recent[0] < cutoff:
+                self._recent.popleft()
+            return len(self._recent) * 60.0 / RATE_WINDOW
+
+
+class ReaderWorker(threading.Thread):
+    """One worker per reader: take the next job, wait for a card, write it, wait for removal."""
+
+    def __init__(self, station, reader):
+        super().__init__(name=f"reader-{reader}", daemon=True)
+        self.station = station
+        self.reader = reader
+        self.stats = ReaderStats()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set() and not self.station.stop_event.is_set():
+            card = self.wait_for_card()
+            if card is None:
+                break
+            start = time.perf_counter()
+            try:
+                self.provision(card)
+                metrics.observe("sakura_provision_seconds", time.perf_counter() - start)
+            except Exception as e:
+                self.stats.record(False)
+                print(f"[{self.reader}] 寫入失敗：{e}")
+            finally:
+                self.stats.record_retries(card.retries)
+                self.wait_for_removal(card)
+
+    def card_present(self):
+        connection = self.reader.createConnection()
+        try:
+            connection.connect()
+            connection.disconnect()
+            return True
+        except Exception:
+            return False
+
+    def wait_for_card(self):
+        """Block until a card is on this reader; returns a connected CardReader or None on stop."""
+        while not self.stop_event.is_set() and not self.station.stop_event.is_set():
+            if self.card_present():
+                card = CardReader(self.reader, self.station.retry_policy, verbose=False)
+                card.connect()
+                return card
+            time.sleep(CARD_POLL_INTERVAL)
+        return None
+
+    def wait_for_removal(self, card):
+        card.disconnect()
+        while not self.stop_event.is_set() and self.card_present():
+            time.sleep(CARD_POLL_INTERVAL)  # 卡片移開後才放下一張
+
+    def provision(self, card):
+        uid = card.get_uid()
+        number = self.station.registry.get(uid)
+        job = None
+        if number is None:
+            try:
+                job = self.station.jobs.get_nowait()
+            except queue.Empty:
+                print(f"[{self.reader}] 沒有剩餘的 job，略過 UID {uid}")
+                return
+            number = self.station.registry.bind(uid, job.number)
+            if number == job.number:
+                url = job.url.format(uid=uid)
+            else:
+                # 另一台 reader 在 get() 和 bind() 之間先登記了這張卡: job 放回 queue 留給下一張新卡
+                # (先 put 再 task_done，unfinished_tasks 不會短暫變成 0 讓 run() 以為做完了)
+                self.station.jobs.put(job)
+                self.station.jobs.task_done()
+                job = None
+                url = generate_url(number, uid)
+        else:
+            # 已經登記過的卡片: 沿用原本的流水號重新寫入，不消耗 job
+            url = generate_url(number, uid)
+
+        try:
+            # NDEFFile 依 reader 的上限分段寫入 (超過 255 bytes 的 URL 也能寫)
+            NDEFFile(CardSession(card)).write(encode_uri_record(url))
+        finally:
+            if job is not None:
+                # 寫完 (或失敗) 才算做完，run() 不會在寫卡途中關掉 registry
+                self.station.jobs.task_done()
+        self.stats.record(True)
+        print(f"[{self.reader}] 編號 {number} -> UID {uid}")
+
+
+class ProvisioningStation:
+    """
+    Multi-reader provisioning bench.
+
+    Readers are discovered (and hot-plugged) by polling the PC/SC reader list;
+    each one gets its own worker thread, and all workers share one queue of
+    pre-generated assignments, so throughput scales with the number of readers.
+    """
+
+    def __init__(self, registry, assignments, list_readers=None, retry_policy=None):
+        self.registry = registry
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.jobs = queue.Queue()
+        for assignment in assignments:
+            self.jobs.put(assignment)
+        self.list_readers = list_readers or readers
+        self.workers = {}
+        self.stop_event = threading.Event()
+
+    def refresh_readers(self):
+        """Start workers for newly attached readers and stop those that went away."""
+        attached = {str(reader): reader for reader in self.list_readers()}
+        for name, reader in attached.items():
+            if name not in self.workers or not self.workers[name].is_alive():
+                worker = ReaderWorker(self, reader)
+                self.workers[name] = worker
+                worker.start()
+                print(f"Reader attached: {name}")
+        for name in list(self.workers):
+            if name not in attached:
+                self.workers.pop(name).stop_event.set()
+                print(f"Reader removed: {name}")
+
+    def status(self):
+        """{reader name: (cards per minute, written, failed, retries)}"""
+        return {name: (worker.stats.cards_per_minute(), worker.stats.written, worker.stats.failed,
+                       sum(worker.stats.retries.values()))
+                for name, worker in self.workers.items()}
+
+    def print_status(self):
+        status = self.status()
+        total = sum(cpm for cpm, _, _, _ in status.values())
+        lines = [f"  {name}: {cpm:.1f} cards/min ({written} written, {failed} failed, {retries} retries)"
+                 for name, (cpm, written, failed, retries) in status.items()]
+        print(f"--- {len(status)} readers, {total:.1f} cards/min, {self.jobs.qsize()} jobs left ---")
+        print("\n".join(lines))
+
+    def run(self, status_interval=5.0):
+        """Run until every job is done (or Ctrl+C), printing live throughput."""
+        next_status = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self.refresh_readers()
+                if time.monotonic() >= next_status:
+                    self.print_status()
+                    next_status += status_interval
+                if self.jobs.unfinished_tasks == 0:
+                    break
+                time.sleep(READER_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            self.print_status()
+
+    def stop(self):
+        self.stop_event.set()
+        for worker in self.workers.values():
+            worker.stop_event.set()
+        for worker in self.workers.values():
+            worker.join()  # 等寫到一半的卡片寫完
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision NFC cards on every attached reader in parallel.")
+    parser.add_argument("count", type=int, help="number of cards to provision")
+    parser.add_argument("--registry", default=uid_registry.REGISTRY_FILE)
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help="dump APDU / provisioning latency here (.json or Prometheus text)")
+    args = parser.parse_args()
+
+    registry = uid_registry.UIDRegistry(args.registry)
+    assignments = generate_assignments(registry.peek_next_number(), args.count)
+    dumper = None
+    if args.metrics_file:
+        dumper = metrics.PeriodicDumper(metrics.REGISTRY, args.metrics_file)
+        dumper.start()
+    try:
+        ProvisioningStation(registry, assignments).run()
+    finally:
+        registry.close()
+        if dumper:
+            dumper.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+
+REGISTRY_FILE = "uid_registry.csv"
+
+# 一行 = "number,UID\n"；UID 是 4 / 7 / 10 bytes 的大寫 hex
+ROW_PATTERN = re.compile(rb"^(\d+),([0-9A-F]{8}|[0-9A-F]{14}|[0-9A-F]{20})\r?\n$")
+
+
+class UIDRegistry:
+    """
+    Persistent UID -> number registry with a monotonic sequence allocator.
+
+    The registry is a dict in memory and an append-only `number,uid` CSV on disk,
+    replayed on start-up. Lookups and allocations are O(1), and numbers are never
+    reused across restarts because the next number is always max(number) + 1.
+    Rows that are not a number and a 4 / 7 / 10-byte hex UID are skipped
+    (counted in `skipped`), and an unterminated last line left by a crash is
+    cut off before anything is appended.
+    """
+
+    def __init__(self, path=REGISTRY_FILE, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._numbers = {}
+        self._next_number = 1
+        self.skipped = 0
+
+        complete = 0
+        try:
+            with open(path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break  # 最後一行寫到一半 (crash)
+                    complete += len(line)
+                    match = ROW_PATTERN.match(line)
+                    if match is None:
+                        self.skipped += 1
+                        continue
+                    number, uid = int(match.group(1)), match.group(2).decode()
+                    self._numbers[uid] = number
+                    self._next_number = max(self._next_number, number + 1)
+        except FileNotFoundError:
+            pass
+
+        self._file = open(path, "a")
+        # 截掉殘缺的最後一行，下一筆才不會接在它後面
+        if self._file.tell() > complete:
+            self._file.truncate(complete)
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __contains__(self, uid):
+        return uid in self._numbers
+
+    def get(self, uid):
+        """Return the number bound to a UID, or None."""
+        return self._numbers.get(uid)
+
+    def peek_next_number(self):
+        """The number the next new UID will get."""
+        return self._next_number
+
+    def get_or_allocate(self, uid):
+        """Return (number, is_new): the UID's existing number, or a freshly allocated one."""
+        number = self._numbers.get(uid)
+        if number is not None:
+            return number, False
+
+        with self._lock:
+            number = self._numbers.get(uid)
+            if number is not None:
+                return number, False
+
+            number = self._next_number
+            self._append(number, uid)
+            self._next_number = number + 1
+            return number, True
+
+    def _append(self, number, uid):
+        self._file.write(f"{number},{uid}\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._numbers[uid] = number
+
+    def bind(self, uid, number):
+        """
+        Bind a UID to a pre-allocated number (e.g. from a provisioning job).
+        Returns the number the UID ends up with, which is its existing one if it
+        was already registered.
+        """
+        with self._lock:
+            existing = self._numbers.get(uid)
+            if existing is not None:
+                return existing
+
+            self._append(number, uid)
+            self._next_number = max(self._next_number, number + 1)
+            return number
+
+    def items(self):
+        """(number, uid) pairs in allocation order."""
+        return [(number, uid) for uid, number in self._numbers.items()]
+
+    def to_dataframe(self):
+        """Export the registry as a pandas DataFrame with Number / UID columns (reporting only)."""
+        import pandas as pd
+
+        return pd.DataFrame(self.items(), columns=['Number', 'UID'])
+
+    def close(self):
+        self._file.close()
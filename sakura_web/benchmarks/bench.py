@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import getpass
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "prototype"))
+sys.path.insert(1, os.path.join(HERE, "..", "app"))
+
+import helper
+import main
+import sdm
+import tap_log
+import uid_registry
+
+DEFAULT_SIZES = (10, 10_000, 100_000, 1_000_000)
+DEFAULT_THRESHOLD = 0.10   # compare: 中位數變慢超過 10% 算 regression
+TARGET_SAMPLE_SECONDS = 0.05
+SAMPLES = 7
+
+
+########## Measurement ##########
+
+def measure(fn, ops, samples=SAMPLES, min_number=1):
+    """
+    Time fn(i) over `ops` pre-built operations.
+
+    The number of calls per sample is calibrated so a sample takes about
+    TARGET_SAMPLE_SECONDS; returns per-call timings in microseconds.
+    """
+    start = time.perf_counter()
+    fn(0)
+    single = max(time.perf_counter() - start, 1e-7)
+    number = max(min_number, min(ops - 1, int(TARGET_SAMPLE_SECONDS / single))) if ops > 1 else 1
+
+    per_call = []
+    index = 1
+    for _ in range(samples):
+        if index + number > ops:
+            break
+        start = time.perf_counter()
+        for i in range(index, index + number):
+            fn(i)
+        per_call.append((time.perf_counter() - start) / number * 1e6)
+        index += number
+    if not per_call:
+        per_call.append(single * 1e6)
+    return {
+        "median_us": round(statistics.median(per_call), 3),
+        "min_us": round(min(per_call), 3),
+        "max_us": round(max(per_call), 3),
+        "calls": number * len(per_call),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+########## Fixtures ##########
+
+def open_database(workdir, driver):
+    helper.DATABASE = os.path.join(workdir, "database.json")
+    helper.SQLITE_DATABASE = os.path.join(workdir, "database.db")
+    helper.BINARY_DATABASE = os.path.join(workdir, "database.snap")
+    helper.DATABASE_DRIVER = driver
+    helper.close_store()
+
+
+def build_database(num_cards, num_users, rng):
+    """database.json layout: every user owns one registered card, the rest are unregistered."""
+    uids = set()
+    while len(uids) < num_cards:
+        uids.add("04" + "%012X" % rng.getrandbits(48))
+    uids = list(uids)
+    users = [{"username": f"user{i}", "password": f"pw{i}", "cards": [uids[i]]} for i in range(num_users)]
+    cards = [{"uid": uid, "counter": 0, "registered": i < num_users} for i, uid in enumerate(uids)]
+    return {"cards": cards, "users": users}, uids
+
+
+########## Benchmarks ##########
+
+def bench_size_independent(results):
+    rng = random.Random(1)
+    uids = ["04" + "%012X" % rng.getrandbits(48) for _ in range(1000)]
+    urls = [helper.format_sdm_url(i, uid, i, sdm.compute_sdm_mac(uid, i))
+            for i, uid in enumerate(uids)]
+    taps = [helper.parse_sdm_url(url)[1:] for url in urls]
+
+    results["parse_sdm_url"] = measure(lambda i: helper.parse_sdm_url(urls[i % len(urls)]), 10**6)
+    results["validate_enc"] = measure(lambda i: main.validate_enc(*taps[i % len(taps)]), 10**6)
+
+    # 回訪用戶: session token 查詢 (不跑 KDF)
+    tokens = [main.sessions.create(f"user{i}").token for i in range(1000)]
+    results["session_get"] = measure(lambda i: main.sessions.get(tokens[i % len(tokens)]), 10**6)
+    for token in tokens:
+        main.sessions.revoke(token)
+
+    # tap event log: 每個 tap 多花的時間 (buffer 滿了才寫檔)
+    with tempfile.TemporaryDirectory() as workdir:
+        log = tap_log.TapLog(os.path.join(workdir, "taps"), flush_interval=None)
+        sources = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+        results["tap_log_record"] = measure(
+            lambda i: log.record(taps[i % len(taps)][0], i, "valid", 2, sources[i % len(sources)]), 10**6)
+        log.close()
+
+
+def bench_database(results, size, driver, workdir, rng):
+    num_users = max(1, size // 10)
+    data, uids = build_database(size, num_users, rng)
+    open_database(workdir, driver)
+
+    start = time.perf_counter()
+    helper.save_database(data)
+    results[f"save_database[{driver},n={size}]"] = {"median_us": round((time.perf_counter() - start) * 1e6, 3),
+                                                    "calls": 1}
+
+    def load(_):
+        helper.load_database()
+    results[f"load_database[{driver},n={size}]"] = measure(load, 3 if size >= 100_000 else 1000, samples=3)
+
+    # 冷啟動: 開資料庫到查完第一張卡
+    def reopen(i):
+        helper.close_store()
+        open_database(workdir, driver)
+        helper.get_card(uids[i % size])
+    results[f"open_store[{driver},n={size}]"] = measure(reopen, 3 if size >= 100_000 else 100, samples=3)
+
+    # 每次 validate 都用新的 CTR (不然第二次就變成 replay)
+    ops = 200_000
+    taps = [(uids[rng.randrange(size)], i + 1) for i in range(ops)]
+    results[f"validate_uid_ctr[{driver},n={size}]"] = measure(lambda i: main.validate_uid_ctr(*taps[i]), ops)
+
+    # 已登記的卡: user{i} 擁有 uids[i]
+    owners = [(f"user{i % num_users}", uids[i % num_users]) for i in range(1000)]
+    results[f"verify_card_ownership[{driver},n={size}]"] = measure(
+        lambda i: main.verify_card_ownership(*owners[i % len(owners)]), 10**6)
+
+    bench_login_signup(results, f"{driver},n={size}", num_users)
+    helper.close_store()
+
+
+def bench_login_signup(results, label, num_users):
+    """
+    login/signup read from input()/getpass(); feed them from lists instead of a terminal.
+    Both run scrypt (the seeded plaintext passwords are rehashed on their first login).
+    """
+    credentials = [(f"user{i % num_users}", f"pw{i % num_users}") for i in range(1000)]
+    answers = []
+    original_getpass = getpass.getpass
+    main.input = lambda prompt="": answers.pop()
+    getpass.getpass = lambda prompt="": answers.pop()
+    try:
+        def login(i):
+            username, password = credentials[i % len(credentials)]
+            answers[:] = [password, username]
+            return main.login()
+        results[f"login[{label}]"] = measure(login, 10**6)
+
+        def signup(i):
+            answers[:] = [f"pw-new-{i}", f"new-user-{i}"]
+            return main.signup()
+        results[f"signup[{label}]"] = measure(signup, 100_000)
+    finally:
+        del main.input
+        getpass.getpass = original_getpass
+
+
+def bench_registry(results, size, workdir, rng):
+    """uid_registry allocation (what app.add_uid_to_dataframe does) with `size` UIDs already registered."""
+    path = os.path.join(workdir, f"uid_registry_{size}.csv")
+    with open(path, "w") as f:
+        f.writelines(f"{number},04{rng.getrandbits(48):012X}\n" for number in range(1, size + 1))
+    registry = uid_registry.UIDRegistry(path)
+    new_uids = [f"05{rng.getrandbits(48):012X}" for _ in range(100_000)]
+    results[f"registry.get_or_allocate[n={size}]"] = measure(lambda i: registry.get_or_allocate(new_uids[i]),
+                                                             len(new_uids))
+
+    try:
+        with quiet():
+            import app
+    except ImportError as e:
+        results[f"add_uid_to_dataframe[n={size}]"] = {"skipped": f"app.py not importable: {e}"}
+    else:
+        app._registry = registry
+        more_uids = [f"06{rng.getrandbits(48):012X}" for _ in range(100_000)]
+        try:
+            with quiet():
+                results[f"add_uid_to_dataframe[n={size}]"] = measure(
+                    lambda i: app.add_uid_to_dataframe(more_uids[i]), len(more_uids))
+        finally:
+            app._registry = None
+    registry.close()
+
+
+def run(sizes, drivers):
+    results = {}
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_size_independent(results)
+        for size in sizes:
+            for driver in drivers:
+                print(f"  {driver} n={size}...", file=sys.stderr)
+                bench_database(results, size, driver, workdir, rng)
+            bench_registry(results, size, workdir, rng)
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+########## Compare ##########
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """[(name, baseline µs, current µs, change)] and the names that regressed beyond `threshold`."""
+    rows = []
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name, {}).get("median_us")
+        after = result.get("median_us")
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the prototype hot paths.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run the benchmarks and write a JSON result file")
+    run_parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                            help="comma-separated database sizes (cards)")
+    run_parser.add_argument("--drivers", default="json,sqlite,binary")
+    run_parser.add_argument("--output", default="bench_results.json")
+
+    compare_parser = sub.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="relative slowdown that counts as a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = [int(size) for size in args.sizes.split(",")]
+        results = run(sizes, args.drivers.split(","))
+        with open(args.output, "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+        for name, result in results.items():
+            if "skipped" in result:
+                print(f"{name:55} skipped ({result['skipped']})")
+            else:
+                print(f"{name:55} {result['median_us']:>12.3f} µs")
+        print(f"Results written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows, regressions = compare(baseline, current, args.threshold)
+    for name, before, after, change in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:55} {before:>12.3f} -> {after:>12.3f} µs  {change:+7.1%}{flag}")
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import helper
+
+# scrypt 參數: N (CPU/記憶體成本，2 的次方), r (block size), p (平行度)
+SCRYPT_N = int(os.environ.get("SAKURA_SCRYPT_N", 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+SCHEME = "scrypt"
+
+SESSION_TTL = 30 * 60      # 閒置多久 session 失效 (秒)
+MAX_SESSIONS = 100000
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+class CredentialStore:
+    """
+    Password hashing and checking on top of the card store's user records.
+
+    The user's "password" field holds "scrypt$N$r$p$<salt>$<key>" (base64).
+    A password stored with other parameters than this instance's, or still in
+    plaintext from before hashing was introduced, is accepted once and
+    rehashed with the current parameters on that login.
+    """
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        if n < 2 or n & (n - 1):
+            raise ValueError(f"scrypt N must be a power of two: {n}")
+        self.n, self.r, self.p = n, r, p
+        self._dummy = None
+
+    def hash_password(self, password, salt=None):
+        salt = os.urandom(SALT_BYTES) if salt is None else salt
+        key = _scrypt(password, salt, self.n, self.r, self.p)
+        return f"{SCHEME}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify_password(self, password, stored):
+        """Returns (matches, needs_rehash)."""
+        scheme, _, params = stored.partition("$")
+        if scheme != SCHEME:
+            # 舊資料: 明文密碼
+            return hmac.compare_digest(password.encode(), stored.encode()), True
+        try:
+            n, r, p, salt, key = params.split("$")
+            n, r, p = int(n), int(r), int(p)
+            salt, key = base64.b64decode(salt), base64.b64decode(key)
+        except ValueError:
+            return False, False
+        matches = hmac.compare_digest(_scrypt(password, salt, n, r, p, len(key)), key)
+        return matches, (n, r, p) != (self.n, self.r, self.p)
+
+    def authenticate(self, username, password):
+        """Username if the password is right (rehashing it if needed), else None."""
+        user = helper.get_user(username)
+        if user is None:
+            # 查無此人時也跑一次 KDF，回應時間不會洩漏帳號是否存在
+            if self._dummy is None:
+                self._dummy = self.hash_password(secrets.token_hex(8))
+            self.verify_password(password, self._dummy)
+            return None
+        matches, needs_rehash = self.verify_password(password, user["password"])
+        if not matches:
+            return None
+        if needs_rehash:
+            helper.set_user_password(username, self.hash_password(password))
+        return username
+
+    def create_user(self, username, password):
+        helper.add_user(username, self.hash_password(password))
+
+
+def _scrypt(password, salt, n, r, p, dklen=KEY_BYTES):
+    # hashlib 預設 maxmem 是 32 MiB; scrypt 需要約 128 * r * N bytes
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=dklen,
+                          maxmem=256 * r * (n + p + 2))
+
+
+class Session:
+    """Per-login state: who is logged in, plus free-form `data` for the application."""
+
+    __slots__ = ("token", "username", "created", "expires", "data")
+
+    def __init__(self, token, username, now, ttl):
+        self.token = token
+        self.username = username
+        self.created = now
+        self.expires = now + ttl
+        self.data = {}
+
+
+class SessionStore:
+    """
+    In-memory session tokens with an idle timeout.
+
+    A token is handed out after a successful login (one KDF run); presenting it
+    again within `ttl` seconds of its last use skips the KDF. Sessions are kept
+    in least-recently-used order, so expired ones are always at the front and
+    are dropped in O(1) each; at most `max_sessions` are kept.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self._sessions = OrderedDict()  # token -> Session
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        sessions = self._sessions
+        while sessions:
+            session = next(iter(sessions.values()))
+            if session.expires > now and len(sessions) <= self.max_sessions:
+                break
+            sessions.popitem(last=False)
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            now = self.clock()
+            session = self._sessions[token] = Session(token, username, now, self.ttl)
+            self._expire(now)
+        return session
+
+    def get(self, token):
+        """The live session for a token (its idle timer restarts), or None."""
+        if token is None:
+            return None
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            now = self.clock()
+            if session.expires <= now:
+                del self._sessions[token]
+                return None
+            session.expires = now + self.ttl
+            self._sessions.move_to_end(token)
+            return session
+
+    def revoke(self, token):
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
+
+    def revoke_user(self, username):
+        """Log a user out everywhere (e.g. after a password change). Returns the number of sessions ended."""
+        with self._lock:
+            tokens = [token for token, session in self._sessions.items() if session.username == username]
+            for token in tokens:
+                del self._sessions[token]
+        return len(tokens)
+
+    def __len__(self):
+        return len(self._sessions)
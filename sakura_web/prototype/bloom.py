@@ -0,0 +1,114 @@
+import hashlib
+import math
+
+import numpy as np
+
+from card_table import MASK64, pack_uid
+
+
+def uid_key(uid):
+    """64-bit key of a UID: the packed 7 bytes for a 14-hex-digit UID, a blake2b hash otherwise."""
+    key = pack_uid(uid)
+    if key is not None:
+        return key
+    return int.from_bytes(hashlib.blake2b(uid.encode(), digest_size=8).digest(), "little")
+
+
+def _mix(key):
+    """splitmix64 finaliser: spreads a packed UID over all 64 bits."""
+    z = (key + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def _mix_array(keys):
+    """_mix() over a uint64 numpy array (the multiplications wrap mod 2**64)."""
+    z = keys + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class BloomFilter:
+    """
+    Bloom filter over card UIDs.
+
+    `in` never gives a false negative for an added UID; false positives happen
+    at about `error_rate` while at most `capacity` UIDs were added. UIDs cannot
+    be removed -- rebuild the filter instead.
+    """
+
+    def __init__(self, capacity=1024, error_rate=0.001):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        # m = -n ln(p) / ln(2)^2, k = m/n ln(2)
+        self.num_bits = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_keys(cls, uids, error_rate=0.001, headroom=2, packed=None):
+        """
+        Filter sized for `headroom` times the given UIDs, so it can keep growing
+        incrementally. `packed` optionally adds UIDs that are already packed
+        (a uint64 array such as CardTable.packed_keys()).
+        """
+        keys = np.fromiter((uid_key(uid) for uid in uids), dtype=np.uint64)
+        if packed is not None:
+            keys = np.concatenate([np.asarray(packed, dtype=np.uint64), keys])
+        bloom = cls(max(1024, len(keys) * headroom), error_rate)
+        bloom.add_keys(keys)
+        return bloom
+
+    @classmethod
+    def from_buffer(cls, bits, capacity, error_rate, num_bits, num_hashes, count):
+        """Wrap an existing writable bit array (e.g. part of a mapped snapshot) without copying it."""
+        bloom = cls.__new__(cls)
+        bloom.capacity, bloom.error_rate = capacity, error_rate
+        bloom.num_bits, bloom.num_hashes, bloom.count = num_bits, num_hashes, count
+        bloom.bits = bits
+        return bloom
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def _positions(self, uid):
+        # 一個 64-bit hash 切成兩半，用 double hashing 產生 k 個位置
+        h = _mix(uid_key(uid))
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, uid):
+        bits = self.bits
+        for position in self._positions(uid):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, uids):
+        """Bulk add() of UID strings."""
+        self.add_keys(np.fromiter((uid_key(uid) for uid in uids), dtype=np.uint64))
+
+    def add_keys(self, keys):
+        """Bulk add of uid_key() values (a uint64 numpy array), vectorised."""
+        h = _mix_array(keys)
+        h1, h2 = h & np.uint64(0xFFFFFFFF), (h >> np.uint64(32)) | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        for i in range(self.num_hashes):
+            positions = (h1 + np.uint64(i) * h2) % np.uint64(self.num_bits)
+            np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(keys)
+
+    def __contains__(self, uid):
+        bits = self.bits
+        for position in self._positions(uid):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
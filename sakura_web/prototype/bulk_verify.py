@@ -0,0 +1,164 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import helper
+import sdm
+
+CHUNK_SIZE = 10000
+
+
+class VerifyStats:
+    """Running totals and throughput for a verify_many run."""
+
+    def __init__(self):
+        self.total = 0
+        self.valid = 0
+        self.stages = Counter()  # 失敗在哪個階段: parse / enc / uid_ctr
+        self.flags = Counter()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, verdict):
+        self.total += 1
+        if verdict["valid"]:
+            self.valid += 1
+        else:
+            self.stages[verdict["stage"]] += 1
+        if verdict["flag"] is not None:
+            self.flags[verdict["flag"]] += 1
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        """URLs verified per second so far."""
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return {"total": self.total, "valid": self.valid, "rejected": dict(self.stages),
+                "flags": dict(self.flags), "elapsed_s": round(self.elapsed, 3),
+                "urls_per_s": round(self.rate, 1)}
+
+
+def _parse_and_verify(urls):
+    """Parse a chunk (helper.parse_sdm_url) and check every ENC (runs in a worker process)."""
+    parsed = []
+    taps = []
+    for url in urls:
+        try:
+            prefix, uid, ctr, enc = helper.parse_sdm_url(url)
+        except ValueError:
+            parsed.append(None)
+            continue
+        parsed.append((prefix, uid, ctr))
+        taps.append((uid, ctr, enc))
+    enc_ok = iter(sdm.verify_batch(taps))
+    return [None if tap is None else tap + (next(enc_ok),) for tap in parsed]
+
+
+def _chunks(urls, chunk_size):
+    iterator = iter(urls)
+    while True:
+        chunk = [url.strip() for url in itertools.islice(iterator, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def _resolve(chunk, parsed, advance, accepted):
+    """
+    Resolve a verified chunk against the database in bulk and build the verdicts.
+    `accepted` (uid -> lowest CTR still acceptable) carries the taps accepted
+    earlier in the run, so a URL repeated within the input is a replay.
+    """
+    # Bloom filter 先濾掉一定不存在的 UID，不用去資料庫查
+    cards = helper.get_cards([tap[1] for tap in parsed
+                              if tap is not None and tap[3] and helper.card_may_exist(tap[1])])
+    for url, tap in zip(chunk, parsed):
+        if tap is None:
+            yield {"url": url, "valid": False, "stage": "parse", "flag": None}
+            continue
+
+        prefix, uid, ctr, enc_ok = tap
+        verdict = {"url": url, "uid": uid, "ctr": ctr, "valid": False, "stage": "enc", "flag": None}
+        if enc_ok:
+            verdict["stage"] = "uid_ctr"
+            card = cards.get(uid)
+            if card is None:
+                verdict["flag"] = 1
+            elif advance:
+                advanced = helper.advance_card_counter(uid, ctr)
+                verdict["flag"], verdict["valid"] = (2, True) if advanced else (0, False)
+            elif ctr >= max(card["counter"], accepted.get(uid, 0)):
+                accepted[uid] = ctr + 1
+                verdict["flag"], verdict["valid"] = 2, True
+            else:
+                verdict["flag"] = 0
+        yield verdict
+
+
+def verify_many(urls, chunk_size=CHUNK_SIZE, workers=None, advance=False, stats=None):
+    """
+    Verify a stream of SDM URLs and yield one verdict dict per URL, in input order.
+
+    URLs are consumed lazily in chunks, so the input can be a file object with
+    millions of lines. Parsing and ENC checks run on a process pool (workers=0 runs
+    them in-process); UID/CTR checks are resolved against the database in bulk.
+    By default the database is only read (flag 2 = CTR not yet used); with
+    advance=True each accepted tap also advances the stored counter, as a live
+    tap would. Either way a tap whose CTR is not above the last one accepted
+    for its card in this run is a replay (flag 0). Pass a VerifyStats to collect
+    throughput numbers.
+    """
+    stats = stats if stats is not None else VerifyStats()
+    accepted = {}  # 只讀模式: 這次執行裡每張卡已經接受過的 CTR
+    chunks = _chunks(urls, chunk_size)
+
+    if workers == 0:
+        for chunk in chunks:
+            for verdict in _resolve(chunk, _parse_and_verify(chunk), advance, accepted):
+                stats.add(verdict)
+                yield verdict
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 最多 2 x workers 個 chunk 在處理中，記憶體用量固定
+        pending = deque()
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending.append((chunk, pool.submit(_parse_and_verify, chunk)))
+                if len(pending) < 2 * workers:
+                    continue
+            while pending and (chunk is None or len(pending) >= 2 * workers):
+                done_chunk, future = pending.popleft()
+                for verdict in _resolve(done_chunk, future.result(), advance, accepted):
+                    stats.add(verdict)
+                    yield verdict
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify SDM URLs in bulk (one URL per line).")
+    parser.add_argument("file", help="file with one URL per line, or - for stdin")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (0 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--advance", action="store_true", help="advance stored counters for accepted taps")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+
+    stats = VerifyStats()
+    source = sys.stdin if args.file == "-" else open(args.file, "r")
+    with source:
+        for verdict in verify_many(source, args.chunk_size, args.workers, args.advance, stats):
+            if not args.quiet:
+                print(json.dumps(verdict, ensure_ascii=False))
+    print(json.dumps(stats.summary()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+from array import array
+
+import numpy as np
+
+HEX_DIGITS = "0123456789ABCDEF"
+UID_HEX_LENGTH = 14  # 7-byte UID = 14 個大寫 hex，剛好塞進一個 uint64
+
+MAX_COUNTER = 0xFFFFFFFF
+GOLDEN = 0x9E3779B97F4A7C15  # Fibonacci hashing multiplier
+MASK64 = (1 << 64) - 1
+EMPTY = -1
+MIN_CAPACITY = 1024
+
+
+def pack_uid(uid):
+    """UID string -> integer key, or None if it is not 14 uppercase hex digits."""
+    if len(uid) != UID_HEX_LENGTH or uid.strip(HEX_DIGITS):
+        return None
+    return int(uid, 16)
+
+
+def unpack_uid(key):
+    return f"{key:014X}"
+
+
+def index_bits(rows):
+    """log2 of an index size that keeps the load factor at or below 1/2."""
+    return max(MIN_CAPACITY * 2, 2 * rows - 1).bit_length()
+
+
+def build_index(keys, bits):
+    """
+    Open-addressing (linear probing) index over a uint64 key column, as an
+    int32 numpy array of row numbers (EMPTY = free slot). Vectorised: every
+    round places the rows whose probe slot is still free (one per slot) and
+    moves the others one slot on, so no free slot is ever skipped.
+    """
+    index = np.full(1 << bits, EMPTY, dtype=np.int32)
+    mask = (1 << bits) - 1
+    pending = np.arange(len(keys), dtype=np.int64)
+    slots = ((np.asarray(keys, dtype=np.uint64) * np.uint64(GOLDEN)) >> np.uint64(64 - bits)).astype(np.int64)
+    while pending.size:
+        free = index[slots] == EMPTY
+        taken, first = np.unique(slots[free], return_index=True)
+        index[taken] = pending[free][first]
+        placed = np.zeros(pending.size, dtype=bool)
+        placed[np.flatnonzero(free)[first]] = True
+        pending = pending[~placed]
+        slots = (slots[~placed] + 1) & mask
+    return index
+
+
+class CardTable:
+    """
+    Column-oriented card table: one row per card, in insertion order.
+
+    UIDs are stored as packed uint64 keys, counters as uint32 and the
+    registered flag in a bitset, and rows are found through an open-addressing
+    index of row numbers, so a card costs about 20 bytes instead of a few
+    hundred for a dict record. UIDs that do not pack (not 14 uppercase hex
+    digits, e.g. hand-edited test data) fall back to a plain dict.
+
+    The columns are array.array (fast single-item access on the tap path) and
+    are viewed as numpy arrays for bulk work. from_columns() wraps other
+    buffers with the same layout, e.g. memoryviews over a mapped snapshot.
+
+    The table behaves like the old {uid: record} dict where CardStore needs it:
+    `in`, len(), iteration over UIDs and get() returning a fresh record dict.
+    """
+
+    def __init__(self, capacity=MIN_CAPACITY):
+        capacity = max(MIN_CAPACITY, capacity)
+        self.keys = array("Q", bytes(8 * capacity))
+        self.counters = array("I", bytes(4 * capacity))
+        self.flags = bytearray((capacity + 7) // 8)
+        self.rows = 0
+        self.extra = {}  # 不能 pack 的 UID -> record
+        self._set_index(np.full(1 << index_bits(capacity), EMPTY, dtype=np.int32))
+
+    @classmethod
+    def from_columns(cls, keys, counters, flags, rows, index, extra=None):
+        """
+        Wrap existing writable columns (typed memoryviews or arrays: keys "Q",
+        counters "I", flags bytes, index "i" as built by build_index) without
+        copying them. The first append copies them into growable arrays.
+        """
+        table = cls.__new__(cls)
+        table.keys, table.counters, table.flags, table.rows = keys, counters, flags, rows
+        table.extra = dict(extra or {})
+        mask = len(index) - 1
+        table._lookup = (index, mask, 64 - mask.bit_length())
+        return table
+
+    @property
+    def index(self):
+        return self._lookup[0]
+
+    ########## Index ##########
+
+    def _set_index(self, index):
+        # index / mask / shift 一起換，並行的 _find 不會拿到不一致的組合
+        mask = len(index) - 1
+        self._lookup = (array("i", index.tobytes()), mask, 64 - mask.bit_length())
+
+    def _rebuild_index(self):
+        keys = np.frombuffer(self.keys, dtype=np.uint64, count=self.rows)
+        self._set_index(build_index(keys, index_bits(self.rows)))
+
+    def _find(self, key):
+        """Row number of `key`, or -1."""
+        index, mask, shift = self._lookup  # 先拿 index 再拿 keys: 並行 resize 時看到的 keys 一定夠長
+        keys = self.keys
+        slot = ((key * GOLDEN) & MASK64) >> shift
+        while True:
+            row = index[slot]
+            if row < 0 or keys[row] == key:
+                return row
+            slot = (slot + 1) & mask
+
+    def _append(self, key, counter, registered):
+        row = self.rows
+        if row == len(self.keys):
+            self._grow(2 * row)
+        self.keys[row] = key
+        self.counters[row] = counter
+        self._set_flag(row, registered)
+        index, mask, shift = self._lookup
+        if 2 * (row + 1) > len(index):
+            self.rows = row + 1
+            self._rebuild_index()
+            return
+        slot = ((key * GOLDEN) & MASK64) >> shift
+        while index[slot] != EMPTY:
+            slot = (slot + 1) & mask
+        self.rows = row + 1
+        index[slot] = row  # 最後才發佈，讀取端看到 row 時資料已經寫好
+
+    def _grow(self, capacity):
+        rows = self.rows
+        keys = array("Q")
+        keys.frombytes(memoryview(self.keys).cast("B")[:8 * rows])
+        keys.frombytes(bytes(8 * (capacity - rows)))
+        counters = array("I")
+        counters.frombytes(memoryview(self.counters).cast("B")[:4 * rows])
+        counters.frombytes(bytes(4 * (capacity - rows)))
+        flags = bytearray((capacity + 7) // 8)
+        flags[:(rows + 7) // 8] = self.flags[:(rows + 7) // 8]
+        self.keys, self.counters, self.flags = keys, counters, flags
+
+    def _flag(self, row):
+        return bool(self.flags[row >> 3] & (1 << (row & 7)))
+
+    def _set_flag(self, row, value):
+        if value:
+            self.flags[row >> 3] |= 1 << (row & 7)
+        else:
+            self.flags[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+    def _row(self, uid):
+        key = pack_uid(uid)
+        return self._find(key) if key is not None else EMPTY
+
+    ########## Card API ##########
+
+    def put(self, uid, counter=0, registered=False):
+        """Insert or replace a card."""
+        counter = _check_counter(counter)
+        key = pack_uid(uid)
+        if key is None:
+            self.extra[uid] = {"uid": uid, "counter": counter, "registered": bool(registered)}
+            return
+        row = self._find(key)
+        if row < 0:
+            self._append(key, counter, registered)
+        else:
+            self.counters[row] = counter
+            self._set_flag(row, registered)
+
+    def extend(self, uids, counters, registered):
+        """Bulk insert (later duplicates win, like repeated put() calls)."""
+        uids, counters, registered = list(uids), list(counters), list(registered)
+        if not len(self) and self._extend_packed(uids, counters, registered):
+            return
+        check_existing = len(self) > 0
+        latest = {}  # 同一批裡重複的 UID: 保留第一次出現的位置，值用最後一次的
+        for uid, counter, flag in zip(uids, counters, registered):
+            key = pack_uid(uid)
+            if key is None or (check_existing and uid in self):
+                self.put(uid, counter, flag)
+            else:
+                latest[uid] = (key, _check_counter(counter), flag)
+        if not latest:
+            return
+
+        start, end = self.rows, self.rows + len(latest)
+        if end > len(self.keys):
+            self._grow(max(end, 2 * len(self.keys)))
+        columns = latest.values()
+        self.keys[start:end] = array("Q", (key for key, _, _ in columns))
+        self.counters[start:end] = array("I", (counter for _, counter, _ in columns))
+        for row, (_, _, flag) in enumerate(columns, start):
+            if flag:
+                self.flags[row >> 3] |= 1 << (row & 7)
+        self.rows = end
+        self._rebuild_index()
+
+    def _extend_packed(self, uids, counters, registered):
+        """
+        Vectorised load into an empty table when every UID packs and none repeats
+        (the usual snapshot load). Returns False to fall back to the slow path.
+        """
+        joined = "".join(uids)
+        if not uids or set(map(len, uids)) != {UID_HEX_LENGTH} or joined.strip(HEX_DIGITS):
+            return False
+        rows = len(uids)
+        packed = np.zeros((rows, 8), dtype=np.uint8)
+        packed[:, 1:] = np.frombuffer(bytes.fromhex(joined), dtype=np.uint8).reshape(rows, 7)
+        keys = packed.view(">u8").ravel().astype(np.uint64)
+        counter_column = np.asarray(counters, dtype=np.int64)
+        ordered = np.sort(keys)
+        if (ordered[1:] == ordered[:-1]).any() or counter_column.min() < 0 or counter_column.max() > MAX_COUNTER:
+            return False
+
+        self._grow(max(MIN_CAPACITY, rows))
+        np.frombuffer(self.keys, dtype=np.uint64)[:rows] = keys
+        np.frombuffer(self.counters, dtype=np.uint32)[:rows] = counter_column
+        flags = np.packbits(np.asarray(registered, dtype=bool), bitorder="little")
+        self.flags[:len(flags)] = flags.tobytes()
+        self.rows = rows
+        self._rebuild_index()
+        return True
+
+    def get(self, uid):
+        """Record dict {"uid", "counter", "registered"} (a copy), or None."""
+        row = self._row(uid)
+        if row < 0:
+            record = self.extra.get(uid)
+            return dict(record) if record is not None else None
+        return {"uid": uid, "counter": self.counters[row], "registered": self._flag(row)}
+
+    def counter(self, uid):
+        """Stored counter, or None if the card does not exist."""
+        row = self._row(uid)
+        if row < 0:
+            record = self.extra.get(uid)
+            return record["counter"] if record is not None else None
+        return self.counters[row]
+
+    def set_counter(self, uid, counter):
+        counter = _check_counter(counter)
+        row = self._row(uid)
+        if row < 0:
+            self.extra[uid]["counter"] = counter  # KeyError 和舊的 dict 一樣
+        else:
+            self.counters[row] = counter
+
+    def is_registered(self, uid):
+        row = self._row(uid)
+        return self.extra[uid]["registered"] if row < 0 else self._flag(row)
+
+    def set_registered(self, uid, registered=True):
+        row = self._row(uid)
+        if row < 0:
+            self.extra[uid]["registered"] = bool(registered)
+        else:
+            self._set_flag(row, registered)
+
+    def packed_keys(self):
+        """Packed UIDs of all rows as a uint64 numpy array (copy); `extra` UIDs are not included."""
+        return np.frombuffer(self.keys, dtype=np.uint64, count=self.rows).copy()
+
+    def records(self):
+        """All cards as record dicts, in insertion order (packed UIDs first)."""
+        rows = self.rows
+        registered = np.unpackbits(np.frombuffer(self.flags, dtype=np.uint8), bitorder="little")[:rows].tolist()
+        for key, counter, flag in zip(self.keys[:rows], self.counters[:rows], registered):
+            yield {"uid": f"{key:014X}", "counter": counter, "registered": bool(flag)}
+        for record in list(self.extra.values()):
+            yield dict(record)
+
+    def clear(self):
+        self.__init__()
+
+    @property
+    def nbytes(self):
+        """Memory held by the packed columns and the index (not counting `extra`)."""
+        return sum(memoryview(column).nbytes for column in (self.keys, self.counters, self.flags, self._lookup[0]))
+
+    def __contains__(self, uid):
+        return self._row(uid) >= 0 or uid in self.extra
+
+    def __len__(self):
+        return self.rows + len(self.extra)
+
+    def __iter__(self):
+        for key in self.keys[:self.rows]:
+            yield f"{key:014X}"
+        yield from list(self.extra)
+
+
+def _check_counter(counter):
+    counter = int(counter)
+    if not 0 <= counter <= MAX_COUNTER:
+        raise ValueError(f"Counter out of range: {counter}")
+    return counter
@@ -1,36 +1,122 @@
-import hashlib
-import json
+import os
 import random
 import re
+import sdm
+import sqlite_storage
+import storage
 
 DATABASE = "database.json"
+SQLITE_DATABASE = "database.db"
+BINARY_DATABASE = "database.snap"
+
+# 資料庫 driver: "json" (snapshot + change log), "binary" (memory-mapped snapshot + change log) or "sqlite"
+DATABASE_DRIVER = os.environ.get("SAKURA_DB_DRIVER", "json")
 
 # 設定網址
 BASE_URL = "https://nfc.sakurahighschool.com"
 PREFIX = "/a/"
 
+# SDM URL 格式，和 NTAG 424 DNA 的 ASCII mirroring 一樣: UID hex, SDMReadCtr 6 位 hex, SDMMAC 16 位 hex
+# (卡片輸出大寫，大小寫都接受)；只 compile 一次
+SDM_URL_PATTERN = re.compile(r"https://[^/]+(/a/\d+)\?uid=([0-9A-Fa-f]+)&ctr=([0-9A-Fa-f]{6})&enc=([0-9A-Fa-f]{16})(?![0-9A-Fa-f])")
+MAX_SDM_CTR = 0xFFFFFF  # SDMReadCtr 是 3 bytes
+
 
 ########## Functions for Database Management ##########
 
+_store = None
+
+def get_store():
+    """Return the process-wide card store, opening it on first use."""
+    global _store
+    if _store is None:
+        if DATABASE_DRIVER == "sqlite":
+            _store = sqlite_storage.SQLiteStore(SQLITE_DATABASE)
+        elif DATABASE_DRIVER == "json":
+            _store = storage.CardStore(DATABASE)
+        elif DATABASE_DRIVER == "binary":
+            _store = storage.CardStore(BINARY_DATABASE, snapshot_format="binary")
+        else:
+            raise ValueError(f"Unknown database driver: {DATABASE_DRIVER}")
+    return _store
+
+def close_store():
+    """Close the process-wide card store, if open; the next get_store() opens it again."""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
 def load_database():
-    """Load the database from a JSON file."""
-    try:
-        with open(DATABASE, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"cards": [], "users": []}  # Default structure
+    """Load the whole database in the database.json layout (O(n), prefer the lookups below)."""
+    return get_store().to_dict()
 
 def save_database(data):
-    """Save the updated database to the JSON file."""
-    with open(DATABASE, "w") as file:
-        json.dump(data, file, indent=4)
+    """Replace the whole database with `data` and write a fresh snapshot."""
+    get_store().replace(data)
 
 def clear_database():
     """Reset the database by removing all cards and users."""
-    empty_db = {"cards": [], "users": []}
+    get_store().clear()
+
+def get_card(uid):
+    """Look up a card by UID in O(1). Returns None if it does not exist."""
+    return get_store().get_card(uid)
+
+def card_may_exist(uid):
+    """Cheap pre-check (Bloom filter): False means the UID is definitely not in the database."""
+    return get_store().may_contain(uid)
+
+def get_user(username):
+    """Look up a user by username in O(1). Returns None if it does not exist."""
+    return get_store().get_user(username)
+
+def get_cards(uids):
+    """Look up many cards at once. Returns {uid: card or None}."""
+    return get_store().get_cards(uids)
+
+def is_card_owner(username, uid):
+    """Check whether the card is assigned to the user."""
+    return get_store().is_owner(username, uid)
+
+def get_card_owner(uid):
+    """Username the card is assigned to, or None."""
+    return get_store().get_owner(uid)
+
+def get_user_cards(username):
+    """UIDs assigned to the user, in registration order."""
+    return get_store().cards_for_user(username)
+
+def add_card(uid, counter=0, registered=False):
+    """Add a new card to the database."""
+    get_store().add_card(uid, counter, registered)
+
+def add_cards(uids, counter=0, registered=False):
+    """Add many new cards at once (one bulk insert / change-log entry)."""
+    get_store().add_cards(uids, counter, registered)
 
-    with open(DATABASE, "w") as file:
-        json.dump(empty_db, file, indent=4)
+def update_card_counter(uid, counter):
+    """Persist a new counter value for a card."""
+    get_store().set_counter(uid, counter)
+
+def advance_card_counter(uid, ctr):
+    """
+    Atomically accept a tap CTR for a card (compare-and-swap).
+    Returns True if accepted, False if it is a replay, None if the card does not exist.
+    """
+    return get_store().advance_counter(uid, ctr)
+
+def add_user(username, password):
+    """Add a new user with no cards (`password` is stored as given, see auth.CredentialStore)."""
+    get_store().add_user(username, password)
+
+def set_user_password(username, password):
+    """Replace the stored password (hash) of an existing user."""
+    get_store().set_password(username, password)
+
+def register_card(username, uid):
+    """Assign an unregistered card to the user. Returns False if it was already registered."""
+    return get_store().register_card(username, uid)
 
 ########## Functions for URL Management ##########
 
@@ -40,33 +126,30 @@ def generate_new_uid():
 
 def get_all_uid():
     """Retrieve all UIDs from the card section of the database."""
-    db = load_database()
-    
-    # 從資料庫提取 UID
-    if "cards" in db and db["cards"]:
-        return [card["uid"] for card in db["cards"]]
-    
-    return []  # Return an empty list if no cards exist
+    return get_store().uids()
 
 def generate_new_sdm_url(uid, num):
-    # 模擬 CTR（8 Bytes，計數器）
-    ctr = "00000000"
+    # 模擬 CTR (SDMReadCtr, 3 bytes)
+    ctr = 0
     
-    # 假設 ENC 為 SHA256（c實際上應該是 AES-CMAC）
-    enc_data = f"{uid}{ctr}".encode()
-    enc = hashlib.sha256(enc_data).hexdigest()[:16]  # 取前16位當作加密碼
+    # ENC = NTAG 424 DNA SDMMAC (AES-CMAC)
+    enc = sdm.compute_sdm_mac(uid, ctr)
     
     # 生成完整 SDM URL
-    sdm_url = f"{BASE_URL}{PREFIX}{num}?uid={uid}&ctr={ctr}&enc={enc}"
+    return format_sdm_url(num, uid, ctr, enc)
 
-    return sdm_url
+def format_sdm_url(num, uid, ctr, enc, base_url=BASE_URL):
+    """SDM URL for card number `num`, formatted the way the card mirrors it (ctr: int)."""
+    if not 0 <= ctr <= MAX_SDM_CTR:
+        raise ValueError(f"CTR 超出範圍: {ctr}")
+    return f"{base_url}{PREFIX}{num}?uid={uid}&ctr={ctr:06X}&enc={enc.upper()}"
 
 def parse_sdm_url(url):
-    """ 解析 SDM URL，提取 prefix（流水號）、UID 和 CTR """
-    match = re.search(r"https://[^/]+(/a/\d+)\?uid=([A-F0-9]+)&ctr=(\d+)&enc=([a-f0-9]+)", url)
+    """ 解析 SDM URL，提取 prefix（流水號）、UID、CTR 和 ENC """
+    match = SDM_URL_PATTERN.search(url)
     if match:
         prefix, uid, ctr, enc = match.groups()
-        return prefix, uid, int(ctr), enc  # 轉換 CTR 為整數
+        return prefix, uid.upper(), int(ctr, 16), enc  # CTR 是 hex
     else:
         raise ValueError("URL 格式錯誤，無法解析 prefix, UID 和 CTR")
 
@@ -75,35 +158,27 @@ def generate_next_sdm_url(base_url, url):
     prefix, uid, ctr, _ = parse_sdm_url(url)
 
     ctr += 1  # Increment counter
-    ctr_str = f"{ctr:08d}"  # Keep 8-digit format
+    enc = sdm.compute_sdm_mac(uid, ctr)  # Generate new ENC
 
-    enc_data = f"{uid}{ctr_str}".encode()
-    enc = hashlib.sha256(enc_data).hexdigest()[:16]  # Generate new ENC
-
-    new_sdm_url = f"{base_url}{prefix}?uid={uid}&ctr={ctr_str}&enc={enc}"
-    return new_sdm_url
+    return format_sdm_url(prefix[len(PREFIX):], uid, ctr, enc, base_url)
 
 ########## Function for testing ##########
 
-def generate_test_database(num=5):
+def generate_test_database(num=5, show_urls=True):
     # reset the database
     clear_database()
 
-    db = load_database()
-
-    # generate n new card uid
-    for _ in range(num):
-        uid = generate_new_uid()
-        db["cards"].append({"uid": uid, "counter": "00000000", "registered": False})
-
-    save_database(db)
-
-    all_card_uid = get_all_uid()
+    # generate n new card uid (不重複), 一次寫入
+    all_card_uid = set()
+    while len(all_card_uid) < num:
+        all_card_uid.add(generate_new_uid())
+    all_card_uid = list(all_card_uid)
+    add_cards(all_card_uid)
 
     # generate n new sdm url
     if not all_card_uid:
         print("Error: all_card_uid is empty.")
         return 0
-    else:
+    elif show_urls:
         for i in range(min(num, len(all_card_uid))):
             print(f"\n{i+1}. {generate_new_sdm_url(all_card_uid[i], i)}")
@@ -0,0 +1,267 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from urllib.parse import urlsplit
+
+import helper
+import main
+import metrics
+import sdm
+
+# 一次 tap: 種類、URL、以及這個 tap 應不應該被接受
+Tap = namedtuple("Tap", ["kind", "url", "expect_valid"])
+
+TAP_KINDS = ("valid", "replay", "forged", "unknown")
+
+HISTORY_SIZE = 10000   # replay 從最近這麼多個 valid tap 裡挑
+REPLAY_MIN_AGE = 100   # 只重送至少這麼多個 tap 之前的 URL (避免和原本的 tap 同時在處理中)
+MAX_CTR_GAP = 3        # 真實卡片可能被別的手機讀過，CTR 不一定連續
+
+
+class TapStream:
+    """
+    Endless stream of realistic taps over a set of cards.
+
+    Most taps are the next valid URL of a randomly chosen card (occasionally
+    skipping a few CTR values, as when the card was read elsewhere); the rest
+    are replays of older URLs, forged ENCs for real cards and genuine-looking
+    URLs of cards that are not in the database.
+    """
+
+    def __init__(self, cards, replay_ratio=0.05, forged_ratio=0.02, unknown_ratio=0.01, seed=None):
+        """`cards` maps UID -> the lowest CTR the next tap may carry (the stored counter)."""
+        self.uids = list(cards)
+        if not self.uids:
+            raise ValueError("TapStream needs at least one card")
+        self.next_ctr = dict(cards)
+        self.numbers = {uid: i for i, uid in enumerate(self.uids)}
+        self.ratios = (replay_ratio, forged_ratio, unknown_ratio)
+        self.rng = random.Random(seed)
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            return self._next_tap()
+
+    def _url(self, uid, ctr, enc, number):
+        return helper.format_sdm_url(number, uid, ctr, enc)
+
+    def _next_tap(self):
+        rng = self.rng
+        replay_ratio, forged_ratio, unknown_ratio = self.ratios
+        roll = rng.random()
+
+        if roll < replay_ratio and len(self.history) > REPLAY_MIN_AGE:
+            url = self.history[rng.randrange(len(self.history) - REPLAY_MIN_AGE)]
+            return Tap("replay", url, False)
+        roll -= replay_ratio
+
+        if roll < forged_ratio:
+            uid = rng.choice(self.uids)
+            enc = "%016x" % rng.getrandbits(64)
+            return Tap("forged", self._url(uid, self.next_ctr[uid], enc, self.numbers[uid]), False)
+        roll -= forged_ratio
+
+        if roll < unknown_ratio:
+            uid = "04" + "%012X" % rng.getrandbits(48)
+            ctr = rng.randrange(100)
+            return Tap("unknown", self._url(uid, ctr, sdm.compute_sdm_mac(uid, ctr), 0), False)
+
+        uid = rng.choice(self.uids)
+        ctr = self.next_ctr[uid] + (rng.randrange(MAX_CTR_GAP) if rng.random() < 0.1 else 0)
+        self.next_ctr[uid] = ctr + 1
+        url = self._url(uid, ctr, sdm.compute_sdm_mac(uid, ctr), self.numbers[uid])
+        self.history.append(url)
+        return Tap("valid", url, True)
+
+
+class InProcessTarget:
+    """Run main.verify_tap directly."""
+
+    name = "in-process"
+
+    def verify(self, url):
+        return main.verify_tap(url)
+
+
+class HttpTarget:
+    """Send taps to a running server.py; one keep-alive connection per load thread."""
+
+    def __init__(self, endpoint, timeout=10.0):
+        parts = urlsplit(endpoint)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.name = endpoint
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def verify(self, url):
+        parts = urlsplit(url)
+        connection = self._connection()
+        try:
+            connection.request("GET", f"{parts.path}?{parts.query}")
+            response = connection.getresponse()
+            return json.loads(response.read())
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+class LoadReport:
+    """Outcome counts per tap kind plus latency histograms."""
+
+    def __init__(self):
+        self.latency = metrics.Histogram()        # 從預定送出時間算起 (包含排隊)
+        self.service_time = metrics.Histogram()   # 實際送出到收到結果
+        self.outcomes = Counter()                 # (kind, "accepted" / "rejected" / "error")
+        self.flags = Counter()
+        self.unexpected = Counter()               # 結果和預期不同的 tap (同一張卡的 tap 被並行處理時也可能亂序)
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, tap, verdict, latency, service_time):
+        self.latency.record(latency)
+        self.service_time.record(service_time)
+        with self.lock:
+            if verdict is None:
+                self.outcomes[(tap.kind, "error")] += 1
+                return
+            self.outcomes[(tap.kind, "accepted" if verdict["valid"] else "rejected")] += 1
+            if verdict.get("flag") is not None:
+                self.flags[verdict["flag"]] += 1
+            if verdict["valid"] != tap.expect_valid:
+                self.unexpected[tap.kind] += 1
+
+    @property
+    def total(self):
+        return sum(self.outcomes.values())
+
+    def summary(self):
+        def percentiles(histogram):
+            return {f"p{q}": round((histogram.quantile(q / 100) or 0) * 1000, 3) for q in (50, 95, 99)}
+
+        accepted = sum(n for (_, outcome), n in self.outcomes.items() if outcome == "accepted")
+        errors = sum(n for (_, outcome), n in self.outcomes.items() if outcome == "error")
+        return {
+            "taps": self.total,
+            "accepted": accepted,
+            "rejected": self.total - accepted - errors,
+            "errors": errors,
+            "by_kind": {kind: {outcome: n for (k, outcome), n in self.outcomes.items() if k == kind}
+                        for kind in TAP_KINDS},
+            "flags": {str(flag): n for flag, n in self.flags.items()},
+            "unexpected": dict(self.unexpected),
+            "elapsed_s": round(self.elapsed, 3),
+            "taps_per_s": round(self.total / self.elapsed, 1) if self.elapsed else 0.0,
+            "latency_ms": percentiles(self.latency),
+            "service_time_ms": percentiles(self.service_time),
+        }
+
+
+def seed_cards(num_cards):
+    """Fresh database with `num_cards` cards; returns {uid: next CTR}."""
+    helper.generate_test_database(num_cards, show_urls=False)
+    return {uid: 0 for uid in helper.get_all_uid()}
+
+
+def existing_cards():
+    """The cards already in the database with their stored counters."""
+    cards = helper.get_cards(helper.get_all_uid())
+    return {uid: card["counter"] for uid, card in cards.items()}
+
+
+def run_load(stream, target, taps, rate=None, concurrency=8, report=None):
+    """
+    Push `taps` taps from `stream` through `target` with `concurrency` threads.
+
+    With a `rate` (taps/s) the load is open-loop: tap i is due at start + i/rate
+    and its latency is measured from that moment, so a slow server shows up as
+    queueing delay instead of silently lowering the offered load. Without a rate
+    every thread sends as fast as it can.
+    """
+    report = report if report is not None else LoadReport()
+    counter = iter(range(taps))
+    counter_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def worker():
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+                if index is None:
+                    return
+                tap = next(stream)
+            due = start + index / rate if rate else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                verdict = target.verify(tap.url)
+            except Exception:
+                verdict = None
+            done = time.perf_counter()
+            report.record(tap, verdict, done - min(due, sent), done - sent)
+
+    threads = [threading.Thread(target=worker, name=f"load-{i}", daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Generate realistic tap load against the verification pipeline.")
+    parser.add_argument("--cards", type=int, default=1000, help="cards to seed with generate_test_database")
+    parser.add_argument("--taps", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=None, help="target taps per second (default: as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--url", default=None, help="server endpoint, e.g. http://127.0.0.1:8080 (default: in-process)")
+    parser.add_argument("--replay", type=float, default=0.05, help="fraction of replayed taps")
+    parser.add_argument("--forged", type=float, default=0.02, help="fraction of forged ENCs")
+    parser.add_argument("--unknown", type=float, default=0.01, help="fraction of unknown UIDs")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for a reproducible tap stream")
+    parser.add_argument("--no-seed-cards", action="store_true", help="use the cards already in the database")
+    parser.add_argument("--seed-only", action="store_true", help="seed the database and exit (start server.py next)")
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    args = parser.parse_args()
+
+    cards = existing_cards() if args.no_seed_cards else seed_cards(args.cards)
+    if args.seed_only:
+        print(f"Seeded {len(cards)} cards into the {helper.DATABASE_DRIVER} database.")
+        return
+    if args.url:
+        helper.close_store()  # 伺服器自己開資料庫
+
+    stream = TapStream(cards, args.replay, args.forged, args.unknown, args.seed)
+    target = HttpTarget(args.url) if args.url else InProcessTarget()
+    report = run_load(stream, target, args.taps, args.rate, args.concurrency)
+
+    summary = report.summary()
+    summary.update(target=target.name, cards=len(cards), target_rate=args.rate, concurrency=args.concurrency)
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,86 +1,72 @@
+import argparse
+import auth
 import getpass
-import hashlib
 import helper
+import metrics
+import sdm
+import tap_log
 import time
 
-current_user = None
+# 密碼 (scrypt) 和登入後的 session；每個 session 自己記住是誰登入的
+credentials = auth.CredentialStore()
+sessions = auth.SessionStore()
+
+# server.py 會設定一個 ratelimit.RejectLimiter；只有帶 source 的 tap 會被限流
+reject_limiter = None
+
+# 每個 tap 的驗證結果都寫進這個 tap_log.TapLog (server.py / --tap-log 設定)；None = 不記錄
+event_log = None
+
+# 每個驗證階段的延遲 (histogram 先取好，記錄時不用再查表)
+STAGES = ("parse", "enc", "uid_ctr", "ownership")
+STAGE_SECONDS = {stage: metrics.REGISTRY.histogram("sakura_verify_stage_seconds", stage=stage) for stage in STAGES}
+VERIFY_SECONDS = metrics.REGISTRY.histogram("sakura_verify_seconds")
 
 def validate_enc(uid, ctr, enc):
-    """ 驗證 SDM URL 中的 ENC 是否正確 """
-    # 重新計算 ENC
-    ctr_str = f"{ctr:08d}"  # 保持 8 位數格式
-    enc_data = f"{uid}{ctr_str}".encode()
-    expected_enc = hashlib.sha256(enc_data).hexdigest()[:16]  # 取前16位當作加密碼
-
-    # 比對計算出的 ENC 和 URL 內的 ENC
-    if expected_enc == enc:
-        return True # URL 內的 ENC 驗證成功，UID & CTR 正確
-    else:
-        return False # URL 內的 ENC 驗證失敗，UID 或 CTR 不匹配
+    """ 驗證 SDM URL 中的 ENC 是否正確 (AES-CMAC SDMMAC, constant-time 比對) """
+    # URL 內的 ENC 驗證成功 -> UID & CTR 正確; 失敗 -> UID 或 CTR 不匹配
+    return sdm.verify_sdm_mac(uid, ctr, enc)
 
 def validate_uid_ctr(uid, ctr):
-    """ Check if UID exists, verify CTR value and update CTR value """
-    db = helper.load_database()
-
-    card = next((card for card in db["cards"] if card["uid"] == uid), None)
-    if not card:
+    """ Check if UID exists, verify CTR value and advance the stored CTR atomically """
+    # Bloom filter: 不存在的 UID 不碰資料庫就直接拒絕
+    accepted = helper.advance_card_counter(uid, ctr) if helper.card_may_exist(uid) else None
+    if accepted is None:
         # 卡片不存在系統裡
+        metrics.inc("sakura_verify_flag_total", flag="1")
         return False, 1, "Error - 卡片不存在系統裡..."
 
-    if ctr == 0:
-        # 卡片第一次被開通 or # URL 內的 UID 符合系統儲存的 UID & URL 內的 CTR > 系統儲存的 CTR
+    if accepted:
+        # 卡片第一次被開通 or # URL 內的 UID 符合系統儲存的 UID & URL 內的 CTR > 上次接受的 CTR
+        metrics.inc("sakura_verify_flag_total", flag="2")
         return True, 2, "審核通過 - 卡片已被驗證."
 
-    if ctr > int(card["counter"]):
-        # Update counter
-        temp_ctr = int(card["counter"])
-        temp_ctr += 1  # Increment counter
-        card["counter"] = f"{temp_ctr:08d}" # Keep 8-digit format
-        helper.save_database(db)
-
-        # 卡片第一次被開通 or # URL 內的 UID 符合系統儲存的 UID & URL 內的 CTR > 系統儲存的 CTR
-        return True, 2, "審核通過 - 卡片已被驗證."
-    
-    # Update counter
-    ctr += 1  # Increment counter
-    card["counter"] = f"{ctr:08d}" # Keep 8-digit format
-    helper.save_database(db)
-
-    # URL 內的 CTR <= 系統儲存的 CTR
+    # URL 內的 CTR <= 上次接受的 CTR (replay)
+    metrics.inc("sakura_verify_flag_total", flag="0")
     return False, 0, "審核失敗 - Counter值太低."
 
 def login():
     """ User login verification. """
-    db = helper.load_database()
-    
     username = input("\nEnter username: ")
     password = getpass.getpass("Enter password: ")  # Hide password input
 
-    user = next((user for user in db["users"] if user["username"] == username and user["password"] == password), None)
-
-    return username if user else None
+    return credentials.authenticate(username, password)
 
 def signup():
     """ Create a new user account. """
-    db = helper.load_database()
-
     username = input("\nEnter new username: ")
-    if any(user["username"] == username for user in db["users"]):
+    if helper.get_user(username):
         return None, "審核失敗 - 該用戶已經存在系統裡!"
 
     password = getpass.getpass("Enter new password: ")
-    db["users"].append({"username": username, "password": password, "cards": []})
-
-    helper.save_database(db)
+    credentials.create_user(username, password)
 
     return username, "審核通過 - 用戶登記成功!"
 
-def logout():
-    """ Logout the current user """
-    global current_user
-    message = f"用戶 {current_user} 已被登出."
-    current_user = None  # Reset user
-    return message
+def logout(session):
+    """ Logout the user of a session """
+    sessions.revoke(session.token)
+    return f"用戶 {session.username} 已被登出."
 
 def reset_password():
     """ Reset a user's password. """
@@ -92,34 +78,105 @@ def verify_card_ownership(username, uid):
     If the flag is False, assign the card to the user.
     If the flag is True, check if the user owns the card.
     """
-    db = helper.load_database()
-
-    user = next((user for user in db["users"] if user["username"] == username), None)
+    user = helper.get_user(username)
     if not user:
         return False, "Error - 查詢不到該用戶!"
 
-    card = next((card for card in db["cards"] if card["uid"] == uid), None)
+    card = helper.get_card(uid)
     if not card:
         return False, "Error - 該卡片沒有被登記在系統裡!"
     
-    if not card["registered"]:
+    if not card["registered"] and helper.register_card(username, uid):
         # Card is not assigned -> Assign it to the user
-        card["registered"] = True
-        user["cards"].append(uid)
-        helper.save_database(db)
         return True, f"審核通過 - 卡片序號 {uid} 登記在 {username}."
 
-    if uid in user["cards"]:
+    if helper.is_card_owner(username, uid):
         return True, f"審核通過 - 用戶 {username} 已經擁有 {uid}."
 
     return False, f"審核失敗 - 卡片序號 {uid} 已經登記在其他用戶."
 
+def record_tap(uid, ctr, outcome, flag=None, username=None):
+    """ Log a tap of the interactive flow to event_log (outcome: one of tap_log.OUTCOMES) """
+    if event_log is not None:
+        event_log.record(uid, ctr, outcome, flag, username=username)
 
-def main():
+def verify_tap(url, username=None, source=None):
+    """
+    Run the non-interactive verification pipeline for one tap URL:
+    parse_sdm_url -> validate_enc -> validate_uid_ctr -> verify_card_ownership.
+    Ownership is only checked when a username is given. Taps with a `source`
+    (client address) are throttled by reject_limiter once that source has had
+    too many taps rejected; those return stage "rate_limit".
+    Returns a JSON-serialisable result carrying the validate_uid_ctr flag (0/1/2).
+    Stage latencies and outcomes are recorded in metrics.REGISTRY, and every
+    tap in event_log if one is set.
+    """
+    start = time.perf_counter()
+    limiter = reject_limiter if source is not None else None
+    result = _verify_tap(url, username, start, source, limiter)
+    if limiter is not None and not result["valid"] and result["stage"] != "rate_limit":
+        limiter.reject(source, result.get("uid"))
+    VERIFY_SECONDS.record(time.perf_counter() - start)
+    if event_log is not None:
+        event_log.record_result(result, source, username)
+    metrics.inc("sakura_verify_total", result="valid" if result["valid"] else result["stage"])
+    return result
+
+def _verify_tap(url, username, start, source=None, limiter=None):
+    result = {"valid": False, "stage": "parse", "flag": None, "message": None}
+
+    try:
+        _, uid, ctr, enc = helper.parse_sdm_url(url)
+    except ValueError as e:
+        result["message"] = str(e)
+        return result
+    result["uid"] = uid
+    result["ctr"] = ctr
+    if limiter is not None and not limiter.allowed(source, uid):
+        result["stage"] = "rate_limit"
+        result["message"] = "審核失敗 - 太多失敗的請求，請稍後再試"
+        return result
+    last = time.perf_counter()
+    STAGE_SECONDS["parse"].record(last - start)
+
+    result["stage"] = "enc"
+    valid_enc = validate_enc(uid, ctr, enc)
+    now = time.perf_counter()
+    STAGE_SECONDS["enc"].record(now - last)
+    last = now
+    if not valid_enc:
+        result["message"] = "審核失敗 - URL 內的 ENC 驗證失敗，UID 或 CTR 不匹配"
+        return result
+
+    result["stage"] = "uid_ctr"
+    validation, flag, validation_message = validate_uid_ctr(uid, ctr)
+    now = time.perf_counter()
+    STAGE_SECONDS["uid_ctr"].record(now - last)
+    last = now
+    result["flag"] = flag
+    result["message"] = validation_message
+    if not validation:
+        return result
+
+    if username is not None:
+        result["stage"] = "ownership"
+        card_ownership, card_ownership_message = verify_card_ownership(username, uid)
+        STAGE_SECONDS["ownership"].record(time.perf_counter() - last)
+        result["message"] = card_ownership_message
+        if not card_ownership:
+            return result
+
+    result["valid"] = True
+    return result
+
+
+def main(pause=time.sleep):
+    """ Interactive demo flow; pass pause=lambda _: None to skip the demo delays """
     # Create 5 different UIDs and URLs
     helper.generate_test_database()
 
-    global current_user
+    # 這台裝置上的 session token: 沒登出就再次 tap 的用戶不用重新輸入密碼
+    device_token = None
 
     while True:
         """ Main function to handle the complete flow """
@@ -131,29 +188,35 @@ def main():
         try:
             # Step 1: Extract UID, CTR, and ENC
             print("\n--- Step 1: 解析 UID, CTR, and ENC ---")
-            _, uid, ctr, enc = helper.parse_sdm_url(given_url)
-            time.sleep(2)
+            try:
+                _, uid, ctr, enc = helper.parse_sdm_url(given_url)
+            except ValueError:
+                record_tap(None, None, "parse")
+                raise
+            pause(2)
             
             # Step 2: Validate ENC
             print("\n--- Step 2: 正在驗證 ENC ---")
             if not validate_enc(uid, ctr, enc):
+                record_tap(uid, ctr, "enc")
                 print("\n審核失敗 - URL 內的 ENC 驗證失敗，UID 或 CTR 不匹配")
-                time.sleep(2)
+                pause(2)
                 next_new_url = helper.generate_next_sdm_url(helper.BASE_URL, given_url)
                 print(f"\nStep 7 - Next SDM URL: {next_new_url}")
                 continue  # Loop back to Step 1
             else:
                 print(f"\n審核通過 - URL 內的 ENC 驗證成功，UID 和 CTR 正確")
-                time.sleep(2)
+                pause(2)
 
             # Step 3: Validate UID and CTR
             print("\n--- Step 3: 正在驗證 UID and CTR ---")
             validation, flag, validation_message = validate_uid_ctr(uid, ctr)
             if not validation:
+                record_tap(uid, ctr, "replay" if flag == 0 else "unknown", flag)
                 if flag == 0:
                     # URL 內的 CTR <= 系統儲存的 CTR
                     print(f"\n{validation_message}")
-                    time.sleep(2)  
+                    pause(2)  
                     next_new_url = helper.generate_next_sdm_url(helper.BASE_URL, given_url)
                     print(f"\nStep 7 - Next SDM URL: {next_new_url}")
                     continue  # Loop back to Step 1
@@ -163,33 +226,38 @@ def main():
             else:
                 # 卡片第一次被開通 or # URL 內的 UID 符合系統儲存的 UID & URL 內的 CTR > 系統儲存的 CTR
                 print(f"\n{validation_message}")
-                time.sleep(2)
+                pause(2)
 
             # Step 4: User Login or Signup Choice
             print("\n--- Step 4: 用戶登入 or 登記 ---")
-            while True:
+            session = sessions.get(device_token)
+            if session:
+                print(f"\n歡迎回來 {session.username} - 已經登入，不用再輸入密碼.")
+            while not session:
                 choice = input("\nDo you want to [1] 登入 or [2] 登記? (Enter 1 or 2): ").strip()
                 if choice == "1":
                     username = login()
                     if username:
-                        current_user = username
+                        session = sessions.create(username)
                         break
                     print("\n登入失敗: 錯誤用戶名 or 密碼. 請重新嘗試.")
                 elif choice == "2":
                     username, signup_message = signup()
                     if username:
-                        current_user = username
+                        session = sessions.create(username)
                         print(f"\n{signup_message}")
                         break
                     print("\n登記失敗: 該用戶已經存在系統裡. 請重新嘗試.")
                 else:
                     print("\n錯誤選項. 請輸入 '1' for 登入 or '2' for 登記.")
 
-            time.sleep(2)
+            pause(2)
 
             # Step 5: Verify if the card is assigned or assign it
             print("\n--- Step 5: 正在驗證卡片持有者 ---")
-            card_ownership, card_ownership_message = verify_card_ownership(username, uid)
+            device_token = session.token
+            card_ownership, card_ownership_message = verify_card_ownership(session.username, uid)
+            record_tap(uid, ctr, "valid" if card_ownership else "ownership", flag, session.username)
             if not card_ownership:
                 print(f"{card_ownership_message}. Jumping to Step 7...")
                 next_new_url = helper.generate_next_sdm_url(helper.BASE_URL, given_url)
@@ -200,29 +268,49 @@ def main():
 
             while True:
                 # After login or signup - Simulate user "using the application"
-                print(f"\n{current_user} 正在使用該應用程式中...")
-                time.sleep(5)
+                print(f"\n{session.username} 正在使用該應用程式中...")
+                pause(5)
 
                 # Step 6 Logout choice:
-                # Ask the user if they want to logout
-                logout_choice = input("\nDo you want to 登出? (yes/no): ").strip().lower()
+                # Ask the user if they want to logout ('stay' = leave but keep the session on this device)
+                logout_choice = input("\nDo you want to 登出? (yes/no/stay): ").strip().lower()
                 if logout_choice == 'yes':
-                    logout_message = logout()
+                    logout_message = logout(session)
+                    device_token = None
                     print(f"\n--- Step 6: {logout_message} - Jumping to Step 7... ---")
                     break  # Exit the application loop and restart from Step 1
+                if logout_choice == 'stay':
+                    print(f"\n--- Step 6: {session.username} 保持登入 - Jumping to Step 7... ---")
+                    break
             
-            time.sleep(2)
+            pause(2)
 
             # Step 7: Generate and display the next SDM URL (Always happens)
             print("\n--- Step 7: Generating Next SDM URL ---")
             next_new_url = helper.generate_next_sdm_url(helper.BASE_URL, given_url)
             print(f"\nStep 7 - Next SDM URL: {next_new_url}")
-            time.sleep(2)
+            pause(2)
 
         except ValueError as e:
             print(f"Error: {e}")
             break # Exit loop if an error occurs
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interactive SDM tap verification demo.")
+    parser.add_argument("--no-sleep", action="store_true", help="skip the demo delays between steps")
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help="write latency histograms / counters here on exit (.json or Prometheus text)")
+    parser.add_argument("--tap-log", default=tap_log.TAP_LOG_DIR,
+                        help="append every tap's outcome to the event log in this directory")
+    args = parser.parse_args()
+    if args.tap_log:
+        event_log = tap_log.TapLog(args.tap_log)
+
     # Run the test script
-    main()
\ No newline at end of file
+    try:
+        main(pause=(lambda _: None) if args.no_sleep else time.sleep)
+    finally:
+        if args.metrics_file:
+            metrics.dump(args.metrics_file)
+        if event_log is not None:
+            event_log.close()
\ No newline at end of file
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# HDR 風格的 log-linear bucket: 每個 2 的次方再切成 2**SUB_BUCKET_BITS 格，
+# 相對誤差 < 1 / 2**SUB_BUCKET_BITS (6.25%)，記錄一個值只要幾個整數運算
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 40  # 2**40 µs ≈ 12 天，超過的值算進最後一格
+BUCKETS = (MAX_EXPONENT + 1) * SUB_BUCKETS
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+METRICS_FILE = os.environ.get("SAKURA_METRICS_FILE")
+
+
+def _bucket_index(value):
+    """Bucket of a non-negative integer value (microseconds)."""
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    index = (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+    return min(index, BUCKETS - 1)
+
+
+def _bucket_upper_bound(index):
+    """Largest value (microseconds) that falls into bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    Fixed-size latency histogram (values in seconds, stored in µs buckets).
+
+    Recording is O(1) with no allocation; quantiles walk the bucket array and
+    are accurate to the bucket width.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        # _bucket_index() inline (hot path)
+        value = int(seconds * 1000000)
+        if value < SUB_BUCKETS:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+            if index >= BUCKETS:
+                index = BUCKETS - 1
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            if seconds < self.min:
+                self.min = seconds
+
+    def clear(self):
+        with self._lock:
+            self.counts[:] = [0] * BUCKETS
+            self.count = 0
+            self.total = 0.0
+            self.min = float("inf")
+            self.max = 0.0
+
+    def quantile(self, q):
+        """Latency (seconds) at quantile q (0..1), or None if nothing was recorded."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(q * self.count + 0.5))
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return min(_bucket_upper_bound(index) / 1e6, self.max)
+        return self.max
+
+    def merge(self, other):
+        with self._lock:
+            for index, n in enumerate(other.counts):
+                if n:
+                    self.counts[index] += n
+            self.count += other.count
+            self.total += other.total
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def summary(self):
+        summary = {"count": self.count, "sum_s": self.total,
+                   "min_s": self.min if self.count else None, "max_s": self.max if self.count else None}
+        for q in QUANTILES:
+            summary[f"p{q * 100:g}"] = self.quantile(q)
+        return summary
+
+
+class Metrics:
+    """
+    Named histograms and counters with optional labels.
+
+    A metric is identified by its name plus a sorted tuple of label pairs, e.g.
+    observe("sakura_verify_stage_seconds", 0.0002, stage="enc"). Snapshots can be
+    written as JSON or Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).record(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        histogram = self.histogram(name, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.record(time.perf_counter() - start)
+
+    def reset(self):
+        """Zero everything; histograms are cleared in place so cached references stay valid."""
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.clear()
+            self.counters.clear()
+
+    ########## Export ##########
+
+    def to_dict(self):
+        with self._lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        return {
+            "timestamp": time.time(),
+            "histograms": [{"name": name, "labels": dict(labels), **histogram.summary()}
+                           for (name, labels), histogram in histograms],
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in counters],
+        }
+
+    def to_prometheus(self):
+        """Prometheus text format; histograms are exported as summaries (quantiles, _sum, _count)."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                if value is not None:
+                    lines.append(f"{name}{_labels(labels + (('quantile', f'{q:g}'),))} {value:.9g}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.total:.9g}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, fmt=None):
+        """Write a snapshot to `path` (format from `fmt` or the extension: .json, otherwise Prometheus)."""
+        fmt = fmt or ("json" if path.endswith(".json") else "prometheus")
+        text = json.dumps(self.to_dict(), indent=2) if fmt == "json" else self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)  # 讀取端不會看到寫到一半的檔案
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + inner + "}"
+
+
+class PeriodicDumper(threading.Thread):
+    """Dump `metrics` to `path` every `interval` seconds (and once more on stop)."""
+
+    def __init__(self, metrics, path, interval=10.0, fmt=None):
+        super().__init__(name="metrics-dump", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.metrics.dump(self.path, self.fmt)
+
+    def stop(self):
+        self.stop_event.set()
+        self.metrics.dump(self.path, self.fmt)
+
+
+# Process-wide registry
+REGISTRY = Metrics()
+
+observe = REGISTRY.observe
+inc = REGISTRY.inc
+timer = REGISTRY.timer
+dump = REGISTRY.dump
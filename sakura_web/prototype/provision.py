@@ -0,0 +1,218 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import helper
+import sdm
+from card_table import pack_uid
+
+CHUNK_SIZE = 20000
+MANUFACTURER = 0x04  # NXP: NTAG 424 DNA 的 UID 第一個 byte 都是 04
+MANIFEST_FORMATS = ("csv", "ndjson")
+MANIFEST_FIELDS = ("number", "uid", "ctr", "url")
+
+
+class UIDAllocator:
+    """
+    Random 7-byte UIDs (manufacturer byte + 48 random bits) that never repeat.
+
+    Every key handed out or already in the database is kept in one sorted
+    uint64 array (8 bytes per card), so membership of a whole candidate batch
+    is one searchsorted() and the set of used keys can hold tens of millions
+    of cards. New keys are merged in with np.insert at their searchsorted()
+    positions, so a chunk costs one pass over `used` instead of a re-sort.
+    """
+
+    def __init__(self, existing=(), seed=None, manufacturer=MANUFACTURER):
+        self.rng = np.random.default_rng(seed)
+        self.prefix = np.uint64(manufacturer << 48)
+        self.used = np.unique(np.asarray(existing, dtype=np.uint64))
+
+    @classmethod
+    def from_store(cls, seed=None):
+        """Allocator that avoids every UID already in the database."""
+        keys = (pack_uid(uid) for uid in helper.get_all_uid())
+        return cls(np.fromiter((key for key in keys if key is not None), dtype=np.uint64), seed)
+
+    def allocate(self, count):
+        """`count` new unique keys as a uint64 array, in random order."""
+        fresh = np.empty(0, dtype=np.uint64)
+        while len(fresh) < count:
+            need = count - len(fresh)
+            candidates = self.prefix | self.rng.integers(0, 1 << 48, size=need + need // 64 + 16, dtype=np.uint64)
+            # 同一批裡重複的只留第一個，再去掉已經用過的
+            _, first = np.unique(candidates, return_index=True)
+            candidates = candidates[np.sort(first)]
+            positions = np.searchsorted(self.used, candidates).clip(max=max(len(self.used) - 1, 0))
+            taken = self.used[positions] == candidates if len(self.used) else np.zeros(len(candidates), dtype=bool)
+            fresh = np.concatenate([fresh, candidates[~taken][:need]])
+        merged = np.sort(fresh)
+        self.used = np.insert(self.used, np.searchsorted(self.used, merged), merged)
+        return fresh
+
+
+def _manifest_rows(start_number, keys, fmt):
+    """
+    Worker side: SDM URLs (sdm.compute_sdm_macs) for a chunk of keys, returned as
+    the UIDs plus the chunk's manifest text, so only two objects cross the
+    process boundary.
+    """
+    uids = [f"{key:014X}" for key in keys.tolist()]
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n") if fmt == "csv" else None
+    for number, (uid, enc) in enumerate(zip(uids, sdm.compute_sdm_macs(uids, 0)), start_number):
+        row = (number, uid, 0, helper.format_sdm_url(number, uid, 0, enc))
+        if writer:
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(dict(zip(MANIFEST_FIELDS, row))) + "\n")
+    return uids, out.getvalue()
+
+
+def manifest_format(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def _read_partial_manifest(path, fmt):
+    """
+    (numbers, uids, complete bytes) of an unfinished manifest; a torn last line
+    is not counted, so appending after `complete` bytes continues the batch.
+    """
+    numbers, uids = [], []
+    complete = 0
+    with open(path, "rb") as file:
+        for position, line in enumerate(file):
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            if fmt == "csv":
+                if position == 0:
+                    continue  # header
+                number, uid = next(csv.reader([line.decode()]))[:2]
+            else:
+                row = json.loads(line)
+                number, uid = row["number"], row["uid"]
+            numbers.append(int(number))
+            uids.append(uid)
+    return numbers, uids, complete
+
+
+def provision(count, manifest_path, start_number=1, workers=None, chunk_size=CHUNK_SIZE, fmt=None, seed=None,
+              allocator=None, progress=None, resume=False):
+    """
+    Create `count` cards with unique random UIDs, bulk-insert them into the
+    database in chunks and stream a manifest (number, uid, ctr, SDM URL) for
+    the encoding station to `manifest_path` (CSV, or NDJSON for .ndjson /
+    .jsonl or fmt="ndjson").
+
+    UIDs are allocated up front in the parent (vectorised); the SDM MACs are
+    computed by a pool of `workers` processes (default: CPU count, 1 = in
+    process). At most 2 * workers chunks are in flight, so memory stays
+    bounded whatever the batch size, and chunks are written in order.
+
+    The manifest is built in `manifest_path + ".tmp"` and renamed when the
+    batch is done. Each chunk is appended and fsynced there before its cards
+    are inserted, so the partial manifest always lists every card the batch
+    has committed. If a run dies, `resume=True` picks the batch up from that
+    file: cards listed but not yet inserted are inserted, and the rest of the
+    batch is created. Without `resume`, a leftover .tmp raises FileExistsError.
+    """
+    fmt = fmt or manifest_format(manifest_path)
+    if fmt not in MANIFEST_FORMATS:
+        raise ValueError(f"Unknown manifest format: {fmt}")
+    workers = workers or os.cpu_count() or 1
+
+    written = 0
+    tmp_path = f"{manifest_path}.tmp"
+    if os.path.exists(tmp_path):
+        if not resume:
+            raise FileExistsError(f"{tmp_path} is left from an unfinished batch; resume it or remove it")
+        numbers, uids, complete = _read_partial_manifest(tmp_path, fmt)
+        if numbers and numbers != list(range(start_number, start_number + len(numbers))):
+            raise ValueError(f"{tmp_path} does not continue from number {start_number}")
+        # 寫進 manifest 但還沒寫進資料庫的卡片 (在 add_cards 之前中斷)
+        missing = [uid for uid, card in helper.get_cards(uids).items() if card is None]
+        if missing:
+            helper.add_cards(missing)
+        written = len(uids)
+        with open(tmp_path, "r+b") as manifest:
+            manifest.truncate(complete)
+        mode = "a"
+    else:
+        mode = "w"
+    allocator = allocator or UIDAllocator.from_store(seed)
+
+    def chunks():
+        for start in range(written, count, chunk_size):
+            keys = allocator.allocate(min(chunk_size, count - start))
+            yield start_number + start, keys
+
+    with open(tmp_path, mode, newline="") as manifest:
+        if fmt == "csv" and manifest.tell() == 0:
+            manifest.write(",".join(MANIFEST_FIELDS) + "\n")
+
+        def store(result):
+            nonlocal written
+            uids, text = result
+            # 先寫 manifest 再寫資料庫: 中斷後 .tmp 裡一定有已經建立的卡片
+            manifest.write(text)
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            helper.add_cards(uids)
+            written += len(uids)
+            if progress:
+                progress(written, count)
+
+        if workers == 1:
+            for start, keys in chunks():
+                store(_manifest_rows(start, keys, fmt))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for start, keys in chunks():
+                    pending.append(executor.submit(_manifest_rows, start, keys, fmt))
+                    if len(pending) >= 2 * workers:
+                        store(pending.popleft().result())
+                while pending:
+                    store(pending.popleft().result())
+        manifest.flush()
+        os.fsync(manifest.fileno())
+    # 完整的 manifest 最後才出現: 編碼站不會讀到一半的檔案
+    os.replace(tmp_path, manifest_path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a batch of cards and a manifest for the encoding station.")
+    parser.add_argument("count", type=int, help="number of cards to create")
+    parser.add_argument("manifest", help="manifest to write (.csv, or .ndjson / .jsonl)")
+    parser.add_argument("--start-number", type=int, default=1, help="number in the first card's URL")
+    parser.add_argument("--workers", type=int, default=None, help="processes computing SDM MACs (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--format", choices=MANIFEST_FORMATS, default=None)
+    parser.add_argument("--seed", type=int, default=None, help="seed the UID generator (reproducible test batches)")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted batch from its .tmp manifest")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def progress(done, total):
+        elapsed = time.perf_counter() - start
+        print(f"\r{done}/{total} cards ({done / max(elapsed, 1e-9):.0f} cards/s)", end="", file=sys.stderr)
+
+    written = provision(args.count, args.manifest, args.start_number, args.workers, args.chunk_size, args.format,
+                        args.seed, progress=progress, resume=args.resume)
+    helper.close_store()
+    print(f"\nCreated {written} cards in {time.perf_counter() - start:.1f}s -> {args.manifest}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
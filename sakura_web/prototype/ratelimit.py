@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by an arbitrary hashable key.
+
+    Each key may spend `burst` tokens at once and regains `rate` tokens per
+    second. Only the `max_keys` most recently used buckets are kept; an
+    evicted key simply starts over with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, last refill time]
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def allowed(self, key):
+        """True if `key` has at least one token left (nothing is spent)."""
+        with self._lock:
+            if key not in self._buckets:
+                return True
+            return self._bucket(key, self.clock())[0] >= 1
+
+    def charge(self, key, cost=1):
+        """Spend `cost` tokens (the bucket may go negative, which delays the refill)."""
+        with self._lock:
+            bucket = self._bucket(key, self.clock())
+            bucket[0] = max(bucket[0] - cost, -self.burst)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RejectLimiter:
+    """
+    Throttle sources that keep sending taps which get rejected.
+
+    Only rejected taps spend tokens, so a source tapping real cards is never
+    slowed down. There is one bucket per source (floods of random UIDs) and a
+    smaller one per (source, UID) (ENC guessing against a single card). Both
+    are keyed by source, so a flood from one address cannot lock a card out
+    for everyone else.
+    """
+
+    def __init__(self, source_rate=5.0, source_burst=50, card_rate=0.5, card_burst=10, max_keys=100000,
+                 clock=time.monotonic):
+        self.sources = TokenBucketLimiter(source_rate, source_burst, max_keys, clock)
+        self.cards = TokenBucketLimiter(card_rate, card_burst, max_keys, clock)
+
+    def allowed(self, source, uid=None):
+        if not self.sources.allowed(source):
+            return False
+        return uid is None or self.cards.allowed((source, uid))
+
+    def reject(self, source, uid=None):
+        """Record a rejected tap from `source` (for `uid`, if the URL could be parsed)."""
+        self.sources.charge(source)
+        if uid is not None:
+            self.cards.charge((source, uid))
@@ -0,0 +1,194 @@
+import functools
+import hmac
+import os
+
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+
+# NTAG 424 DNA SDM keys (AES-128). 預設為出廠的全 0 key，正式環境請用環境變數設定
+SDM_META_READ_KEY = bytes.fromhex(os.environ.get("SAKURA_SDM_META_READ_KEY", "00" * 16))
+SDM_FILE_READ_KEY = bytes.fromhex(os.environ.get("SAKURA_SDM_FILE_READ_KEY", "00" * 16))
+
+# 每張卡的 SDMFileRead key = CMAC(master, 0x01 || UID || SYSTEM_IDENTIFIER)
+SYSTEM_IDENTIFIER = b"sakura"
+
+# 熱門卡片的 per-UID key 留在 cache 裡，不用每次 tap 都重新 diversify
+KEY_CACHE_SIZE = 65536
+
+UID_LENGTH = 7
+PICC_DATA_TAG = 0xC7  # UID mirroring + SDMReadCtr mirroring, 7-byte UID
+SV2_PREFIX = bytes([0x3C, 0xC3, 0x00, 0x01, 0x00, 0x80])
+ZERO_IV = bytes(16)
+
+MASK_128 = (1 << 128) - 1
+CMAC_PAD_BLOCK = 0x80 << 120  # CMAC padding of an empty message
+
+
+def _cmac(key, data):
+    return CMAC.new(key, msg=data, ciphermod=AES).digest()
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def diversify_key(uid):
+    """Derive the per-card SDMFileRead key from the master key (uid: 7 bytes)."""
+    return _cmac(SDM_FILE_READ_KEY, b"\x01" + uid + SYSTEM_IDENTIFIER)
+
+
+def _dbl(value):
+    """Doubling in GF(2^128), used to derive the CMAC subkeys K1 / K2."""
+    value <<= 1
+    return (value & MASK_128) ^ 0x87 if value >> 128 else value
+
+
+def _xor_block(block, value):
+    return (int.from_bytes(block, "big") ^ value).to_bytes(16, "big")
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _card_cipher(uid):
+    """Cached per-card AES-ECB encryptor and CMAC subkey K1 for the diversified key."""
+    encrypt = AES.new(diversify_key(uid), AES.MODE_ECB).encrypt
+    return encrypt, _dbl(int.from_bytes(encrypt(ZERO_IV), "big"))
+
+
+def session_mac_key(card_key, uid, ctr):
+    """SesSDMFileReadMAC = CMAC(K_SDMFileRead, 3CC3 0001 0080 || UID || SDMReadCtr(LSB first))."""
+    return _cmac(card_key, SV2_PREFIX + uid + ctr.to_bytes(3, "little"))
+
+
+def truncate_mac(mac):
+    """SDM MACs keep the odd-indexed bytes of the 16-byte CMAC (8 bytes)."""
+    return mac[1::2]
+
+
+def _sdm_mac(uid, ctr):
+    """
+    Same result as truncate_mac(CMAC(session_mac_key(...), b"")), with the CMACs
+    unrolled into raw AES block operations: SV2 is exactly one complete block, so
+    its CMAC is E(K, SV2 ^ K1), and the empty-message CMAC is E(Ks, pad ^ K2).
+    """
+    encrypt, k1 = _card_cipher(uid)
+    session_key = encrypt(_xor_block(SV2_PREFIX + uid + ctr.to_bytes(3, "little"), k1))
+    session_encrypt = AES.new(session_key, AES.MODE_ECB).encrypt
+    k2 = _dbl(_dbl(int.from_bytes(session_encrypt(ZERO_IV), "big")))
+    # SDMMACInputOffset == SDMMACOffset，所以 MAC 的輸入資料是空字串
+    return truncate_mac(session_encrypt((CMAC_PAD_BLOCK ^ k2).to_bytes(16, "big")))
+
+
+def _uid_bytes(uid):
+    """Hex UID from the URL -> 7 bytes, or None if it is malformed."""
+    try:
+        uid_bytes = bytes.fromhex(uid)
+    except ValueError:
+        return None
+    return uid_bytes if len(uid_bytes) == UID_LENGTH else None
+
+
+def compute_sdm_mac(uid, ctr):
+    """Compute the ENC (SDMMAC) a genuine card mirrors into its URL, as lowercase hex."""
+    uid_bytes = _uid_bytes(uid)
+    if uid_bytes is None:
+        raise ValueError(f"UID 格式錯誤: {uid}")
+    return _sdm_mac(uid_bytes, ctr).hex()
+
+
+def compute_sdm_macs(uids, ctr=0):
+    """
+    compute_sdm_mac() for many cards at one counter (bulk provisioning). The
+    per-card key diversification CMACs all run as a single AES-ECB call with
+    the master key, and the per-card key caches are left alone.
+    """
+    uid_list = []
+    for uid in uids:
+        uid_bytes = _uid_bytes(uid)
+        if uid_bytes is None:
+            raise ValueError(f"UID 格式錯誤: {uid}")
+        uid_list.append(uid_bytes)
+
+    # diversify_key(): CMAC(master, 0x01 || UID || SYSTEM_IDENTIFIER)，訊息不到一個 block -> 補位後 XOR K2
+    master_encrypt = AES.new(SDM_FILE_READ_KEY, AES.MODE_ECB).encrypt
+    master_k2 = _dbl(_dbl(int.from_bytes(master_encrypt(ZERO_IV), "big")))
+    tail = SYSTEM_IDENTIFIER + b"\x80"
+    if 1 + UID_LENGTH + len(tail) > 16:
+        card_keys = [diversify_key(uid) for uid in uid_list]
+    else:
+        tail = tail.ljust(16 - 1 - UID_LENGTH, b"\x00")
+        blocks = b"".join(_xor_block(b"\x01" + uid + tail, master_k2) for uid in uid_list)
+        keys = master_encrypt(blocks)
+        card_keys = [keys[i:i + 16] for i in range(0, len(keys), 16)]
+
+    counter = ctr.to_bytes(3, "little")
+    macs = []
+    for uid, card_key in zip(uid_list, card_keys):
+        encrypt = AES.new(card_key, AES.MODE_ECB).encrypt
+        k1 = _dbl(int.from_bytes(encrypt(ZERO_IV), "big"))
+        session_encrypt = AES.new(encrypt(_xor_block(SV2_PREFIX + uid + counter, k1)), AES.MODE_ECB).encrypt
+        k2 = _dbl(_dbl(int.from_bytes(session_encrypt(ZERO_IV), "big")))
+        macs.append(truncate_mac(session_encrypt((CMAC_PAD_BLOCK ^ k2).to_bytes(16, "big"))).hex())
+    return macs
+
+
+def verify_sdm_mac(uid, ctr, enc):
+    """Check the ENC of a tap in constant time."""
+    uid_bytes = _uid_bytes(uid)
+    if uid_bytes is None or not 0 <= ctr <= 0xFFFFFF:
+        return False
+    try:
+        expected = bytes.fromhex(enc)
+    except ValueError:
+        return False
+    return hmac.compare_digest(_sdm_mac(uid_bytes, ctr), expected)
+
+
+def verify_batch(taps):
+    """
+    Verify many (uid, ctr, enc) taps in one pass and return a list of booleans.
+    UIDs are decoded once per card rather than once per tap.
+    """
+    uids = {}
+    results = []
+    for uid, ctr, enc in taps:
+        uid_bytes = uids.get(uid)
+        if uid_bytes is None:
+            uid_bytes = uids[uid] = _uid_bytes(uid) or False
+        if not uid_bytes or not 0 <= ctr <= 0xFFFFFF:
+            results.append(False)
+            continue
+        try:
+            expected = bytes.fromhex(enc)
+        except ValueError:
+            results.append(False)
+            continue
+        results.append(hmac.compare_digest(_sdm_mac(uid_bytes, ctr), expected))
+    return results
+
+
+########## Encrypted PICCData (picc_data=...) ##########
+
+def decrypt_picc_data(picc_data):
+    """
+    Decrypt a 16-byte encrypted PICCData mirror with the SDMMetaRead key.
+    Returns (uid, ctr) with the UID as uppercase hex.
+    """
+    plain = AES.new(SDM_META_READ_KEY, AES.MODE_CBC, iv=ZERO_IV).decrypt(bytes.fromhex(picc_data))
+    if plain[0] != PICC_DATA_TAG:
+        raise ValueError("PICCData 格式錯誤")
+    uid = plain[1:1 + UID_LENGTH]
+    ctr = int.from_bytes(plain[1 + UID_LENGTH:4 + UID_LENGTH], "little")
+    return uid.hex().upper(), ctr
+
+
+def encrypt_picc_data(uid, ctr):
+    """Build the encrypted PICCData a card would mirror (for test URL generation)."""
+    plain = bytes([PICC_DATA_TAG]) + bytes.fromhex(uid) + ctr.to_bytes(3, "little")
+    plain += os.urandom(16 - len(plain))
+    return AES.new(SDM_META_READ_KEY, AES.MODE_CBC, iv=ZERO_IV).encrypt(plain).hex().upper()
+
+
+def verify_picc_data(picc_data, enc):
+    """Decrypt PICCData and verify its SDMMAC. Returns (valid, uid, ctr)."""
+    try:
+        uid, ctr = decrypt_picc_data(picc_data)
+    except ValueError:
+        return False, None, None
+    return verify_sdm_mac(uid, ctr, enc), uid, ctr
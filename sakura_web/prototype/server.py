@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import helper
+import main
+import metrics
+import ratelimit
+import tap_log
+
+# GET /a/<num>?uid=&ctr=&enc=  (帶 session token 時也檢查/登記卡片持有者)
+TAP_PATH = re.compile(r"^/a/\d+$")
+METRICS_PATH = "/metrics"  # Prometheus text format
+# POST {"username": ..., "password": ...} -> {"token": ...}; POST /logout 帶 token
+LOGIN_PATH = "/login"
+LOGOUT_PATH = "/logout"
+
+MAX_HEADER_BYTES = 8192
+MAX_BODY_BYTES = 4096
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+def session_token(headers):
+    """Token from an "Authorization: Bearer <token>" header, or None."""
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+
+class VerificationServer:
+    """
+    Minimal asyncio HTTP/1.1 server for SDM tap URLs.
+
+    The database stays open for the lifetime of the process (helper.get_store()),
+    connections are kept alive, and each tap runs main.verify_tap on a small thread
+    pool so storage I/O (log fsync, SQLite) never stalls the event loop.
+    Clients whose taps keep getting rejected are throttled per peer address
+    (main.reject_limiter) and receive 429 until their bucket refills. Every
+    tap's outcome goes to main.event_log when --tap-log is given.
+
+    Card ownership is only checked for taps that carry a session token
+    (Authorization: Bearer, from POST /login): the username comes from
+    main.sessions, never from the request, so a caller cannot register a card
+    to somebody else. Each login runs the KDF once on the thread pool; later
+    taps in the same session only look the token up.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, workers=8):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="verify")
+        self._server = None
+
+    async def start(self):
+        helper.get_store()  # 先把資料庫載入記憶體，第一個 tap 不用等
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        return self._server
+
+    async def serve_forever(self):
+        server = await self.start()
+        print(f"Verification server listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        source = peer[0] if peer else None
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                if len(head) > MAX_HEADER_BYTES:
+                    await self.respond(writer, 400, {"message": "Header too large"}, keep_alive=False)
+                    break
+
+                request_line, _, header_block = head.decode("latin-1").partition("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self.respond(writer, 400, {"message": "Malformed request line"}, keep_alive=False)
+                    break
+                headers = {}
+                for line in header_block.split("\r\n"):
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_BYTES:
+                    await self.respond(writer, 413 if length > 0 else 400, {"message": "Bad request body"},
+                                       keep_alive=False)
+                    break
+                try:
+                    payload = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    status, body = await self.dispatch(method, target, source, headers, payload)
+                except Exception:
+                    # 資料庫錯誤、tap log 已關閉 ...: 回 500 並關掉連線，不要讓例外丟出 handler
+                    print(f"Error handling {method} {target}:", file=sys.stderr)
+                    traceback.print_exc()
+                    metrics.inc("sakura_server_errors_total")
+                    status, body, keep_alive = 500, {"message": "Internal server error"}, False
+                await self.respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, source=None, headers=None, payload=b""):
+        headers = headers or {}
+        parts = urlsplit(target)
+        if parts.path in (LOGIN_PATH, LOGOUT_PATH):
+            if method != "POST":
+                return 405, {"message": "Use POST"}
+            if parts.path == LOGIN_PATH:
+                return await self.login(payload, source)
+            revoked = main.sessions.revoke(session_token(headers))
+            return (200, {"message": "Logged out"}) if revoked else (401, {"message": "Not logged in"})
+
+        if method != "GET":
+            return 405, {"message": "Only GET is supported"}
+        if parts.path == METRICS_PATH:
+            return 200, metrics.REGISTRY.to_prometheus()
+        if not TAP_PATH.match(parts.path):
+            return 404, {"message": "Not found"}
+
+        username = None
+        token = session_token(headers)
+        if token is not None:
+            session = main.sessions.get(token)
+            if session is None:
+                return 401, {"message": "Session expired or invalid, please log in again"}
+            username = session.username
+        elif "user" in parse_qs(parts.query):
+            return 401, {"message": "Log in (POST /login) and send the session token to check card ownership"}
+
+        url = f"{helper.BASE_URL}{target}"
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, main.verify_tap, url, username, source)
+        if result["stage"] == "rate_limit":
+            return 429, result
+        return (400 if result["stage"] == "parse" else 200), result
+
+    async def login(self, payload, source=None):
+        try:
+            credentials = json.loads(payload)
+            username, password = credentials["username"], credentials["password"]
+        except (ValueError, TypeError, KeyError):
+            return 400, {"message": "Expected a JSON body with username and password"}
+        limiter = main.reject_limiter if source is not None else None
+        if limiter is not None and not limiter.allowed(source):
+            return 429, {"message": "審核失敗 - 太多失敗的請求，請稍後再試"}
+
+        # scrypt 很慢，不能在 event loop 上跑
+        loop = asyncio.get_running_loop()
+        username = await loop.run_in_executor(self.executor, main.credentials.authenticate, username, password)
+        if username is None:
+            if limiter is not None:
+                limiter.reject(source)
+            return 401, {"message": "登入失敗: 錯誤用戶名 or 密碼"}
+        session = main.sessions.create(username)
+        return 200, {"token": session.token, "username": username, "expires_in": main.sessions.ttl}
+
+    async def respond(self, writer, status, body, keep_alive=True):
+        if isinstance(body, str):
+            payload, content_type = body.encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            payload, content_type = json.dumps(body, ensure_ascii=False).encode(), "application/json; charset=utf-8"
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode() + payload)
+        await writer.drain()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Serve SDM tap verification over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help="also dump metrics to this file (.json or Prometheus text)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0)
+    parser.add_argument("--reject-rate", type=float, default=5.0,
+                        help="rejected taps per second a client may keep sending before it gets 429 (0 = no limit)")
+    parser.add_argument("--reject-burst", type=int, default=50)
+    parser.add_argument("--tap-log", default=tap_log.TAP_LOG_DIR,
+                        help="append every tap's outcome to the event log in this directory (see tap_analytics.py)")
+    parser.add_argument("--tap-log-segment-mb", type=int, default=tap_log.MAX_SEGMENT_BYTES // 2**20,
+                        help="start a new log segment once the current one reaches this size")
+    args = parser.parse_args()
+
+    if args.reject_rate > 0:
+        main.reject_limiter = ratelimit.RejectLimiter(args.reject_rate, args.reject_burst)
+    if args.tap_log:
+        main.event_log = tap_log.TapLog(args.tap_log, max_bytes=args.tap_log_segment_mb * 2**20)
+
+    dumper = None
+    if args.metrics_file:
+        dumper = metrics.PeriodicDumper(metrics.REGISTRY, args.metrics_file, args.metrics_interval)
+        dumper.start()
+
+    server = VerificationServer(args.host, args.port, args.workers)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        if dumper:
+            dumper.stop()
+        if main.event_log is not None:
+            main.event_log.close()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,183 @@
+"""
+Binary snapshot format (little-endian), version 1:
+
+    header     magic, version, index bits, card / user counts, Bloom filter parameters
+    sections   (offset, length) for each of SECTIONS, every section 64-byte aligned
+    keys       uint64[rows]       packed 7-byte UIDs, in row order
+    counters   uint32[rows]
+    flags      bitset[rows]       registered bit per row
+    index      int32[2**bits]     open-addressing index (card_table.build_index)
+    bloom      Bloom filter bits over all card UIDs
+    extra      JSON list of cards whose UID does not pack (usually empty)
+    users      USER records: (offset, length) of username, password and card list in `strings`
+    strings    UTF-8 string table; a user's card list is its UIDs joined by NUL
+
+The card sections are used in place through a copy-on-write mapping, so opening
+a snapshot costs the same whatever the card count and a lookup only pages in
+what it touches. Changes made in memory never reach the file; they go to the
+change log and a new snapshot is written on compaction.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+from bloom import BloomFilter
+from card_table import CardTable
+
+
+MAGIC = b"SAKURADB"
+VERSION = 1
+ALIGNMENT = 64
+
+HEADER = struct.Struct("<8sHHIQQQQQId")
+SECTIONS = ("keys", "counters", "flags", "index", "bloom", "extra", "users", "strings")
+SECTION = struct.Struct("<QQ")
+USER = struct.Struct("<IIIIII")
+
+CARD_SEPARATOR = "\0"
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _column(buffer, typecode, dtype):
+    """Typed view of a little-endian section; copied (byte-swapped) on big-endian hosts."""
+    if sys.byteorder == "little":
+        return buffer.cast(typecode)
+    return array(typecode, np.frombuffer(buffer, dtype=dtype).astype(dtype.newbyteorder("=")).tobytes())
+
+
+def _little_endian(buffer, dtype):
+    if sys.byteorder == "little":
+        return buffer
+    return np.frombuffer(buffer, dtype=dtype).astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+
+
+########## Read ##########
+
+def read(path):
+    """
+    Map a snapshot into a {"cards", "users", "owners", "uid_filter", "mmap"} state.
+    Raises FileNotFoundError if it does not exist, ValueError if it is not a
+    snapshot of a supported version. Release the mapping with close(state).
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            raise ValueError(f"{path}: not a binary snapshot")
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    (magic, version, _, index_bits, rows, num_users,
+     bloom_capacity, bloom_bits, bloom_count, bloom_hashes, bloom_error_rate) = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != VERSION:
+        mapped.close()
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a binary snapshot")
+        raise ValueError(f"{path}: unsupported snapshot version {version}")
+
+    view = memoryview(mapped)
+    sections = {}
+    for i, name in enumerate(SECTIONS):
+        offset, length = SECTION.unpack_from(mapped, HEADER.size + i * SECTION.size)
+        sections[name] = view[offset:offset + length]
+
+    extra = {card["uid"]: card for card in json.loads(bytes(sections["extra"]) or b"[]")}
+    cards = CardTable.from_columns(_column(sections["keys"], "Q", np.dtype("<u8")),
+                                   _column(sections["counters"], "I", np.dtype("<u4")),
+                                   sections["flags"], rows,
+                                   _column(sections["index"], "i", np.dtype("<i4")), extra)
+    if len(cards.index) != 1 << index_bits:
+        raise ValueError(f"{path}: corrupt card index")
+    uid_filter = BloomFilter.from_buffer(sections["bloom"], bloom_capacity, bloom_error_rate,
+                                         bloom_bits, bloom_hashes, bloom_count)
+
+    users, owners = {}, {}
+    strings = sections["strings"]
+    for name_at, name_len, password_at, password_len, cards_at, cards_len in USER.iter_unpack(sections["users"]):
+        username = str(strings[name_at:name_at + name_len], "utf-8")
+        card_list = str(strings[cards_at:cards_at + cards_len], "utf-8")
+        user_cards = card_list.split(CARD_SEPARATOR) if card_list else []
+        users[username] = {"username": username,
+                           "password": str(strings[password_at:password_at + password_len], "utf-8"),
+                           "cards": user_cards}
+        for uid in user_cards:
+            owners[uid] = username
+    if len(users) != num_users:
+        raise ValueError(f"{path}: corrupt user section")
+    return {"cards": cards, "users": users, "owners": owners, "uid_filter": uid_filter, "mmap": mapped}
+
+
+def close(state):
+    """
+    Unmap a snapshot returned by read(). The card table and Bloom filter are
+    views into the mapping, so the state is emptied first and must not be used
+    afterwards. A state that is not mapped (e.g. read from JSON) is left alone.
+    """
+    mapped = state.pop("mmap", None)
+    if mapped is None:
+        return
+    state.clear()  # 先放掉 CardTable 欄位和 Bloom filter bits 這些 view，mmap 才能 close
+    try:
+        mapped.close()
+    except BufferError:
+        pass  # 還有別人拿著 view (例如正在查詢的 thread): 等它們被回收時再 unmap
+
+
+########## Write ##########
+
+def write(path, state, uid_filter=None):
+    """Atomically write a state as a binary snapshot (the Bloom filter is rebuilt unless given)."""
+    cards = state["cards"]
+    rows = cards.rows
+    if uid_filter is None:
+        uid_filter = BloomFilter.from_keys(cards.extra, packed=cards.packed_keys())
+    index = memoryview(cards.index).cast("B")
+
+    strings = bytearray()
+    users = bytearray()
+
+    def intern(text):
+        data = text.encode("utf-8")
+        strings.extend(data)
+        return len(strings) - len(data), len(data)
+
+    for user in state["users"].values():
+        users += USER.pack(*intern(user["username"]), *intern(user["password"]),
+                           *intern(CARD_SEPARATOR.join(user["cards"])))
+
+    payloads = {
+        "keys": _little_endian(memoryview(cards.keys).cast("B")[:8 * rows], "=u8"),
+        "counters": _little_endian(memoryview(cards.counters).cast("B")[:4 * rows], "=u4"),
+        "flags": memoryview(cards.flags).cast("B")[:(rows + 7) // 8],
+        "index": _little_endian(index, "=i4"),
+        "bloom": memoryview(uid_filter.bits).cast("B"),
+        "extra": json.dumps(list(cards.extra.values())).encode() if cards.extra else b"",
+        "users": users,
+        "strings": strings,
+    }
+
+    offset = _align(HEADER.size + len(SECTIONS) * SECTION.size)
+    layout = []
+    for name in SECTIONS:
+        layout.append((offset, len(payloads[name])))
+        offset = _align(offset + len(payloads[name]))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, (len(index) // 4).bit_length() - 1, rows, len(state["users"]),
+                               uid_filter.capacity, uid_filter.num_bits, uid_filter.count,
+                               uid_filter.num_hashes, uid_filter.error_rate))
+        for section in layout:
+            file.write(SECTION.pack(*section))
+        for name, (offset, _) in zip(SECTIONS, layout):
+            file.seek(offset)
+            file.write(payloads[name])
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,371 @@
+import json
+import sqlite3
+import sys
+import threading
+
+from bloom import BloomFilter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    uid        TEXT PRIMARY KEY,
+    counter    INTEGER NOT NULL DEFAULT 0,
+    registered INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ownership (
+    uid      TEXT PRIMARY KEY REFERENCES cards(uid),
+    username TEXT NOT NULL REFERENCES users(username),
+    seq      INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ownership_username ON ownership(username, seq);
+CREATE INDEX IF NOT EXISTS ownership_seq ON ownership(seq);
+
+-- 每新增一張卡 +1 (upsert 撞到既有的 uid 不算)，讓 Bloom filter 分得出別的 process
+-- 只是更新了 counter，還是真的加了卡
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO meta (key, value) VALUES ('card_inserts', 0);
+
+CREATE TRIGGER IF NOT EXISTS count_card_inserts AFTER INSERT ON cards
+BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'card_inserts';
+END;
+"""
+
+# SQLite 預設一個 statement 最多 999 個 bound parameters
+MAX_BULK_PARAMS = 900
+
+# Hot-path queries. sqlite3 keeps a per-connection cache of prepared statements
+# keyed by SQL text, so these are compiled once and reused for every tap.
+SELECT_CARD = "SELECT counter, registered FROM cards WHERE uid = ?"
+SELECT_CARDS = "SELECT uid, counter, registered FROM cards WHERE uid IN ({})"
+SELECT_USER = "SELECT password FROM users WHERE username = ?"
+SELECT_USER_CARDS = "SELECT uid FROM ownership WHERE username = ? ORDER BY seq"
+SELECT_OWNERSHIP = "SELECT 1 FROM ownership WHERE uid = ? AND username = ?"
+SELECT_OWNER = "SELECT username FROM ownership WHERE uid = ?"
+UPDATE_COUNTER = "UPDATE cards SET counter = ? WHERE uid = ?"
+ADVANCE_COUNTER = "UPDATE cards SET counter = ? + 1 WHERE uid = ? AND counter <= ?"
+# upsert: OR REPLACE 會先刪掉舊的 row (ownership 的 foreign key 也會被檢查)
+INSERT_CARD = ("INSERT INTO cards (uid, counter, registered) VALUES (?, ?, ?) "
+               "ON CONFLICT(uid) DO UPDATE SET counter = excluded.counter, registered = excluded.registered")
+INSERT_USER = "INSERT INTO users (username, password) VALUES (?, ?)"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE username = ?"
+REGISTER_CARD = "UPDATE cards SET registered = 1 WHERE uid = ? AND registered = 0"
+INSERT_OWNERSHIP = "INSERT OR REPLACE INTO ownership (uid, username, seq) VALUES (?, ?, ?)"
+NEXT_OWNERSHIP_SEQ = "SELECT COALESCE(MAX(seq), 0) + 1 FROM ownership"  # ownership_seq index: O(log n)
+SELECT_CARD_INSERTS = "SELECT value FROM meta WHERE key = 'card_inserts'"
+
+
+class SQLiteStore:
+    """
+    SQLite backend with the same interface as storage.CardStore.
+
+    The database runs in WAL mode so several processes can verify taps against the
+    same file: readers never block, and writers are serialised by SQLite instead of
+    overwriting each other's snapshots.
+    """
+
+    def __init__(self, path, cached_statements=64, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False, cached_statements=cached_statements)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+        # Bloom filter 在背景建 (要掃過所有 UID)，開啟資料庫不用等
+        self.uid_filter = None
+        self.filter_ready = threading.Event()
+        self._filter_generation = 0
+        self._filter_version = self._filter_inserts = None
+        self._building = True
+        self._pending_uids = []
+        self._closing = False
+        self._filter_builder = threading.Thread(target=self._build_filter, name="uid-filter", daemon=True)
+        self._filter_builder.start()
+
+    ########## Lookups ##########
+
+    def may_contain(self, uid):
+        """
+        Bloom filter check: False means the card is definitely not in the database.
+
+        The filter only sees cards added through this connection. If another
+        process has added cards since it was built, a miss falls back to a
+        primary-key lookup while the filter is rebuilt in the background.
+        Until the filter has been built (filter_ready) every UID may exist.
+        """
+        uid_filter = self.uid_filter
+        if uid_filter is None or uid in uid_filter:
+            return True
+        with self._lock:
+            if self._filter_current():
+                return False
+            if self._conn.execute(SELECT_CARD, (uid,)).fetchone() is None:
+                return False
+            self._add_to_filter([uid])
+            return True
+
+    def get_card(self, uid):
+        """Return the card record for a UID, or None."""
+        with self._lock:
+            row = self._conn.execute(SELECT_CARD, (uid,)).fetchone()
+        if row is None:
+            return None
+        return {"uid": uid, "counter": row[0], "registered": bool(row[1])}
+
+    def get_cards(self, uids):
+        """Bulk lookup with chunked IN (...) queries: {uid: card record or None}."""
+        uids = list(dict.fromkeys(uids))
+        found = dict.fromkeys(uids)
+        with self._lock:
+            for i in range(0, len(uids), MAX_BULK_PARAMS):
+                chunk = uids[i:i + MAX_BULK_PARAMS]
+                query = SELECT_CARDS.format(",".join("?" * len(chunk)))
+                for uid, counter, registered in self._conn.execute(query, chunk):
+                    found[uid] = {"uid": uid, "counter": counter, "registered": bool(registered)}
+        return found
+
+    def get_user(self, username):
+        """Return the user record (with its cards) for a username, or None."""
+        with self._lock:
+            row = self._conn.execute(SELECT_USER, (username,)).fetchone()
+            if row is None:
+                return None
+            cards = [uid for (uid,) in self._conn.execute(SELECT_USER_CARDS, (username,))]
+        return {"username": username, "password": row[0], "cards": cards}
+
+    def get_owner(self, uid):
+        """Username the card is assigned to, or None."""
+        with self._lock:
+            row = self._conn.execute(SELECT_OWNER, (uid,)).fetchone()
+        return row[0] if row else None
+
+    def is_owner(self, username, uid):
+        """Check whether the card is assigned to the user (ownership primary key lookup)."""
+        with self._lock:
+            return self._conn.execute(SELECT_OWNERSHIP, (uid, username)).fetchone() is not None
+
+    def cards_for_user(self, username):
+        """UIDs assigned to the user in registration order, via the ownership(username, seq) index."""
+        with self._lock:
+            return [uid for (uid,) in self._conn.execute(SELECT_USER_CARDS, (username,))]
+
+    def uids(self):
+        with self._lock:
+            return [uid for (uid,) in self._conn.execute("SELECT uid FROM cards")]
+
+    def to_dict(self):
+        """Materialise the whole database in the database.json layout (O(n), debugging only)."""
+        with self._lock:
+            cards = [{"uid": uid, "counter": counter, "registered": bool(registered)}
+                     for uid, counter, registered in self._conn.execute("SELECT uid, counter, registered FROM cards")]
+            users = [self.get_user(username) for (username,) in self._conn.execute("SELECT username FROM users")]
+        return {"cards": cards, "users": users}
+
+    ########## Mutations ##########
+
+    def add_card(self, uid, counter=0, registered=False):
+        self.add_cards([uid], counter, registered)
+
+    def add_cards(self, uids, counter=0, registered=False):
+        """Bulk add_card() in one transaction."""
+        uids = list(uids)
+        with self._lock:
+            with self._transaction():
+                before = self._card_inserts()
+                self._conn.executemany(INSERT_CARD, ((uid, int(counter), int(registered)) for uid in uids))
+                if before == self._filter_inserts:
+                    # 只有自己加的卡，filter 等一下就會補上
+                    self._filter_inserts = self._card_inserts()
+            self._add_to_filter(uids)
+
+    def set_counter(self, uid, counter):
+        with self._lock:
+            self._conn.execute(UPDATE_COUNTER, (int(counter), uid))
+
+    def advance_counter(self, uid, ctr):
+        """
+        Atomically accept a tap counter; same contract as CardStore.advance_counter.
+        The check and the update are one UPDATE statement, so this also holds
+        across processes sharing the database file.
+        """
+        with self._lock:
+            if self._conn.execute(ADVANCE_COUNTER, (ctr, uid, ctr)).rowcount:
+                return True
+            return False if self._conn.execute(SELECT_CARD, (uid,)).fetchone() else None
+
+    def add_user(self, username, password):
+        with self._lock:
+            self._conn.execute(INSERT_USER, (username, password))
+
+    def set_password(self, username, password):
+        """Replace a user's stored password (hash)."""
+        with self._lock:
+            self._conn.execute(UPDATE_PASSWORD, (password, username))
+
+    def register_card(self, username, uid):
+        """
+        Assign an unregistered card to a user in one transaction. Returns False if
+        the card was already registered, True otherwise.
+        """
+        with self._lock, self._transaction():
+            if not self._conn.execute(REGISTER_CARD, (uid,)).rowcount:
+                return False
+            seq = self._conn.execute(NEXT_OWNERSHIP_SEQ).fetchone()[0]
+            self._conn.execute(INSERT_OWNERSHIP, (uid, username, seq))
+            return True
+
+    def clear(self):
+        self.replace({"cards": [], "users": []})
+
+    def replace(self, data):
+        """Replace the whole database with `data` (legacy save_database path)."""
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM ownership")
+            self._conn.execute("DELETE FROM users")
+            self._conn.execute("DELETE FROM cards")
+            _insert_all(self._conn, data)
+        self._rebuild_filter()
+
+    def close(self):
+        self._closing = True  # 背景建 filter 的 thread 看到就停
+        self._filter_builder.join()
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _card_inserts(self):
+        return self._conn.execute(SELECT_CARD_INSERTS).fetchone()[0]
+
+    def _filter_current(self):
+        """
+        Whether a filter miss can be trusted: nobody else has added cards since
+        the filter was built. Starts a background rebuild if someone has.
+        """
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._filter_version:
+            return True
+        # 別的 process commit 過；只改了 counter / users 的話 filter 還是完整的
+        if self._card_inserts() == self._filter_inserts:
+            self._filter_version = version
+            return True
+        self._refresh_filter()
+        return False
+
+    def _refresh_filter(self):
+        if self._building or self._closing or self._filter_builder.is_alive():
+            return
+        self._building = True
+        self._filter_builder = threading.Thread(target=self._build_filter, name="uid-filter", daemon=True)
+        self._filter_builder.start()
+
+    def _rebuild_filter(self):
+        with self._lock:
+            self._filter_generation += 1
+            self._filter_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            self._filter_inserts = self._card_inserts()
+            self.uid_filter = BloomFilter.from_keys(uid for (uid,) in self._conn.execute("SELECT uid FROM cards"))
+            self._building = False
+            self._pending_uids = []
+            self.filter_ready.set()
+
+    def _build_filter(self):
+        """Filter (re)build on a separate read connection, so taps are served meanwhile."""
+        with self._lock:
+            if self._closing:
+                return
+            generation = self._filter_generation
+            # 在掃描之前記下 data_version 跟 card_inserts: 掃描期間別人加的卡會讓下一次檢查再重建一次
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            inserts = self._card_inserts()
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+
+        def scan():
+            for (uid,) in conn.execute("SELECT uid FROM cards"):
+                if self._closing:
+                    return
+                yield uid
+
+        try:
+            uid_filter = BloomFilter.from_keys(scan())
+        finally:
+            conn.close()
+
+        with self._lock:
+            if self._closing or generation != self._filter_generation:
+                return  # 期間 replace() 已經同步重建過
+            for uid in self._pending_uids:
+                uid_filter.add(uid)
+            self._building = False
+            self._pending_uids = []
+            self._filter_version = version
+            self._filter_inserts = inserts
+            self.uid_filter = uid_filter
+            self.filter_ready.set()
+
+    def _add_to_filter(self, uids):
+        if self._building:
+            self._pending_uids.extend(uids)  # 背景建好之後再補進去
+        if self.uid_filter is None:
+            return
+        if self.uid_filter.count + len(uids) >= self.uid_filter.capacity:
+            self._rebuild_filter()
+        else:
+            self.uid_filter.update(uids)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent writers queue up on the write lock."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _insert_all(conn, data):
+    conn.executemany(INSERT_CARD, ((card["uid"], int(card["counter"]), int(card["registered"]))
+                                   for card in data.get("cards", [])))
+    conn.executemany(INSERT_USER, ((user["username"], user["password"]) for user in data.get("users", [])))
+    ownership = ((uid, user["username"]) for user in data.get("users", []) for uid in user["cards"])
+    conn.executemany(INSERT_OWNERSHIP, ((uid, username, seq) for seq, (uid, username) in enumerate(ownership, 1)))
+
+
+def migrate_json(json_path, sqlite_path):
+    """One-shot migration of a database.json file into a SQLite database."""
+    with open(json_path, "r") as file:
+        data = json.load(file)
+
+    store = SQLiteStore(sqlite_path)
+    store.replace(data)
+    store.close()
+    return len(data.get("cards", [])), len(data.get("users", []))
+
+
+if __name__ == "__main__":
+    # python sqlite_storage.py database.json database.db
+    if len(sys.argv) != 3:
+        print("Usage: python sqlite_storage.py <database.json> <database.db>")
+        sys.exit(1)
+    num_cards, num_users = migrate_json(sys.argv[1], sys.argv[2])
+    print(f"Migrated {num_cards} cards and {num_users} users into {sys.argv[2]}")
@@ -0,0 +1,444 @@
+import json
+import os
+import sys
+import threading
+
+import snapshot
+from bloom import BloomFilter
+from card_table import CardTable
+
+# 每個 mutation 都寫進 append-only log；log 太長時在背景壓縮成 snapshot
+COMPACT_THRESHOLD = 10000
+
+# 以 UID hash 分散的 lock 數量；不同卡片幾乎不會搶同一把 lock
+LOCK_STRIPES = 64
+
+# snapshot 格式: "json" (database.json layout) or "binary" (snapshot.py, memory-mapped)
+SNAPSHOT_FORMATS = ("json", "binary")
+
+
+def _empty_state():
+    # owners: uid -> username，和每個 user 的 cards 清單同步維護
+    return {"cards": CardTable(), "users": {}, "owners": {}}
+
+
+def _read_snapshot(path, snapshot_format="json"):
+    """Read a snapshot into uid / username indexes (a binary one also brings its Bloom filter)."""
+    if snapshot_format == "binary":
+        try:
+            return snapshot.read(path)
+        except FileNotFoundError:
+            return _empty_state()
+
+    state = _empty_state()
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return state
+
+    _index(state, data)
+    return state
+
+
+def _index(state, data):
+    cards = data.get("cards", [])
+    # 舊版 database.json 的 counter 是 8 位數字串
+    state["cards"].extend([card["uid"] for card in cards], [int(card["counter"]) for card in cards],
+                          [card["registered"] for card in cards])
+    for user in data.get("users", []):
+        state["users"][user["username"]] = user
+        for uid in user["cards"]:
+            state["owners"][uid] = user["username"]
+
+
+def _uid_filter(cards):
+    return BloomFilter.from_keys(cards.extra, packed=cards.packed_keys())
+
+
+def _write_snapshot(path, state, snapshot_format="json"):
+    """Atomically write the indexes back out in the database.json layout (or as a binary snapshot)."""
+    if snapshot_format == "binary":
+        uid_filter = state.get("uid_filter")
+        snapshot.write(path, state, uid_filter if uid_filter is not None and not uid_filter.full else None)
+        return
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"cards": list(state["cards"].records()),
+                   "users": list(state["users"].values())}, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _apply(state, entry):
+    """Apply one change-log entry to the indexes."""
+    op = entry["op"]
+    if op == "add_card":
+        state["cards"].put(entry["uid"], entry["counter"], entry["registered"])
+        if "uid_filter" in state:
+            state["uid_filter"].add(entry["uid"])
+    elif op == "add_cards":
+        uids = entry["uids"]
+        state["cards"].extend(uids, [entry["counter"]] * len(uids), [entry["registered"]] * len(uids))
+        if "uid_filter" in state:
+            state["uid_filter"].update(uids)
+    elif op == "set_password":
+        state["users"][entry["username"]]["password"] = entry["password"]
+    elif op == "set_counter":
+        state["cards"].set_counter(entry["uid"], entry["counter"])
+    elif op == "add_user":
+        state["users"][entry["username"]] = {"username": entry["username"],
+                                             "password": entry["password"], "cards": []}
+    elif op == "register":
+        # 先查 user 再改 card table: 失敗的 entry 不會留下一半的修改
+        user = state["users"][entry["username"]]
+        if state["cards"].is_registered(entry["uid"]):
+            return
+        state["cards"].set_registered(entry["uid"])
+        user["cards"].append(entry["uid"])
+        state["owners"][entry["uid"]] = entry["username"]
+    elif op == "clear":
+        state["cards"].clear()
+        state["users"].clear()
+        state["owners"].clear()
+    else:
+        raise ValueError(f"Unknown log entry: {op}")
+
+
+def _replay(state, log_path):
+    """
+    Replay a change log on top of a state. Stops at the first torn or
+    unterminated line (a crash mid-write); returns the length in bytes of the
+    part that was applied.
+    """
+    applied = 0
+    try:
+        with open(log_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # 最後一行寫到一半 (crash)，沒有被 fsync 確認過
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # 寫壞的一行，之後的資料不可信
+                _apply(state, entry)
+                applied += len(line)
+    except FileNotFoundError:
+        pass
+    return applied
+
+
+class CardStore:
+    """
+    In-memory card / user indexes backed by a snapshot and an append-only change log.
+
+    Cards live in a packed card_table.CardTable (about 20 bytes per card), users in
+    dicts. Lookups and single-card updates are O(1): every mutation is applied to the
+    in-memory indexes and appended as one line to `<snapshot>.log`. The fsync happens
+    outside the global lock as a group commit: while one thread syncs, the entries
+    of other threads queue up behind it and share the next fsync. Once the log grows past
+    `compact_threshold` entries it is rotated and folded into the snapshot by a
+    background thread, so the hot path never rewrites the whole database.
+
+    The snapshot is either database.json (snapshot_format="json") or a binary
+    snapshot (snapshot_format="binary", see snapshot.py) whose card table and
+    Bloom filter are memory-mapped instead of parsed, so opening the store does
+    not depend on the number of cards.
+    """
+
+    def __init__(self, path, compact_threshold=COMPACT_THRESHOLD, fsync=True, snapshot_format="json"):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+        self.path = path
+        self.snapshot_format = snapshot_format
+        self.log_path = f"{path}.log"
+        self.compacting_path = f"{path}.log.compacting"
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+
+        self._lock = threading.RLock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # group commit: 同時只有一個 thread 在 fsync；lock 順序 _sync_lock -> _lock
+        self._sync_lock = threading.Lock()
+        self._written = 0  # 寫進 log 的 entry 數
+        self._synced = 0   # 其中已經 fsync 的
+        self._compactor = None
+
+        self._state = _read_snapshot(path, snapshot_format)
+        if "uid_filter" not in self._state:
+            self._state["uid_filter"] = _uid_filter(self._state["cards"])
+        # 上次壓縮沒做完：先把舊的 log 併回來
+        if os.path.exists(self.compacting_path):
+            _replay(self._state, self.compacting_path)
+        applied = _replay(self._state, self.log_path)
+        if self._state["uid_filter"].full:
+            self._state["uid_filter"] = _uid_filter(self._state["cards"])
+        if os.path.exists(self.compacting_path):
+            _write_snapshot(self.path, self._state, snapshot_format)
+            os.remove(self.compacting_path)
+            self._reset_log()
+        else:
+            self._log = open(self.log_path, "a")
+            # 把寫到一半的最後一行截掉，新的 entry 才不會接在殘缺的那行後面
+            if self._log.tell() > applied:
+                self._log.truncate(applied)
+                os.fsync(self._log.fileno())
+            self._log_entries = 0
+
+        self.cards = self._state["cards"]
+        self.users = self._state["users"]
+        self.owners = self._state["owners"]
+
+    ########## Lookups ##########
+
+    @property
+    def uid_filter(self):
+        return self._state["uid_filter"]
+
+    def may_contain(self, uid):
+        """Bloom filter check: False means the card is definitely not in the database."""
+        return uid in self._state["uid_filter"]
+
+    def get_card(self, uid):
+        """Return a copy of the card record for a UID, or None."""
+        return self.cards.get(uid)
+
+    def get_cards(self, uids):
+        """Bulk lookup: {uid: card record or None}."""
+        cards = self.cards
+        return {uid: cards.get(uid) for uid in uids}
+
+    def get_user(self, username):
+        """Return the user record for a username, or None. Treat it as read-only."""
+        return self.users.get(username)
+
+    def get_owner(self, uid):
+        """Username the card is assigned to, or None."""
+        return self.owners.get(uid)
+
+    def is_owner(self, username, uid):
+        """Check whether the card is assigned to the user (one owners lookup)."""
+        return self.owners.get(uid) == username
+
+    def cards_for_user(self, username):
+        """UIDs assigned to the user, in registration order ([] for an unknown user)."""
+        user = self.users.get(username)
+        return list(user["cards"]) if user is not None else []
+
+    def uids(self):
+        return list(self.cards)
+
+    def to_dict(self):
+        """Materialise the whole database in the database.json layout (O(n), debugging only)."""
+        with self._lock:
+            return {"cards": list(self.cards.records()),
+                    "users": [dict(user, cards=list(user["cards"])) for user in self.users.values()]}
+
+    ########## Mutations ##########
+
+    def add_card(self, uid, counter=0, registered=False):
+        self._commit({"op": "add_card", "uid": uid, "counter": int(counter), "registered": registered})
+        self._refresh_uid_filter()
+
+    def add_cards(self, uids, counter=0, registered=False):
+        """Bulk add_card(): the whole batch is one change-log entry (later duplicates win)."""
+        uids = list(uids)
+        self._commit({"op": "add_cards", "uids": uids, "counter": int(counter), "registered": registered},
+                     len(uids))
+        self._refresh_uid_filter()
+
+    def _refresh_uid_filter(self):
+        with self._lock:
+            if self._state["uid_filter"].full:
+                self._state["uid_filter"] = _uid_filter(self.cards)
+
+    def set_counter(self, uid, counter):
+        self._commit({"op": "set_counter", "uid": uid, "counter": int(counter)})
+
+    def advance_counter(self, uid, ctr):
+        """
+        Atomically accept a tap counter (compare-and-swap on the stored counter).
+
+        The stored counter is the lowest CTR the next tap may carry. If `ctr` is at
+        least that value it becomes `ctr + 1` and True is returned; otherwise the
+        counter is left untouched and False is returned (replay). Returns None if
+        the card does not exist.
+        """
+        with self._stripe(uid):
+            counter = self.cards.counter(uid)
+            if counter is None:
+                return None
+            if ctr < counter:
+                return False
+            self._commit({"op": "set_counter", "uid": uid, "counter": ctr + 1})
+            return True
+
+    def add_user(self, username, password):
+        self._commit({"op": "add_user", "username": username, "password": password})
+
+    def set_password(self, username, password):
+        """Replace a user's stored password (hash)."""
+        self._commit({"op": "set_password", "username": username, "password": password})
+
+    def register_card(self, username, uid):
+        """
+        Assign an unregistered card to a user. Returns False if the card was
+        already registered (possibly by a concurrent tap) or the card or the
+        user does not exist, True otherwise.
+        """
+        with self._stripe(uid):
+            card = self.cards.get(uid)
+            if card is None or card["registered"] or username not in self.users:
+                return False
+            self._commit({"op": "register", "username": username, "uid": uid})
+            return True
+
+    def clear(self):
+        self.replace({"cards": [], "users": []})
+
+    def replace(self, data):
+        """Replace the whole database (legacy save_database path), writing a fresh snapshot."""
+        with self._lock:
+            self._wait_for_compaction()
+            old_state = self._state
+            self._state = _empty_state()
+            _index(self._state, data)
+            self.cards = self._state["cards"]
+            self.users = self._state["users"]
+            self.owners = self._state["owners"]
+            self._state["uid_filter"] = _uid_filter(self.cards)
+            snapshot.close(old_state)  # 舊的 mapped snapshot 在檔案被換掉之前 unmap
+
+            _write_snapshot(self.path, self._state, self.snapshot_format)
+            self._log.close()
+            self._reset_log()
+
+    def close(self):
+        with self._lock:
+            self._wait_for_compaction()
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self._log.close()
+            self.cards = None
+            snapshot.close(self._state)
+
+    ########## Change log & compaction ##########
+
+    def _stripe(self, uid):
+        return self._stripes[hash(uid) % LOCK_STRIPES]
+
+    def _commit(self, entry, size=1):
+        """
+        Apply and log one entry; `size` is how many changes it counts for towards
+        compaction. Returns once the entry is on disk. Must not be called with
+        _lock held (the group commit takes _sync_lock first).
+        """
+        with self._lock:
+            # CardTable 的欄位和 flag bytes 不能同時被兩個 thread 改，apply 和寫入 log 的順序也要一致
+            _apply(self._state, entry)
+            self._log.write(json.dumps(entry) + "\n")
+            self._written += 1
+            seq = self._written
+            if not self.fsync:
+                self._log.flush()
+            self._log_entries += size
+            if self._log_entries >= self.compact_threshold:
+                self._start_compaction()
+        if self.fsync:
+            self._sync(seq)
+
+    def _sync(self, seq):
+        """Group commit: wait until entry `seq` is on disk, fsyncing everything written so far if needed."""
+        with self._sync_lock:
+            if self._synced >= seq:
+                return  # 前一個 thread 的 fsync 已經包含這筆
+            with self._lock:
+                if self._log.closed:
+                    return  # close() 已經 fsync 過
+                self._log.flush()
+                target = self._written
+                # 自己的 fd: fsync 時 log 可能被輪替或關掉
+                fd = os.dup(self._log.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = target
+
+    def _reset_log(self):
+        self._log = open(self.log_path, "w")
+        self._log_entries = 0
+
+    def _start_compaction(self):
+        """Rotate the log and fold it into the snapshot on a background thread."""
+        if self._compactor and self._compactor.is_alive():
+            return  # 上一輪還沒壓縮完，log 繼續累積
+
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())  # 輪替出去的 entry 不會再經過 _sync
+        self._log.close()
+        os.replace(self.log_path, self.compacting_path)
+        self._reset_log()
+
+        self._compactor = threading.Thread(target=self._compact, daemon=True)
+        self._compactor.start()
+
+    def _compact(self):
+        # 從磁碟上的 snapshot + 被輪替的 log 重建，完全不碰正在服務的 indexes
+        state = _read_snapshot(self.path, self.snapshot_format)
+        _replay(state, self.compacting_path)
+        _write_snapshot(self.path, state, self.snapshot_format)
+        snapshot.close(state)
+        os.remove(self.compacting_path)
+
+    def compact(self):
+        """Force a compaction and wait for it to finish."""
+        with self._lock:
+            self._wait_for_compaction()
+            self._start_compaction()
+            self._wait_for_compaction()
+
+    def _wait_for_compaction(self):
+        if self._compactor:
+            self._compactor.join()
+            self._compactor = None
+
+
+########## JSON import / export ##########
+
+def import_json(json_path, snapshot_path):
+    """Load a database.json file into a binary snapshot, replacing it and its change log."""
+    with open(json_path, "r") as file:
+        data = json.load(file)
+
+    store = CardStore(snapshot_path, snapshot_format="binary")
+    store.replace(data)
+    store.close()
+    return len(data.get("cards", [])), len(data.get("users", []))
+
+
+def export_json(snapshot_path, json_path):
+    """Write a binary snapshot, including its pending change log, out in the database.json layout."""
+    state = _read_snapshot(snapshot_path, "binary")
+    _replay(state, f"{snapshot_path}.log.compacting")
+    _replay(state, f"{snapshot_path}.log")
+    _write_snapshot(json_path, state)
+    num_cards, num_users = len(state["cards"]), len(state["users"])
+    snapshot.close(state)
+    return num_cards, num_users
+
+
+if __name__ == "__main__":
+    # python storage.py import database.json database.snap
+    # python storage.py export database.snap database.json
+    if len(sys.argv) != 4 or sys.argv[1] not in ("import", "export"):
+        print("Usage: python storage.py import <database.json> <database.snap>\n"
+              "       python storage.py export <database.snap> <database.json>")
+        sys.exit(1)
+    command, source, target = sys.argv[1:]
+    num_cards, num_users = (import_json if command == "import" else export_json)(source, target)
+    print(f"{command.capitalize()}ed {num_cards} cards and {num_users} users into {target}")
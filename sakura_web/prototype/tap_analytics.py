@@ -0,0 +1,294 @@
+"""
+Offline analysis of a tap event log (tap_log.py).
+
+The log is read in chunks of `chunk_rows` records straight from memory-mapped
+segments, so logs of hundreds of millions of taps are processed in bounded
+memory. Each analysis keeps only the state it has to carry from one chunk to
+the next:
+
+    CounterGaps     last accepted counter per card
+    ReplayBursts    taps in the still-open time windows
+    CloneSuspects   (card, source) pairs in the still-open time windows
+    TapHeatmap      a 7 x 24 array of counts
+
+Windowed analyses rely on the log being in time order (it is written in tap
+order, give or take the scheduling of concurrent verify threads); a window is
+finished once the log has moved a full window past it.
+
+    python3 tap_analytics.py taps/ --window 5min --min-sources 3
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import tap_log
+from card_table import unpack_uid
+
+CHUNK_ROWS = 1 << 21  # 2M records = 80 MB 一次
+
+EVENT_DTYPE = np.dtype([("time", "<i8"), ("uid", "<u8"), ("source", "<u8"), ("user", "<u8"),
+                        ("ctr", "<u4"), ("outcome", "u1"), ("flag", "i1"), ("pad", "V2")])
+assert EVENT_DTYPE.itemsize == tap_log.RECORD.size
+
+OUTCOME = {name: code for code, name in enumerate(tap_log.OUTCOMES)}
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+NS_PER_SECOND = 10 ** 9
+NS_PER_HOUR = 3600 * NS_PER_SECOND
+NS_PER_DAY = 24 * NS_PER_HOUR
+EPOCH_WEEKDAY = 3  # 1970-01-01 是星期四
+
+
+def read_segment(path):
+    """Records of one segment as a read-only structured array (memory-mapped)."""
+    with open(path, "rb") as file:
+        header = file.read(tap_log.HEADER.size)
+    if len(header) < tap_log.HEADER.size:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    magic, version, record_size = tap_log.HEADER.unpack(header)
+    if magic != tap_log.MAGIC or version != tap_log.VERSION or record_size != EVENT_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a version {tap_log.VERSION} tap log segment")
+    # 最後一筆可能只寫了一半 (crash)，不算
+    rows = (os.path.getsize(path) - tap_log.HEADER.size) // record_size
+    if rows == 0:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    return np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=tap_log.HEADER.size, shape=(rows,))
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    Yield the events of a log directory (or a single segment file) as
+    DataFrames of at most `chunk_rows` rows, oldest first. Columns: time (int64
+    ns since the epoch), uid, source, user (uint64 keys, see tap_log), ctr,
+    outcome (code into tap_log.OUTCOMES) and flag.
+    """
+    paths = tap_log.segments(path) if os.path.isdir(path) else [path]
+    for segment in paths:
+        records = read_segment(segment)
+        for start in range(0, len(records), chunk_rows):
+            block = records[start:start + chunk_rows]
+            yield pd.DataFrame({name: np.array(block[name]) for name in EVENT_DTYPE.names if name != "pad"})
+
+
+def _window_ns(window):
+    return int(pd.Timedelta(window).value)
+
+
+class _Windowed:
+    """
+    Base for analyses over fixed time windows: rows selected from each chunk
+    wait in `pending` until the log has moved a whole window past their own,
+    then their windows are aggregated and emitted.
+    """
+
+    columns = ()
+
+    def __init__(self, window):
+        self.window = _window_ns(window)
+        self.pending = None
+        self.found = []
+
+    def select(self, chunk):
+        raise NotImplementedError
+
+    def aggregate(self, rows):
+        raise NotImplementedError
+
+    def add(self, chunk):
+        rows = self.select(chunk)
+        if not len(rows):
+            return
+        rows = rows.assign(window=rows["time"] // self.window * self.window)
+        pending = rows if self.pending is None else pd.concat([self.pending, rows], ignore_index=True)
+        # 多留一個 window，容許 verify threads 之間少量的亂序
+        cutoff = pending["window"].max() - self.window
+        done = pending["window"].to_numpy() < cutoff
+        if done.any():
+            self._emit(pending[done])
+            pending = pending[~done]
+        self.pending = pending
+
+    def _emit(self, rows):
+        found = self.aggregate(rows)
+        if len(found):
+            self.found.append(found)
+
+    def result(self):
+        if self.pending is not None and len(self.pending):
+            self._emit(self.pending)
+            self.pending = None
+        if not self.found:
+            return pd.DataFrame(columns=list(self.columns))
+        found = pd.concat(self.found, ignore_index=True)
+        found["uid"] = [unpack_uid(key) for key in found["uid"].tolist()]
+        found["window"] = pd.to_datetime(found["window"], unit="ns")
+        return found.sort_values(list(self.columns[:2]), ignore_index=True)
+
+
+class ReplayBursts(_Windowed):
+    """
+    Cards with at least `min_taps` "counter too low" rejections inside one
+    window: somebody replaying a recorded URL over and over. Taps logged
+    without a UID (uid 0) are ignored.
+    """
+
+    columns = ("window", "uid", "taps", "sources")
+
+    def __init__(self, window="1min", min_taps=5):
+        super().__init__(window)
+        self.min_taps = min_taps
+
+    def select(self, chunk):
+        keep = (chunk["outcome"].to_numpy() == OUTCOME["replay"]) & (chunk["uid"].to_numpy() != 0)
+        return chunk.loc[keep, ["time", "uid", "source"]]
+
+    def aggregate(self, rows):
+        counts = rows.groupby(["window", "uid"]).agg(taps=("time", "size"), sources=("source", "nunique"))
+        return counts[counts["taps"] >= self.min_taps].reset_index()
+
+
+class CloneSuspects(_Windowed):
+    """
+    Cards seen from at least `min_sources` different sources inside one
+    window. A genuine card is in one place at a time; the same UID showing up
+    from many addresses at once is the signature of cloned or copied URLs.
+    Taps whose URL did not parse, or whose source is unknown, are ignored.
+    """
+
+    columns = ("window", "uid", "sources", "taps", "accepted")
+
+    def __init__(self, window="5min", min_sources=3):
+        super().__init__(window)
+        self.min_sources = min_sources
+
+    def select(self, chunk):
+        keep = (chunk["uid"].to_numpy() != 0) & (chunk["source"].to_numpy() != 0)
+        rows = chunk.loc[keep, ["time", "uid", "source", "flag"]]
+        return rows.assign(accepted=rows["flag"].to_numpy() == 2).drop(columns="flag")
+
+    def aggregate(self, rows):
+        counts = rows.groupby(["window", "uid"]).agg(sources=("source", "nunique"), taps=("time", "size"),
+                                                     accepted=("accepted", "sum"))
+        return counts[counts["sources"] >= self.min_sources].reset_index()
+
+
+class CounterGaps:
+    """
+    Accepted taps whose counter jumped by more than one since the card's
+    previous accepted tap: the card was read `missing` times by something that
+    never reported to this server (a skimmer, or a URL that was kept and
+    never used). The first accepted tap of a card only sets its baseline.
+    Taps logged without a UID (uid 0) are ignored.
+    """
+
+    columns = ("time", "uid", "previous", "ctr", "missing")
+
+    def __init__(self, min_missing=1):
+        self.min_missing = min_missing
+        self.last = pd.Series(dtype=np.int64)  # uid -> 上一次接受的 counter
+        self.found = []
+
+    def add(self, chunk):
+        keep = (chunk["flag"].to_numpy() == 2) & (chunk["uid"].to_numpy() != 0)
+        accepted = chunk.loc[keep, ["time", "uid", "ctr"]]
+        if not len(accepted):
+            return
+        # 同一張卡的 tap 排在一起，保持時間順序 (stable sort)
+        accepted = accepted.sort_values("uid", kind="stable", ignore_index=True)
+        uids = accepted["uid"].to_numpy()
+        ctrs = accepted["ctr"].to_numpy().astype(np.int64)
+        first = np.empty(len(uids), dtype=bool)
+        first[0] = True
+        first[1:] = uids[1:] != uids[:-1]
+
+        previous = np.empty(len(ctrs), dtype=np.int64)
+        previous[1:] = ctrs[:-1]
+        previous[first] = self.last.reindex(uids[first]).fillna(-1).to_numpy().astype(np.int64)
+        missing = ctrs - previous - 1
+        gap = (previous >= 0) & (missing >= self.min_missing)
+        if gap.any():
+            self.found.append(pd.DataFrame({"time": accepted["time"].to_numpy()[gap], "uid": uids[gap],
+                                            "previous": previous[gap], "ctr": ctrs[gap], "missing": missing[gap]}))
+
+        last = np.empty(len(uids), dtype=bool)
+        last[-1] = True
+        last[:-1] = first[1:]
+        latest = pd.Series(ctrs[last], index=uids[last])
+        self.last = latest.combine_first(self.last) if len(self.last) else latest
+
+    def result(self):
+        if not self.found:
+            return pd.DataFrame(columns=list(self.columns))
+        found = pd.concat(self.found, ignore_index=True).sort_values("time", kind="stable", ignore_index=True)
+        found["uid"] = [unpack_uid(key) for key in found["uid"].tolist()]
+        found["time"] = pd.to_datetime(found["time"], unit="ns")
+        return found
+
+
+class TapHeatmap:
+    """
+    Taps per weekday (rows, Mon..Sun) and hour of the day (columns 0..23),
+    optionally only for some outcomes. `utc_offset` shifts the clock, e.g.
+    "8h" for Taiwan time.
+    """
+
+    def __init__(self, outcomes=None, utc_offset="0h"):
+        self.codes = None if outcomes is None else np.array([OUTCOME[name] for name in outcomes], dtype=np.uint8)
+        self.offset = _window_ns(utc_offset)
+        self.counts = np.zeros(7 * 24, dtype=np.int64)
+
+    def add(self, chunk):
+        times = chunk["time"].to_numpy()
+        if self.codes is not None:
+            times = times[np.isin(chunk["outcome"].to_numpy(), self.codes)]
+        times = times + self.offset
+        days = times // NS_PER_DAY
+        cells = (days + EPOCH_WEEKDAY) % 7 * 24 + times % NS_PER_DAY // NS_PER_HOUR
+        self.counts += np.bincount(cells, minlength=7 * 24)
+
+    def result(self):
+        return pd.DataFrame(self.counts.reshape(7, 24), index=list(WEEKDAYS), columns=range(24))
+
+
+def analyze(path, analyses, chunk_rows=CHUNK_ROWS):
+    """Feed every chunk of the log to each analysis (one pass over the log) and return their results."""
+    for chunk in read_chunks(path, chunk_rows):
+        for analysis in analyses:
+            analysis.add(chunk)
+    return [analysis.result() for analysis in analyses]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counter gaps, replay bursts, cloned cards and tap-rate heatmap "
+                                                 "from a tap event log.")
+    parser.add_argument("log", help="tap log directory (server.py --tap-log) or one segment file")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--replay-window", default="1min")
+    parser.add_argument("--min-replays", type=int, default=5, help="replays per window that make a burst")
+    parser.add_argument("--window", default="5min", help="window for the cloned card check")
+    parser.add_argument("--min-sources", type=int, default=3, help="sources per window that flag a card as cloned")
+    parser.add_argument("--min-missing", type=int, default=1, help="skipped counter values that count as a gap")
+    parser.add_argument("--utc-offset", default="8h", help="clock shift for the heatmap")
+    parser.add_argument("--output", help="also write each table as CSV with this path prefix")
+    args = parser.parse_args()
+
+    tables = dict(zip(
+        ("counter_gaps", "replay_bursts", "clone_suspects", "heatmap"),
+        analyze(args.log, [CounterGaps(args.min_missing), ReplayBursts(args.replay_window, args.min_replays),
+                           CloneSuspects(args.window, args.min_sources), TapHeatmap(utc_offset=args.utc_offset)],
+                args.chunk_rows)))
+
+    heatmap = tables["heatmap"]
+    print(f"{heatmap.to_numpy().sum()} taps")
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        for name, table in tables.items():
+            print(f"\n--- {name} ({len(table)} rows) ---")
+            print(table.head(20).to_string() if len(table) else "(none)")
+            if args.output:
+                table.to_csv(f"{args.output}{name}.csv", index=name == "heatmap")
+
+
+if __name__ == "__main__":
+    main()
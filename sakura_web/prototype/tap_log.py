@@ -0,0 +1,216 @@
+"""
+Append-only tap event log, one fixed-size record per verification outcome.
+
+A log is a directory of segment files taps-000001.bin, taps-000002.bin, ...
+Each segment starts with a 16-byte header (magic, version, record size) and is
+followed by RECORD structs (little-endian):
+
+    time_ns   int64    wall clock time of the tap (time.time_ns())
+    uid       uint64   card_table.pack_uid() of the UID, 0 if it did not parse / pack
+    source    uint64   source_key() of the client address, 0 if unknown
+    user      uint64   user_key() of the username given with the tap, 0 if none
+    ctr       uint32   SDMReadCtr from the URL
+    outcome   uint8    index into OUTCOMES
+    flag      int8     validate_uid_ctr flag (0/1/2), -1 if the tap never got there
+
+Records are packed into an in-memory buffer and written with one write() per
+`buffer_records` taps, or every `flush_interval` seconds by a background
+thread. A new segment is started on every open and whenever the current one
+would grow past `max_bytes`, so a crash can only ever truncate the last
+record of a segment (readers ignore a trailing partial record).
+"""
+
+import functools
+import hashlib
+import ipaddress
+import os
+import re
+import struct
+import threading
+import time
+
+from card_table import pack_uid
+
+MAGIC = b"SAKURATP"
+VERSION = 1
+HEADER = struct.Struct("<8sHH4x")
+RECORD = struct.Struct("<qQQQIBb2x")
+
+# verify_tap 的結果 -> outcome (順序就是檔案裡的代碼，只能往後加)
+OUTCOMES = ("valid", "parse", "rate_limit", "enc", "unknown", "replay", "ownership")
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+SEGMENT_NAME = "taps-{:06d}.bin"
+SEGMENT_PATTERN = re.compile(r"^taps-(\d{6,})\.bin$")
+
+TAP_LOG_DIR = os.environ.get("SAKURA_TAP_LOG")
+MAX_SEGMENT_BYTES = 256 * 1024 * 1024
+BUFFER_RECORDS = 4096
+FLUSH_INTERVAL = 1.0
+
+KEY_CACHE_SIZE = 65536  # 最近的 source / username -> key (ipaddress 解析一次要幾 µs)
+
+HASHED = 1 << 63  # 非 IPv4 的 source / username: 8-byte blake2b，最高位元設成 1
+
+
+def _hash_key(text):
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") | HASHED
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def source_key(source):
+    """Client address -> uint64: IPv4 addresses as their integer value, anything else hashed."""
+    if not source:
+        return 0
+    try:
+        address = ipaddress.ip_address(source)
+    except ValueError:
+        return _hash_key(source)
+    return int(address) if address.version == 4 else _hash_key(address.compressed)
+
+
+def source_label(key):
+    """Readable form of a source_key(): dotted IPv4, or the hash in hex."""
+    if key & HASHED:
+        return f"#{key:016x}"
+    return str(ipaddress.IPv4Address(key)) if key else ""
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def user_key(username):
+    return _hash_key(username) if username else 0
+
+
+def outcome_of(result):
+    """Outcome name for a main.verify_tap() result."""
+    if result["valid"]:
+        return "valid"
+    if result["stage"] == "uid_ctr":
+        return "unknown" if result["flag"] == 1 else "replay"
+    return result["stage"]
+
+
+def segments(directory):
+    """Segment paths of a log directory, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    numbered = sorted((int(match.group(1)), name) for name in names if (match := SEGMENT_PATTERN.match(name)))
+    return [os.path.join(directory, name) for _, name in numbered]
+
+
+class TapLog:
+    """Buffered writer for a tap log directory (see the module docstring). Thread-safe."""
+
+    def __init__(self, directory, max_bytes=MAX_SEGMENT_BYTES, buffer_records=BUFFER_RECORDS,
+                 flush_interval=FLUSH_INTERVAL, max_segments=None, clock=time.time_ns):
+        if max_bytes < HEADER.size + RECORD.size * buffer_records:
+            raise ValueError("max_bytes must hold at least one full buffer of records")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.buffer_records = buffer_records
+        self.max_segments = max_segments
+        self.clock = clock
+        self.recorded = 0
+
+        os.makedirs(directory, exist_ok=True)
+        existing = segments(directory)
+        self._sequence = int(SEGMENT_PATTERN.match(os.path.basename(existing[-1])).group(1)) if existing else 0
+        self._fd = None
+        self._size = 0
+
+        self._buffer = bytearray(RECORD.size * buffer_records)
+        self._count = 0
+        self._lock = threading.Lock()        # 保護 buffer
+        self._write_lock = threading.Lock()  # 寫入順序: 在 _lock 裡取得 (_take)，寫完才放開 (_write)
+        self._closed = False
+
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                             name="tap-log-flush", daemon=True)
+            self._flusher.start()
+
+    def record(self, uid, ctr, outcome, flag=None, source=None, username=None):
+        """Log one tap. `uid` is the UID string from the URL (or None), `outcome` one of OUTCOMES."""
+        uid_key = (pack_uid(uid) or 0) if uid else 0
+        args = (uid_key, source_key(source), user_key(username), ctr or 0, OUTCOME_CODES[outcome],
+                -1 if flag is None else flag)
+        with self._lock:
+            if self._closed:
+                raise ValueError("Tap log is closed")
+            RECORD.pack_into(self._buffer, self._count * RECORD.size, self.clock(), *args)
+            self._count += 1
+            self.recorded += 1
+            full = self._count == self.buffer_records
+            if full:
+                data = self._take()
+        if full:
+            self._write(data)
+
+    def record_result(self, result, source=None, username=None):
+        """Log a main.verify_tap() result."""
+        self.record(result.get("uid"), result.get("ctr"), outcome_of(result), result["flag"], source, username)
+
+    def _take(self):
+        """
+        Swap out the filled part of the buffer (call with _lock held), then pass
+        it to _write(). _write_lock is acquired here and released by _write(),
+        so buffers reach the file in the order they were taken.
+        """
+        self._write_lock.acquire()
+        data = bytes(memoryview(self._buffer)[:self._count * RECORD.size])
+        self._count = 0
+        return data
+
+    def flush(self):
+        with self._lock:
+            data = self._take()
+        self._write(data)
+
+    def _write(self, data):
+        """Write a buffer returned by _take() and release _write_lock."""
+        try:
+            if data:
+                if self._fd is None or self._size + len(data) > self.max_bytes:
+                    self._rotate()
+                os.write(self._fd, data)
+                self._size += len(data)
+            # close() 之後才寫完的 buffer 也要把檔案關掉
+            if self._closed and self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._write_lock.release()
+
+    def _rotate(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+        self._sequence += 1
+        path = os.path.join(self.directory, SEGMENT_NAME.format(self._sequence))
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        os.write(self._fd, HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._size = HEADER.size
+        if self.max_segments:
+            for old in segments(self.directory)[:-self.max_segments]:
+                os.remove(old)
+
+    def _flush_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def close(self):
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            data = self._take()
+        self._write(data)
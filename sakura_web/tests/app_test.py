@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import uid_registry
+import app
+from app_helpers import encode_uri_record, generate_url
+
+
+class FakeNDEF:
+    def __init__(self, capacity=256, fail_verify=False):
+        self.capacity = capacity
+        self.octets = b""
+        self.fail_verify = fail_verify
+
+    @property
+    def has_changed(self):
+        return self.fail_verify
+
+
+class FakeTag:
+    def __init__(self, uid, ndef=None):
+        self.identifier = bytes.fromhex(uid)
+        self.ndef = ndef if ndef is not None else FakeNDEF()
+
+
+class FakeClf:
+    """Presents the tags one per connect() like nfcpy; returns None (Ctrl+C) when they run out."""
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.loop = None
+        self.numbers = []  # 每次等卡片時準備好的流水號
+
+    def connect(self, rdwr):
+        if not self.tags:
+            return None
+        tag = self.tags.pop(0)
+        self.numbers.append(self.loop.prepared.number)
+        rdwr["on-connect"](tag)
+        rdwr["on-release"](tag)
+        return True
+
+
+def run(registry, tags):
+    clf = FakeClf(tags)
+    clf.loop = app.WriteLoop(clf, registry)
+    clf.loop.run()
+    return clf.loop
+
+
+def test_import_does_not_open_the_registry():
+    assert app._registry is None   # 第一次 get_registry() 才打開 uid_registry.csv
+
+
+def test_prepared_record_splices_the_uid():
+    prepared = app.prepare_record(42)
+    for uid in ("04A1B2C3D4E5F6", "04FFFFFFFFFFFF"):
+        assert prepared.encode(uid) == encode_uri_record(generate_url(42, uid))
+    # 長度不同的 UID: 整個重新編碼
+    for uid in ("04A1B2C3", "04A1B2C3D4E5F6A7B8C9"):
+        assert prepared.encode(uid) == encode_uri_record(generate_url(42, uid))
+
+
+def test_write_loop_numbers_new_cards_and_rewrites_known_ones():
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = uid_registry.UIDRegistry(os.path.join(tmp, "uid_registry.csv"), fsync=False)
+        first, short, known = FakeTag("04A1B2C3D4E5F6"), FakeTag("04A1B2C3"), FakeTag("04A1B2C3D4E5F6")
+        last = FakeTag("04FFFFFFFFFFFF")
+        loop = run(registry, [first, short, known, last])
+
+        assert loop.written == 4 and loop.failed == 0
+        assert first.ndef.octets == encode_uri_record(generate_url(1, "04A1B2C3D4E5F6"))
+        assert short.ndef.octets == encode_uri_record(generate_url(2, "04A1B2C3"))
+        # 已登記的卡沿用編號 1，準備好的 3 留給下一張新卡
+        assert known.ndef.octets == first.ndef.octets
+        assert loop.clf.numbers == [1, 2, 3, 3]
+        assert last.ndef.octets == encode_uri_record(generate_url(3, "04FFFFFFFFFFFF"))
+        assert registry.items() == [(1, "04A1B2C3D4E5F6"), (2, "04A1B2C3"), (3, "04FFFFFFFFFFFF")]
+        registry.close()
+
+
+def test_write_loop_counts_failures():
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = uid_registry.UIDRegistry(os.path.join(tmp, "uid_registry.csv"), fsync=False)
+        too_small = FakeTag("04A1B2C3D4E5F6", FakeNDEF(capacity=16))
+        unverified = FakeTag("04A1B2C3D4E5F7", FakeNDEF(fail_verify=True))
+        no_ndef = FakeTag("04A1B2C3D4E5F8")
+        no_ndef.ndef = None
+        loop = run(registry, [too_small, unverified, no_ndef])
+        assert loop.written == 0 and loop.failed == 3
+        assert too_small.ndef.octets == b""
+        registry.close()
+
+
+if __name__ == "__main__":
+    test_import_does_not_open_the_registry()
+    test_prepared_record_splices_the_uid()
+    test_write_loop_numbers_new_cards_and_rewrites_known_ones()
+    test_write_loop_counts_failures()
+    print("App tests passed.")
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import auth
+import helper
+
+
+def with_json_database(test):
+    def run():
+        with tempfile.TemporaryDirectory() as workdir:
+            helper.DATABASE = os.path.join(workdir, "database.json")
+            helper.DATABASE_DRIVER = "json"
+            helper.close_store()
+            try:
+                test()
+            finally:
+                helper.close_store()
+    return run
+
+
+@with_json_database
+def test_passwords_are_hashed_and_rehashed_when_parameters_change():
+    weak = auth.CredentialStore(n=2 ** 4)
+    weak.create_user("alice", "correct horse")
+    stored = helper.get_user("alice")["password"]
+    assert stored.startswith("scrypt$16$") and "correct horse" not in stored
+
+    assert weak.authenticate("alice", "wrong") is None
+    assert weak.authenticate("nobody", "correct horse") is None
+    assert weak.authenticate("alice", "correct horse") == "alice"
+    assert helper.get_user("alice")["password"] == stored   # 參數一樣不用重算
+
+    stronger = auth.CredentialStore(n=2 ** 6)
+    assert stronger.authenticate("alice", "correct horse") == "alice"
+    assert helper.get_user("alice")["password"].startswith("scrypt$64$")
+    assert stronger.verify_password("correct horse", helper.get_user("alice")["password"]) == (True, False)
+
+
+@with_json_database
+def test_plaintext_passwords_are_migrated_on_login():
+    helper.add_user("bob", "hunter2")
+    credentials = auth.CredentialStore(n=2 ** 4)
+    assert credentials.authenticate("bob", "hunter") is None
+    assert helper.get_user("bob")["password"] == "hunter2"
+    assert credentials.authenticate("bob", "hunter2") == "bob"
+    assert helper.get_user("bob")["password"].startswith("scrypt$")
+    assert credentials.authenticate("bob", "hunter2") == "bob"
+
+
+def test_sessions_expire_after_idle_ttl():
+    now = [0.0]
+    sessions = auth.SessionStore(ttl=10, max_sessions=3, clock=lambda: now[0])
+    alice = sessions.create("alice")
+    alice.data["last_uid"] = "04A1B2C3D4E5F6"
+    bob = sessions.create("bob")
+    assert alice.token != bob.token
+
+    now[0] = 8
+    assert sessions.get(alice.token).data["last_uid"] == "04A1B2C3D4E5F6"   # 用過 -> 重新計時
+    now[0] = 12
+    assert sessions.get(bob.token) is None
+    assert sessions.get(alice.token).username == "alice"
+
+    assert sessions.revoke(alice.token)
+    assert sessions.get(alice.token) is None and not sessions.revoke(alice.token)
+
+    tokens = [sessions.create(f"user{i}").token for i in range(5)]
+    assert len(sessions) == 3 and sessions.get(tokens[0]) is None and sessions.get(tokens[-1])
+    assert sessions.revoke_user("user4") == 1
+
+
+if __name__ == "__main__":
+    test_passwords_are_hashed_and_rehashed_when_parameters_change()
+    test_plaintext_passwords_are_migrated_on_login()
+    test_sessions_expire_after_idle_ttl()
+    print("Auth tests passed.")
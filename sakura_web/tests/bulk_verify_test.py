@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import bulk_verify
+import helper
+import sdm
+
+
+def tap(uid, ctr, enc=None):
+    return helper.format_sdm_url(1, uid, ctr, enc or sdm.compute_sdm_mac(uid, ctr))
+
+
+def make_batch(cards, stranger):
+    first, second = cards
+    urls = [
+        (tap(first, 5), "valid", 2),
+        (tap(first, 5), "uid_ctr", 0),            # 同一個 URL 又出現: replay
+        (tap(second, 3), "valid", 2),
+        (tap(first, 4), "uid_ctr", 0),            # 比已接受的 CTR 還舊
+        (tap(first, 6), "valid", 2),
+        (tap(second, 1), "uid_ctr", 0),           # 低於資料庫裡的 counter
+        (tap(second, 4, "0" * 16), "enc", None),  # 偽造的 ENC
+        (tap(stranger, 1), "uid_ctr", 1),         # 不存在的卡片
+        ("https://nfc.sakurahighschool.com/a/1?uid=04&ctr=1", "parse", None),
+        (tap(second, 3), "uid_ctr", 0),
+    ]
+    return [url for url, _, _ in urls], [(stage, flag) for _, stage, flag in urls]
+
+
+def test_replays_within_a_batch_are_rejected():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+        cards = [helper.generate_new_uid(), helper.generate_new_uid()]
+        helper.add_cards(cards)
+        helper.update_card_counter(cards[1], 2)
+        stranger = helper.generate_new_uid()
+        urls, expected = make_batch(cards, stranger)
+
+        try:
+            for workers, chunk_size in ((0, 3), (2, 3), (2, 1000)):
+                stats = bulk_verify.VerifyStats()
+                verdicts = list(bulk_verify.verify_many(urls, chunk_size, workers, stats=stats))
+                assert [verdict["url"] for verdict in verdicts] == urls
+                assert [("valid" if verdict["valid"] else verdict["stage"], verdict["flag"])
+                        for verdict in verdicts] == expected, workers
+                assert stats.total == len(urls) and stats.valid == 3
+                # 只讀模式不會動到資料庫
+                assert helper.get_card(cards[0])["counter"] == 0
+
+            verdicts = list(bulk_verify.verify_many(urls, 4, workers=0, advance=True))
+            assert [("valid" if verdict["valid"] else verdict["stage"], verdict["flag"])
+                    for verdict in verdicts] == expected
+            assert helper.get_card(cards[0])["counter"] == 7 and helper.get_card(cards[1])["counter"] == 4
+            # 已經接受過的 URL 下一次執行也是 replay
+            assert not any(verdict["valid"] for verdict in bulk_verify.verify_many(urls, workers=0))
+        finally:
+            helper.close_store()
+
+
+if __name__ == "__main__":
+    test_replays_within_a_batch_are_rejected()
+    print("Bulk verify tests passed.")
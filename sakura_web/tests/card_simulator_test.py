@@ -0,0 +1,363 @@
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import card_reader_manager
+import card_simulator
+import tests
+from app_helpers import encode_uri_record
+
+APDU_LATENCY = 0.002  # 模擬 ACR122U 每個 APDU 的來回時間
+
+
+def setup_reader(latency=APDU_LATENCY):
+    card = card_simulator.SimulatedNTAG424()
+    reader = card_simulator.SimulatedReader(card=card, latency=latency)
+    card_simulator._readers[:] = [reader]
+    card_simulator.install(tests, card_reader_manager)
+    return card, reader
+
+
+def test_ndef_write_and_read_back():
+    card, _ = setup_reader()
+    connection = tests.connect_to_reader()
+
+    data = [0x00, 0x05, 0xD1, 0x01, 0x01, 0x55, 0x00]
+    tests.write_ndef_data(connection, data)
+    assert tests.read_ndef_data(connection, len(data)) == data
+    assert list(card.files[0xE104][:len(data)]) == data
+
+
+def test_counter_and_token_files():
+    card, _ = setup_reader()
+    connection = tests.connect_to_reader()
+
+    tests.write_counter_value(connection, 7)
+    tests.write_token_and_timer(connection, 12345678, 98765432)
+    proprietary = bytes(card.files[0xE105])
+    assert proprietary[0:4] == (7).to_bytes(4, "big")
+    assert proprietary[8:16] == (12345678).to_bytes(4, "big") + (98765432).to_bytes(4, "big")
+
+
+def test_apdu_throughput_is_bounded_by_latency():
+    _, reader = setup_reader()
+    connection = tests.connect_to_reader()
+
+    start = time.perf_counter()
+    for _ in range(50):
+        tests.read_ndef_data(connection)
+    elapsed = time.perf_counter() - start
+
+    # read_ndef_data = SELECT + READ BINARY
+    assert reader.apdu_count == 100
+    assert elapsed >= 100 * APDU_LATENCY
+    assert elapsed < 100 * APDU_LATENCY * 3, f"simulated APDU loop too slow: {elapsed:.3f}s"
+
+
+def record_apdus(card_reader):
+    """Wrap card_reader.send_apdu so the test sees every APDU the session sends."""
+    sent = []
+    send_apdu = card_reader.send_apdu
+
+    def record(apdu):
+        sent.append(list(apdu))
+        return send_apdu(apdu)
+    card_reader.send_apdu = record
+    return sent
+
+
+def test_session_skips_selects_for_the_selected_file():
+    setup_reader(latency=0)
+    card_reader = card_reader_manager.CardReader()
+    card_reader.connect()
+    sent = record_apdus(card_reader)
+    session = card_reader_manager.CardSession(card_reader)
+
+    session.read_binary(card_reader_manager.CardReader.NDEF_FILE, 0, 4)
+    session.read_binary(card_reader_manager.CardReader.NDEF_FILE, 4, 4)
+    assert [apdu[1] for apdu in sent] == [0xA4, 0xA4, 0xB0, 0xB0]
+    assert session.apdus_sent == 4 and session.apdus_saved == 2
+
+    session.read_binary(card_reader_manager.CardReader.CC_FILE, 0, 2)
+    assert [apdu[1] for apdu in sent][4:] == [0xA4, 0xB0]  # 換檔案只要 SELECT file
+    session.invalidate()
+    session.read_binary(card_reader_manager.CardReader.CC_FILE, 0, 2)
+    assert [apdu[1] for apdu in sent][6:] == [0xA4, 0xA4, 0xB0]
+
+
+def test_session_merges_buffered_writes():
+    card, _ = setup_reader(latency=0)
+    card_reader = card_reader_manager.CardReader()
+    card_reader.connect()
+    sent = record_apdus(card_reader)
+    ndef_file = card_reader_manager.CardReader.NDEF_FILE
+
+    with card_reader_manager.CardSession(card_reader) as session:
+        session.write(ndef_file, 10, b"ab")
+        session.write(ndef_file, 12, b"cd")
+        session.write(ndef_file, 11, b"X")   # 重疊: 後寫的蓋過
+        session.write(ndef_file, 40, b"z")
+        assert not sent
+    updates = [apdu for apdu in sent if apdu[1] == 0xD6]
+    assert [((apdu[2] << 8) | apdu[3], bytes(apdu[5:])) for apdu in updates] == [(10, b"aXcd"), (40, b"z")]
+    assert session.apdus_saved == 2 + 2  # 合併省下 2 個 UpdateBinary, 第二段不用再 SELECT
+    assert bytes(card.files[0xE104][10:14]) == b"aXcd" and card.files[0xE104][40] == ord("z")
+
+    # 讀取前先送出同一個檔案還沒寫的資料
+    session.write(ndef_file, 0, b"\x00\x01")
+    assert session.read_binary(ndef_file, 0, 2) == [0x00, 0x01]
+
+
+def test_secure_session_provisions_with_one_handshake():
+    card, reader = setup_reader(latency=0)
+    card_reader = card_reader_manager.CardReader()
+    card_reader.connect()
+    session = card_reader_manager.CardSession(card_reader)
+    manager = card_reader_manager.CardDataManager(session)
+
+    url = "https://nfc.sakurahighschool.com/s/1?uid=04AABBCCDDEEFF"
+    manager.provision(url, counter=7, token_id=12345678, timer=98765432)
+    manager.provision(url, counter=8, token_id=12345678, timer=98765432)
+
+    auth_commands = [apdu for apdu in reader.log if apdu[:2] in ([0x90, 0x71], [0x90, 0x77])]
+    assert len(auth_commands) == 1
+    assert card.session["cmd_ctr"] == session.auth.cmd_ctr > 0
+    proprietary = bytes(card.files[0xE105])
+    assert proprietary[0:4] == (8).to_bytes(4, "big")
+    assert proprietary[8:16] == (12345678).to_bytes(4, "big") + (98765432).to_bytes(4, "big")
+    # Full mode 的 proprietary file 在 session 內用 ReadData 讀回
+    assert (manager.read_counter(), manager.read_token_id(), manager.read_timer()) == (8, 12345678, 98765432)
+    assert manager.read_url() == url
+
+
+def test_secure_session_switch_key_keeps_counter():
+    card, reader = setup_reader(latency=0)
+    card.keys[2] = bytes(range(16))
+    card_reader = card_reader_manager.CardReader()
+    card_reader.connect()
+    session = card_reader_manager.CardSession(card_reader)
+
+    auth = session.authenticate()
+    auth.write_data(0x03, 0, b"\x01\x02\x03\x04")
+    ti, cmd_ctr = auth.ti, auth.cmd_ctr
+    session.authenticate(bytes(range(16)), key_no=2)
+    assert (auth.ti, auth.cmd_ctr, auth.key_no) == (ti, cmd_ctr, 2)
+    assert card.session["key_no"] == 2
+    assert auth.read_data(0x03, 0, 4) == b"\x01\x02\x03\x04"
+
+    card.tap()  # 新的 field: 卡片的 session 不見了, MAC 對不上
+    try:
+        auth.get_file_counters()
+    except Exception:
+        pass
+    else:
+        raise AssertionError("expected the stale session to be rejected")
+    assert not auth.authenticated
+
+
+def connect_with_policy(**policy):
+    card_reader = card_reader_manager.CardReader(
+        retry_policy=card_reader_manager.RetryPolicy(sleep=lambda _: None, **policy), verbose=False)
+    card_reader.connect()
+    return card_reader
+
+
+def test_authentication_delay_is_retried():
+    card, _ = setup_reader(latency=0)
+    card_reader = connect_with_policy()
+    session = card_reader_manager.CardSession(card_reader)
+
+    card.inject_status(0x91AD, count=2)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        session.authenticate()
+    assert output.getvalue() == ""  # verbose=False: 每次 handshake 都不印
+    assert session.authenticated
+    assert card_reader.retries["AUTHENTICATION_DELAY"] == 2
+
+
+def test_status_errors_are_typed_and_not_retried():
+    card, _ = setup_reader(latency=0)
+    card_reader = connect_with_policy(max_retries=1)
+
+    card.inject_status(0x91AD, count=5)
+    response, status = card_reader.exchange([0x90, 0x71, 0x00, 0x00, 0x02, 0x00, 0x00, 0x00])
+    assert status is card_reader_manager.AUTHENTICATION_DELAY
+    assert card_reader.retries["AUTHENTICATION_DELAY"] == 1
+
+    try:
+        card_reader.send_apdu([0x00, 0xA4, 0x00, 0x0C, 0x02, 0xE1, 0x07])
+    except card_reader_manager.CardError as e:
+        assert e.status.code == 0x6A82
+        assert "SW1=6A, SW2=82" in str(e)
+    else:
+        raise AssertionError("expected CardError")
+
+
+def test_native_error_status_raises():
+    # 0x91xx 只有 9100 / 91AF 不算錯誤
+    card, _ = setup_reader(latency=0)
+    card_reader = connect_with_policy(max_retries=1)
+    card.inject_status(0x91AE)
+    try:
+        card_reader.send_apdu([0x90, 0x60, 0x00, 0x00, 0x00])   # GetVersion
+    except card_reader_manager.CardError as e:
+        assert e.status is card_reader_manager.AUTHENTICATION_ERROR
+    else:
+        raise AssertionError("expected CardError")
+
+
+def test_rf_loss_mid_session_recovers():
+    card, _ = setup_reader(latency=0)
+    card_reader = connect_with_policy()
+    session = card_reader_manager.CardSession(card_reader)
+    manager = card_reader_manager.CardDataManager(session)
+
+    manager.authenticate()
+    card.inject_rf_loss()
+    manager.write_counter(42)
+    session.flush()
+    assert manager.read_counter() == 42
+    assert card_reader.retries["RF_LOSS"] == 1 and card_reader.reconnects == 1
+
+    card.inject_rf_loss()
+    assert manager.read_url() is None  # 空的 NDEF 檔, SELECT 狀態在重新連線後恢復
+
+
+def test_get_version_chains_additional_frames():
+    card, _ = setup_reader(latency=0)
+    card_reader = connect_with_policy()
+    card_reader.select_application()
+    version = card_reader.get_version()
+    assert len(version) == 7 + 7 + 14
+    assert version[14:21] == card.uid
+
+
+def test_ndef_write_is_tearing_safe():
+    card, reader = setup_reader(latency=0)
+    card_reader = card_reader_manager.CardReader(retry_policy=card_reader_manager.NO_RETRY, verbose=False)
+    card_reader.connect()
+    ndef = card_reader_manager.NDEFFile(card_reader_manager.CardSession(card_reader))
+
+    old = encode_uri_record("https://nfc.sakurahighschool.com/s/1?uid=04AABBCCDDEEFF")
+    ndef.write(old)
+    assert ndef.read() == old
+    new = encode_uri_record("https://nfc.sakurahighschool.com/s/2?uid=04AABBCCDDEE00&tag=1")
+    writes = ndef.write(new)
+    # NLEN = 0, 改變的部分, 最後才寫真正的 NLEN
+    assert writes[0] == (0, b"\x00\x00") and writes[-1] == (0, len(new).to_bytes(2, "big"))
+    assert len(writes) > 2 and all(offset >= 2 for offset, _ in writes[1:-1])
+    updates = [apdu for apdu in reader.log if apdu[1] == 0xD6][-len(writes):]
+    assert [((apdu[2] << 8) | apdu[3], bytes(apdu[5:])) for apdu in updates] == writes
+    assert ndef.write(new) == []
+
+    # 卡片在寫最後的 NLEN 之前離開: 讀到的是空的 message，不是新舊混在一起
+    sent = []
+    transceive = card_reader.transceive
+    def tear_before_nlen(apdu):
+        if apdu[1] == 0xD6:
+            sent.append(apdu)
+            if len(sent) == len(writes):
+                card.inject_rf_loss()
+        return transceive(apdu)
+    card_reader.transceive = tear_before_nlen
+    try:
+        ndef.write(old)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("expected the write to be torn")
+    card_reader.transceive = transceive
+    card_reader.reconnect()
+    assert card_reader_manager.NDEFFile(card_reader_manager.CardSession(card_reader)).read() == b""
+
+
+def test_ndef_diff_merges_small_gaps():
+    gap = card_reader_manager.NDEFFile.GAP_MERGE
+    diff = card_reader_manager.NDEFFile.diff
+    old = bytes(32)
+
+    def changed(*positions, length=32):
+        new = bytearray(length)
+        for position in positions:
+            new[position] = 0xFF
+        return bytes(new)
+
+    assert diff(old, old) == []
+    assert diff(old, changed(3)) == [(3, b"\xff")]
+    new = changed(2, 2 + gap)          # 中間 gap - 1 個沒變: 合併成一段
+    assert diff(old, new) == [(2, new[2:3 + gap])]
+    new = changed(2, 3 + gap)          # 中間 GAP_MERGE 個沒變: 分開送
+    assert diff(old, new) == [(2, new[2:3]), (3 + gap, new[3 + gap:4 + gap])]
+    new = changed(30, length=40)       # 變長的部分一定要寫
+    assert diff(old, new) == [(30, new[30:])]
+
+
+def test_extended_length_apdus():
+    card = card_simulator.SimulatedNTAG424(ndef_file_size=1024)
+    reader = card_simulator.SimulatedReader(card=card)
+    card_simulator._readers[:] = [reader]
+    card_reader = connect_with_policy()
+
+    session = card_reader_manager.CardSession(card_reader, max_read=1024, max_write=600, extended_length=True)
+    message = encode_uri_record("https://nfc.sakurahighschool.com/s/1?uid=04AABBCCDDEEFF&ref=" + "x" * 700)
+    card_reader_manager.NDEFFile(session).write(message)
+    updates = [apdu for apdu in reader.log if apdu[1] == 0xD6]
+    # NLEN = 0, message 分成 600 (extended Lc) + 其餘 (short Lc), 最後 NLEN
+    assert [len(apdu) for apdu in updates] == [5 + 2, 7 + 600, 5 + len(message) - 600, 5 + 2]
+    assert updates[1][4:7] == [0x00, 0x02, 0x58]
+
+    assert card_reader_manager.NDEFFile(session).read() == message
+    reads = [apdu for apdu in reader.log if apdu[1] == 0xB0]
+    # 先讀 NLEN，message 再用一個 extended Le 讀完
+    assert reads[-2:] == [[0x00, 0xB0, 0x00, 0x00, 0x02],
+                          [0x00, 0xB0, 0x00, 0x02, 0x00] + list(len(message).to_bytes(2, "big"))]
+    # 知道檔案大小: NLEN 跟 message 一起讀
+    assert card_reader_manager.NDEFFile(session, size=1024).read() == message
+    assert reader.log[-1] == [0x00, 0xB0, 0x00, 0x00, 0x00, 0x04, 0x00]
+
+    short = card_reader_manager.CardSession(card_reader, max_read=1024, max_write=600)
+    assert (short.max_read, short.max_write) == (0x100, 0xFF)
+    assert card_reader_manager.NDEFFile(short).read() == message
+
+
+def test_ndef_read_stays_inside_a_small_file():
+    card = card_simulator.SimulatedNTAG424(ndef_file_size=256)
+    reader = card_simulator.SimulatedReader(card=card)
+    card_simulator._readers[:] = [reader]
+    card_reader = connect_with_policy()
+
+    session = card_reader_manager.CardSession(card_reader, max_read=1024, max_write=600, extended_length=True)
+    message = encode_uri_record("https://nfc.sakurahighschool.com/s/1?uid=04AABBCCDDEEFF")
+    card_reader_manager.NDEFFile(session).write(message)
+    assert card_reader_manager.NDEFFile(session).read() == message
+    assert card_reader_manager.NDEFFile(session, size=256).read() == message
+    # Le 不超過 256-byte 的檔案 (extended Le 1024 會被真的卡片拒絕)
+    for apdu in reader.log:
+        if apdu[1] == 0xB0:
+            le = (apdu[4] or 0x100) if len(apdu) == 5 else (apdu[5] << 8) | apdu[6]
+            assert ((apdu[2] << 8) | apdu[3]) + le <= 256, apdu
+
+
+if __name__ == "__main__":
+    test_ndef_write_and_read_back()
+    test_counter_and_token_files()
+    test_apdu_throughput_is_bounded_by_latency()
+    test_session_skips_selects_for_the_selected_file()
+    test_session_merges_buffered_writes()
+    test_secure_session_provisions_with_one_handshake()
+    test_secure_session_switch_key_keeps_counter()
+    test_authentication_delay_is_retried()
+    test_status_errors_are_typed_and_not_retried()
+    test_native_error_status_raises()
+    test_rf_loss_mid_session_recovers()
+    test_get_version_chains_additional_frames()
+    test_ndef_write_is_tearing_safe()
+    test_ndef_diff_merges_small_gaps()
+    test_extended_length_apdus()
+    test_ndef_read_stays_inside_a_small_file()
+    print("Simulator tests passed.")
@@ -0,0 +1,72 @@
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import card_table
+import helper
+import storage
+
+
+def test_card_table_matches_dict_semantics():
+    rng = random.Random(7)
+    uids = [helper.generate_new_uid() for _ in range(3000)] + ["legacy-1", "abc", "04a1b2c3d4e5f6"]
+    table = card_table.CardTable()
+    model = {}
+    for _ in range(30000):
+        uid = rng.choice(uids)
+        roll = rng.random()
+        if roll < 0.4:
+            counter, registered = rng.randrange(10**8), rng.random() < 0.5
+            table.put(uid, counter, registered)
+            model[uid] = {"uid": uid, "counter": counter, "registered": registered}
+        elif roll < 0.6 and uid in model:
+            table.set_counter(uid, rng.randrange(10**8))
+            model[uid]["counter"] = table.counter(uid)
+        elif roll < 0.7 and uid in model:
+            table.set_registered(uid)
+            model[uid]["registered"] = True
+        else:
+            assert table.get(uid) == model.get(uid)
+            assert (uid in table) == (uid in model)
+
+    assert len(table) == len(model)
+    assert sorted(table) == sorted(model)
+    assert sorted(map(str, table.records())) == sorted(map(str, model.values()))
+
+
+def test_bulk_load_keeps_order_and_last_duplicate():
+    uids = [helper.generate_new_uid() for _ in range(5000)]
+    table = card_table.CardTable()
+    table.extend(uids + uids[:10], list(range(5000)) + [99] * 10, [False] * 5010)
+    assert list(table) == uids
+    assert table.counter(uids[0]) == 99 and table.counter(uids[10]) == 10
+    assert table.nbytes / len(table) < 40
+
+
+def test_card_store_round_trip_through_table():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.json")
+        store = storage.CardStore(path)
+        store.replace({"cards": [{"uid": "68A3E875A84B7F", "counter": "00000002", "registered": True},
+                                 {"uid": "not-a-uid", "counter": 0, "registered": False}],
+                       "users": [{"username": "alice", "password": "pw", "cards": ["68A3E875A84B7F"]}]})
+        assert store.advance_counter("68A3E875A84B7F", 1) is False
+        assert store.advance_counter("68A3E875A84B7F", 2) is True
+        assert store.register_card("alice", "not-a-uid")
+        store.close()
+
+        store = storage.CardStore(path)
+        assert store.get_card("68A3E875A84B7F") == {"uid": "68A3E875A84B7F", "counter": 3, "registered": True}
+        assert store.get_card("not-a-uid")["registered"]
+        assert store.cards_for_user("alice") == ["68A3E875A84B7F", "not-a-uid"]
+        store.close()
+
+
+if __name__ == "__main__":
+    test_card_table_matches_dict_semantics()
+    test_bulk_load_keeps_order_and_last_duplicate()
+    test_card_store_round_trip_through_table()
+    print("Card table tests passed.")
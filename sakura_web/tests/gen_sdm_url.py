@@ -1,17 +1,20 @@
-import hashlib
+import os
 import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+import sdm
 
 def generate_sdm_url(base_url, prefix, num):
 
     # 模擬 UID（10 Bytes）
     uid = ''.join(random.choices('0123456789ABCDEF', k=14))
     
-    # 模擬 CTR（8 Bytes，計數器）
-    ctr = "00000000" 
+    # 模擬 CTR (SDMReadCtr, 3 bytes，卡片以 6 位 hex 輸出)
+    ctr = "000000"
     
-    # 假設 ENC 為 SHA256（c實際上應該是 AES-CMAC）
-    enc_data = f"{uid}{ctr}".encode()
-    enc = hashlib.sha256(enc_data).hexdigest()[:16]  # 取前16位當作加密碼
+    # ENC = NTAG 424 DNA SDMMAC (AES-CMAC)
+    enc = sdm.compute_sdm_mac(uid, int(ctr, 16)).upper()
     
     # 生成完整 SDM URL
     sdm_url = f"{base_url}{prefix}{num}?uid={uid}&ctr={ctr}&enc={enc}"
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import loadgen
+
+
+def test_tap_mix_is_classified_correctly():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+
+        cards = loadgen.seed_cards(20)
+        stream = loadgen.TapStream(cards, replay_ratio=0.1, forged_ratio=0.05, unknown_ratio=0.05, seed=7)
+        # 單一 thread: 沒有亂序，每個 tap 的結果都要和預期一樣
+        report = loadgen.run_load(stream, loadgen.InProcessTarget(), taps=2000, concurrency=1)
+        summary = report.summary()
+
+        assert summary["taps"] == 2000 and summary["errors"] == 0
+        assert summary["unexpected"] == {}
+        for kind in ("replay", "forged", "unknown"):
+            assert summary["by_kind"][kind].get("accepted", 0) == 0
+            assert summary["by_kind"][kind]["rejected"] > 0
+        assert summary["accepted"] == summary["by_kind"]["valid"]["accepted"]
+        assert 0 < summary["latency_ms"]["p50"] <= summary["latency_ms"]["p99"]
+
+        # 重新從資料庫讀 counter 接著產生 tap
+        resumed = loadgen.TapStream(loadgen.existing_cards(), 0, 0, 0, seed=8)
+        assert loadgen.run_load(resumed, loadgen.InProcessTarget(), taps=100, concurrency=1).summary()["accepted"] == 100
+
+        helper.close_store()
+
+
+if __name__ == "__main__":
+    test_tap_mix_is_classified_correctly()
+    print("Load generator tests passed.")
@@ -0,0 +1,67 @@
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import main
+import metrics
+
+
+def test_histogram_quantiles_within_bucket_error():
+    histogram = metrics.Histogram()
+    values = sorted(random.uniform(1e-5, 0.5) for _ in range(20000))
+    for value in values:
+        histogram.record(value)
+
+    for q in metrics.QUANTILES:
+        exact = values[max(0, int(q * len(values) + 0.5) - 1)]
+        estimate = histogram.quantile(q)
+        assert exact <= estimate <= exact * (1 + 1 / metrics.SUB_BUCKETS) + 1e-6, (q, exact, estimate)
+    assert histogram.count == len(values)
+    assert histogram.summary()["max_s"] == values[-1]
+
+
+def test_verify_tap_records_stages_and_flags():
+    metrics.REGISTRY.reset()
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+
+        uid = helper.generate_new_uid()
+        helper.add_card(uid)
+        url = helper.generate_new_sdm_url(uid, 0)
+        assert main.verify_tap(url)["valid"]
+        assert main.verify_tap(url)["flag"] == 0  # replay
+        main.verify_tap("https://example.com/nothing")
+
+        snapshot = metrics.REGISTRY.to_dict()
+        counters = {(c["name"], tuple(c["labels"].items())): c["value"] for c in snapshot["counters"]}
+        assert counters[("sakura_verify_flag_total", (("flag", "2"),))] == 1
+        assert counters[("sakura_verify_flag_total", (("flag", "0"),))] == 1
+        assert counters[("sakura_verify_total", (("result", "parse"),))] == 1
+        stages = {h["labels"].get("stage"): h["count"] for h in snapshot["histograms"]
+                  if h["name"] == "sakura_verify_stage_seconds"}
+        assert stages["parse"] == 2 and stages["enc"] == 2 and stages["uid_ctr"] == 2
+
+        prometheus_path = os.path.join(workdir, "metrics.prom")
+        metrics.dump(prometheus_path)
+        text = open(prometheus_path).read()
+        assert "# TYPE sakura_verify_stage_seconds summary" in text
+        assert 'sakura_verify_stage_seconds_count{stage="enc"} 2' in text
+
+        json_path = os.path.join(workdir, "metrics.json")
+        metrics.dump(json_path)
+        assert json.load(open(json_path))["counters"]
+
+        helper.close_store()
+
+
+if __name__ == "__main__":
+    test_histogram_quantiles_within_bucket_error()
+    test_verify_tap_records_stages_and_flags()
+    print("Metrics tests passed.")
@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from app_helpers import build_ndef_file, decode_uri_record
+from ndef_template import SDM_MIRROR_SPECS, NDEFTemplate
+
+SDM_URL = "https://nfc.sakurahighschool.com/a/{num}?uid={uid}&ctr={ctr}&enc={enc}"
+
+
+def test_patched_template_matches_full_encoding():
+    template = NDEFTemplate(SDM_URL)
+    for num, uid, ctr in [(1, "04A1B2C3D4E5F6", 0), (12345678, "04FFFFFFFFFFFF", 0xFFFFFF)]:
+        image = template.render(num=num, uid=uid, ctr=ctr, enc=bytes(range(8)))
+        url = (f"https://nfc.sakurahighschool.com/a/{num:08d}?uid={uid}&ctr={ctr:06X}"
+               f"&enc=0001020304050607")
+        assert image == build_ndef_file(url)
+        assert decode_uri_record(bytes(template.message)) == url
+
+    uids = ["04A1B2C3D4E5F6", "04FFFFFFFFFFFF", "0400000000002A"]
+    files = template.render_many(num=[7, 8, 99999999], uid=uids, ctr=[0, 1, 2], enc=["0" * 16] * 3)
+    for i, uid in enumerate(uids):
+        assert bytes(files[i]) == template.render(num=[7, 8, 99999999][i], uid=uid, ctr=i, enc="0" * 16)
+
+
+def test_long_templates_and_repeated_fields():
+    template = NDEFTemplate("https://example.com/" + "x" * 300 + "/{uid}/{uid}")
+    image = template.render(uid=bytes.fromhex("04A1B2C3D4E5F6"))
+    assert image == build_ndef_file("https://example.com/" + "x" * 300 + "/04A1B2C3D4E5F6/04A1B2C3D4E5F6")
+
+    for bad in [dict(uid="04A1"), dict(ctr=1)]:
+        try:
+            template.patch(**bad)
+        except (ValueError, KeyError):
+            pass
+        else:
+            raise AssertionError(f"patch({bad}) was accepted")
+
+
+def test_sdm_offsets_point_at_the_mirrored_fields():
+    template = NDEFTemplate(SDM_URL, specs=SDM_MIRROR_SPECS)
+    image = template.render(num=7, uid="04A1B2C3D4E5F6", ctr=0x00002A, enc="0123456789ABCDEF")
+    offsets = template.sdm_offsets()
+    assert image[offsets["uid_offset"]:offsets["uid_offset"] + 14] == b"04A1B2C3D4E5F6"
+    assert image[offsets["ctr_offset"]:offsets["ctr_offset"] + 6] == b"00002A"
+    assert image[offsets["mac_offset"]:offsets["mac_offset"] + 16] == b"0123456789ABCDEF"
+
+    settings = template.change_file_settings()
+    assert settings[:7] == bytes([0x02, 0x40, 0x00, 0xE0, 0xC1, 0xFF, 0xE1])
+    assert [int.from_bytes(settings[i:i + 3], "little") for i in range(7, len(settings), 3)] == \
+        [offsets["uid_offset"], offsets["ctr_offset"], offsets["mac_input_offset"], offsets["mac_offset"]]
+
+    assert NDEFTemplate(SDM_URL).sdm_offsets() == offsets  # 預設格式就是卡片 mirror 的格式
+    try:
+        NDEFTemplate(SDM_URL, specs={"ctr": "08d"}).sdm_offsets()   # 8 位十進位 ctr 卡片沒辦法 mirror
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a decimal counter field was accepted for SDM mirroring")
+
+
+if __name__ == "__main__":
+    test_patched_template_matches_full_encoding()
+    test_long_templates_and_repeated_fields()
+    test_sdm_offsets_point_at_the_mirrored_fields()
+    print("NDEF template tests passed.")
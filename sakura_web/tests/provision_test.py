@@ -0,0 +1,125 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import main
+import provision
+import sdm
+from card_table import pack_uid
+
+
+def use_store(workdir, driver):
+    helper.DATABASE = os.path.join(workdir, "database.json")
+    helper.SQLITE_DATABASE = os.path.join(workdir, "database.sqlite3")
+    helper.DATABASE_DRIVER = driver
+    helper.close_store()
+
+
+def test_allocator_never_repeats():
+    existing = [pack_uid(helper.generate_new_uid()) for _ in range(1000)]
+    allocator = provision.UIDAllocator(existing, seed=1)
+    first, second = allocator.allocate(5000), allocator.allocate(5000)
+    keys = np.concatenate([first, second])
+    assert len(np.unique(keys)) == 10000
+    assert not np.isin(keys, existing).any()
+    assert all(key >> 48 == provision.MANUFACTURER for key in keys.tolist())
+    # 同一個 seed 產生同一批 UID
+    assert (provision.UIDAllocator(existing, seed=1).allocate(5000) == first).all()
+    # used 一直保持排序，且包含所有發出去的 UID
+    assert (allocator.used == np.unique(np.concatenate([keys, np.asarray(existing, dtype=np.uint64)]))).all()
+
+
+def test_batched_macs_match_single_card_macs():
+    uids = [helper.generate_new_uid() for _ in range(50)]
+    assert sdm.compute_sdm_macs(uids, 3) == [sdm.compute_sdm_mac(uid, 3) for uid in uids]
+
+
+def test_provision_writes_store_and_manifest():
+    for driver in ("json", "sqlite"):
+        with tempfile.TemporaryDirectory() as workdir:
+            use_store(workdir, driver)
+            helper.generate_test_database(num=3, show_urls=False)
+            existing = set(helper.get_all_uid())
+
+            path = os.path.join(workdir, "manifest.csv")
+            assert provision.provision(250, path, start_number=100, workers=1, chunk_size=64, seed=2) == 250
+            with open(path, newline="") as file:
+                rows = list(csv.DictReader(file))
+            assert [int(row["number"]) for row in rows] == list(range(100, 350))
+            uids = [row["uid"] for row in rows]
+            assert len(set(uids)) == 250 and not existing & set(uids)
+            assert set(helper.get_all_uid()) == existing | set(uids)
+            assert main.verify_tap(rows[17]["url"])["valid"]
+
+            path = os.path.join(workdir, "manifest.ndjson")
+            provision.provision(10, path, start_number=350, workers=1, seed=3)
+            with open(path) as file:
+                rows = [json.loads(line) for line in file]
+            assert len(rows) == 10 and rows[0]["number"] == 350
+            assert not os.path.exists(path + ".tmp")
+
+            # 批次寫入的卡片重開資料庫後還在
+            helper.close_store()
+            use_store(workdir, driver)
+            assert len(helper.get_all_uid()) == 263
+            assert helper.get_card(rows[0]["uid"]) == {"uid": rows[0]["uid"], "counter": 0, "registered": False}
+            helper.close_store()
+
+
+def test_interrupted_batch_resumes_from_the_partial_manifest():
+    with tempfile.TemporaryDirectory() as workdir:
+        use_store(workdir, "json")
+        path = os.path.join(workdir, "manifest.csv")
+        add_cards = helper.add_cards
+        calls = []
+
+        def crash_on_third_chunk(uids):
+            calls.append(len(uids))
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            add_cards(uids)
+
+        helper.add_cards = crash_on_third_chunk
+        try:
+            provision.provision(100, path, start_number=10, workers=1, chunk_size=16, seed=4)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("expected the batch to be interrupted")
+        finally:
+            helper.add_cards = add_cards
+        assert not os.path.exists(path) and len(helper.get_all_uid()) == 32
+        with open(path + ".tmp", "a") as file:
+            file.write("58,04")  # 寫到一半的一行
+
+        try:
+            provision.provision(100, path, start_number=10, workers=1, chunk_size=16)
+        except FileExistsError:
+            pass
+        else:
+            raise AssertionError("a leftover partial manifest was overwritten")
+
+        assert provision.provision(100, path, start_number=10, workers=1, chunk_size=16, resume=True) == 100
+        with open(path, newline="") as file:
+            rows = list(csv.DictReader(file))
+        assert [int(row["number"]) for row in rows] == list(range(10, 110))
+        uids = [row["uid"] for row in rows]
+        assert len(set(uids)) == 100 and set(helper.get_all_uid()) == set(uids)
+        assert main.verify_tap(rows[40]["url"])["valid"]  # 中斷時還沒寫進資料庫的那一段
+        assert not os.path.exists(path + ".tmp")
+        helper.close_store()
+
+
+if __name__ == "__main__":
+    test_allocator_never_repeats()
+    test_batched_macs_match_single_card_macs()
+    test_provision_writes_store_and_manifest()
+    test_interrupted_batch_resumes_from_the_partial_manifest()
+    print("Provision tests passed.")
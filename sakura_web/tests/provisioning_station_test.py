@@ -0,0 +1,114 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import card_reader_manager
+import card_simulator
+import provisioning_station
+import uid_registry
+from app_helpers import build_ndef_file, generate_url
+
+LONG_URL = "https://nfc.sakurahighschool.com/s/{number}?uid={{uid}}&ref=" + "x" * 300
+
+
+def make_station(workdir, assignments):
+    card_simulator._readers[:] = []
+    card_simulator.install(card_reader_manager, provisioning_station)
+    registry = uid_registry.UIDRegistry(os.path.join(workdir, "uid_registry.csv"), fsync=False)
+    return provisioning_station.ProvisioningStation(registry, assignments, list_readers=card_simulator.readers)
+
+
+def test_long_urls_are_written_in_chunks():
+    with tempfile.TemporaryDirectory() as workdir:
+        url = LONG_URL.format(number=1)
+        station = make_station(workdir, [provisioning_station.Assignment(1, url)])
+        card = card_simulator.SimulatedNTAG424(ndef_file_size=512)
+        reader = card_simulator.add_reader(card=card)
+        worker = provisioning_station.ReaderWorker(station, reader)
+        card_reader = card_reader_manager.CardReader(reader, verbose=False)
+        card_reader.connect()
+
+        # job 要等到寫卡完成才 task_done
+        unfinished = []
+        send_apdu = card_reader.send_apdu
+        def record_unfinished(apdu):
+            if apdu[1] == 0xD6:
+                unfinished.append(station.jobs.unfinished_tasks)
+            return send_apdu(apdu)
+        card_reader.send_apdu = record_unfinished
+
+        worker.provision(card_reader)
+        uid = card.uid.hex().upper()
+        image = build_ndef_file(url.format(uid=uid))
+        assert len(image) > 0xFF
+        assert bytes(card.files[0xE104][:len(image)]) == image
+        assert unfinished and set(unfinished) == {1}
+        assert station.jobs.unfinished_tasks == 0
+        assert station.registry.get(uid) == 1 and worker.stats.written == 1
+        # UpdateBinary 都是 short APDU
+        assert all(apdu[4] <= 0xFF and len(apdu) == 5 + apdu[4] for apdu in reader.log if apdu[1] == 0xD6)
+
+        # 已登記的卡片: 用原本的編號重寫，不消耗 job
+        worker.provision(card_reader)
+        image = build_ndef_file(generate_url(1, uid))
+        assert bytes(card.files[0xE104][:len(image)]) == image
+        station.registry.close()
+
+
+def test_job_is_requeued_when_the_card_was_bound_meanwhile():
+    with tempfile.TemporaryDirectory() as workdir:
+        url = LONG_URL.format(number=1)
+        station = make_station(workdir, [provisioning_station.Assignment(1, url)])
+        card = card_simulator.SimulatedNTAG424(ndef_file_size=512)
+        reader = card_simulator.add_reader(card=card)
+        worker = provisioning_station.ReaderWorker(station, reader)
+        card_reader = card_reader_manager.CardReader(reader, verbose=False)
+        card_reader.connect()
+
+        # 另一台 reader 在 registry.get() 之後、bind() 之前把這張卡登記成 7 號
+        uid = card.uid.hex().upper()
+        station.registry.bind(uid, 7)
+        station.registry.get = lambda uid: None
+
+        worker.provision(card_reader)
+        image = build_ndef_file(generate_url(7, uid))
+        assert bytes(card.files[0xE104][:len(image)]) == image
+        assert station.jobs.qsize() == 1 and station.jobs.unfinished_tasks == 1
+        assert station.jobs.get_nowait().number == 1
+        assert station.registry.items() == [(7, uid)]
+        station.registry.close()
+
+
+def test_stop_waits_for_the_running_write():
+    with tempfile.TemporaryDirectory() as workdir:
+        assignments = list(provisioning_station.generate_assignments(1, 2))
+        station = make_station(workdir, assignments)
+        card = card_simulator.SimulatedNTAG424()
+        reader = card_simulator.add_reader(card=card, latency=0.01)
+        station.refresh_readers()
+
+        deadline = time.monotonic() + 5
+        while not any(apdu[1] == 0xD6 for apdu in reader.log):
+            assert time.monotonic() < deadline, "the worker never started writing"
+            time.sleep(0.001)
+        station.stop()
+        assert not any(worker.is_alive() for worker in station.workers.values())
+        station.registry.close()
+
+        uid = card.uid.hex().upper()
+        image = build_ndef_file(generate_url(1, uid))
+        assert bytes(card.files[0xE104][:len(image)]) == image
+        assert station.jobs.unfinished_tasks == 1
+        registry = uid_registry.UIDRegistry(os.path.join(workdir, "uid_registry.csv"), fsync=False)
+        assert registry.items() == [(1, uid)]
+        registry.close()
+
+
+if __name__ == "__main__":
+    test_long_urls_are_written_in_chunks()
+    test_job_is_requeued_when_the_card_was_bound_meanwhile()
+    test_stop_waits_for_the_running_write()
+    print("Provisioning station tests passed.")
@@ -0,0 +1,82 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import sdm
+
+# NXP AN12196 "NTAG 424 DNA features and hints", SDM example with the factory (all-zero) SDMFileRead key
+AN12196_UID = "04DE5F1EACC040"
+AN12196_CTR = 0x3D
+AN12196_SESSION_KEY = "3FB5F6E3A807A03D5E3570ACE393776F"
+AN12196_MAC = "94EED9EE65337086"
+AN12196_PICC_DATA = "EF963FF7828658A599F3041510671E88"
+
+
+def with_undiversified_keys(test):
+    """Run `test` with the card key = the (all-zero) master key, as in AN12196."""
+    diversify_key = sdm.diversify_key
+    sdm.diversify_key = lambda uid: sdm.SDM_FILE_READ_KEY
+    sdm._card_cipher.cache_clear()
+    try:
+        test()
+    finally:
+        sdm.diversify_key = diversify_key
+        sdm._card_cipher.cache_clear()
+
+
+def test_an12196_known_answers():
+    uid = bytes.fromhex(AN12196_UID)
+    assert sdm.SDM_FILE_READ_KEY == bytes(16) and sdm.SDM_META_READ_KEY == bytes(16)
+    assert sdm.session_mac_key(bytes(16), uid, AN12196_CTR).hex().upper() == AN12196_SESSION_KEY
+    assert sdm.decrypt_picc_data(AN12196_PICC_DATA) == (AN12196_UID, AN12196_CTR)
+
+    def check():
+        assert sdm.compute_sdm_mac(AN12196_UID, AN12196_CTR).upper() == AN12196_MAC
+        assert sdm.verify_sdm_mac(AN12196_UID, AN12196_CTR, AN12196_MAC)
+        assert sdm.verify_sdm_mac(AN12196_UID, AN12196_CTR, AN12196_MAC.lower())
+        assert not sdm.verify_sdm_mac(AN12196_UID, AN12196_CTR + 1, AN12196_MAC)
+        assert sdm.verify_picc_data(AN12196_PICC_DATA, AN12196_MAC) == (True, AN12196_UID, AN12196_CTR)
+        assert sdm.verify_batch([(AN12196_UID, AN12196_CTR, AN12196_MAC)]) == [True]
+
+    with_undiversified_keys(check)
+
+
+def test_diversified_keys_differ_per_card():
+    other = "04DE5F1EACC041"
+    mac = sdm.compute_sdm_mac(AN12196_UID, AN12196_CTR)
+    assert mac.upper() != AN12196_MAC  # 正式的 MAC 用每張卡自己的 key
+    assert sdm.verify_sdm_mac(AN12196_UID, AN12196_CTR, mac)
+    assert not sdm.verify_sdm_mac(other, AN12196_CTR, mac)
+    assert not sdm.verify_sdm_mac("04DE", AN12196_CTR, mac)
+    assert not sdm.verify_sdm_mac(AN12196_UID, 0x1000000, mac)
+    assert not sdm.verify_sdm_mac(AN12196_UID, AN12196_CTR, "zz" * 8)
+
+
+def test_urls_use_the_mirrored_format():
+    # 卡片輸出: ctr 是 6 位大寫 hex，enc 是大寫
+    url = f"https://nfc.sakurahighschool.com/a/7?uid={AN12196_UID}&ctr=00003D&enc={AN12196_MAC}"
+    assert helper.parse_sdm_url(url) == ("/a/7", AN12196_UID, 0x3D, AN12196_MAC)
+    assert helper.parse_sdm_url(url.replace("00003D", "000010"))[2] == 16
+    assert helper.parse_sdm_url(url.lower()) == ("/a/7", AN12196_UID, 0x3D, AN12196_MAC.lower())
+    for bad in ("ctr=3D&", "ctr=0003D&", "ctr=00000061&", "ctr=00003G&"):
+        try:
+            helper.parse_sdm_url(url.replace("ctr=00003D&", bad))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{bad} was accepted")
+
+    assert helper.format_sdm_url(7, AN12196_UID, 0x3D, AN12196_MAC.lower()) == url
+    next_url = helper.generate_next_sdm_url(helper.BASE_URL, url)
+    prefix, uid, ctr, enc = helper.parse_sdm_url(next_url)
+    assert (prefix, uid, ctr) == ("/a/7", AN12196_UID, 0x3E) and "ctr=00003E&" in next_url
+    assert enc == enc.upper() and sdm.verify_sdm_mac(uid, ctr, enc)
+
+
+if __name__ == "__main__":
+    test_an12196_known_answers()
+    test_diversified_keys_differ_per_card()
+    test_urls_use_the_mirrored_format()
+    print("SDM tests passed.")
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import auth
+import helper
+import main
+import sdm
+import server
+
+
+async def request(port, method, target, token=None, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = json.dumps(body).encode() if body is not None else b""
+    head = f"{method} {target} HTTP/1.1\r\nHost: test\r\nConnection: close\r\nContent-Length: {len(payload)}\r\n"
+    if token:
+        head += f"Authorization: Bearer {token}\r\n"
+    writer.write(head.encode() + b"\r\n" + payload)
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    return int(status_line.split()[1]), json.loads(rest.partition(b"\r\n\r\n")[2])
+
+
+def tap_target(uid, ctr):
+    return helper.format_sdm_url(1, uid, ctr, sdm.compute_sdm_mac(uid, ctr), base_url="")
+
+
+async def run_session_flow(uid):
+    app = server.VerificationServer(port=0, workers=2)
+    listener = await app.start()
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        # 沒登入: 只驗證卡片，不能靠 &user= 把卡片登記給別人
+        status, body = await request(port, "GET", tap_target(uid, 1) + "&user=mallory")
+        assert status == 401
+        assert not helper.get_card(uid)["registered"]
+        status, body = await request(port, "GET", tap_target(uid, 1))
+        assert status == 200 and body["valid"] and body["flag"] == 2
+        assert not helper.get_card(uid)["registered"]
+
+        assert (await request(port, "POST", "/login", body={"username": "alice", "password": "wrong"}))[0] == 401
+        assert (await request(port, "POST", "/login", body={"username": "alice"}))[0] == 400
+        status, body = await request(port, "POST", "/login", body={"username": "alice", "password": "pw"})
+        assert status == 200 and body["username"] == "alice"
+        token = body["token"]
+
+        status, body = await request(port, "GET", tap_target(uid, 2), token=token)
+        assert status == 200 and body["valid"]
+        assert helper.get_card_owner(uid) == "alice"
+
+        assert (await request(port, "GET", tap_target(uid, 3), token="not-a-token"))[0] == 401
+        assert (await request(port, "POST", "/logout", token=token))[0] == 200
+        assert (await request(port, "GET", tap_target(uid, 3), token=token))[0] == 401
+    finally:
+        await app.close()
+
+
+async def run_failing_tap(uid):
+    app = server.VerificationServer(port=0, workers=2)
+    listener = await app.start()
+    port = listener.sockets[0].getsockname()[1]
+    verify_tap = main.verify_tap
+
+    def broken(*args):
+        raise ValueError("Tap log is closed")
+
+    main.verify_tap = broken
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {tap_target(uid, 1)} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+        response = await asyncio.wait_for(reader.read(), timeout=5)  # 500 之後連線被關掉
+        writer.close()
+        assert response.startswith(b"HTTP/1.1 500 ") and b"Connection: close" in response
+    finally:
+        main.verify_tap = verify_tap
+    try:
+        # 其他連線照常服務
+        status, body = await request(port, "GET", tap_target(uid, 1))
+        assert status == 200 and body["valid"]
+    finally:
+        await app.close()
+
+
+def test_handler_errors_answer_500():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+        uid = helper.generate_new_uid()
+        helper.add_card(uid)
+        try:
+            asyncio.run(run_failing_tap(uid))
+        finally:
+            helper.close_store()
+
+
+def test_ownership_needs_a_session():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+        main.credentials = auth.CredentialStore(n=2 ** 4)
+        main.credentials.create_user("alice", "pw")
+        uid = helper.generate_new_uid()
+        helper.add_card(uid)
+        try:
+            asyncio.run(run_session_flow(uid))
+        finally:
+            helper.close_store()
+
+
+if __name__ == "__main__":
+    test_ownership_needs_a_session()
+    test_handler_errors_answer_500()
+    print("Server tests passed.")
@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import snapshot
+import storage
+
+
+def make_data(num_cards=2000):
+    uids = [helper.generate_new_uid() for _ in range(num_cards)]
+    cards = [{"uid": uid, "counter": i, "registered": i % 3 == 0} for i, uid in enumerate(uids)]
+    cards.append({"uid": "hand-edited", "counter": 7, "registered": True})
+    users = [{"username": "alice", "password": "pw", "cards": uids[:3] + ["hand-edited"]},
+             {"username": "陳小明", "password": "密碼", "cards": []}]
+    return {"cards": cards, "users": users}
+
+
+def test_binary_snapshot_round_trip():
+    data = make_data()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.snap")
+        store = storage.CardStore(path, snapshot_format="binary")
+        store.replace(data)
+        store.close()
+
+        store = storage.CardStore(path, snapshot_format="binary")
+        assert store.to_dict() == data
+        uid = data["cards"][5]["uid"]
+        assert store.get_card(uid) == {"uid": uid, "counter": 5, "registered": False}
+        assert store.get_owner(data["cards"][0]["uid"]) == "alice"
+        assert store.cards_for_user("alice")[-1] == "hand-edited"
+        assert all(store.may_contain(card["uid"]) for card in data["cards"])
+
+        # 改動寫進 log，不會碰 mapped 的檔案
+        new_uid = helper.generate_new_uid()
+        store.add_card(new_uid)
+        assert store.advance_counter(uid, 9)
+        assert store.register_card("陳小明", new_uid)
+        store.close()
+
+        store = storage.CardStore(path, snapshot_format="binary")
+        assert store.get_card(uid)["counter"] == 10
+        assert store.get_owner(new_uid) == "陳小明" and store.may_contain(new_uid)
+        store.compact()
+        store.close()
+
+        store = storage.CardStore(path, snapshot_format="binary")
+        assert store.get_card(new_uid) == {"uid": new_uid, "counter": 0, "registered": True}
+        assert len(store.cards) == len(data["cards"]) + 1
+        store.close()
+
+
+def test_mappings_are_closed():
+    data = make_data(200)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.snap")
+        store = storage.CardStore(path, snapshot_format="binary")
+        store.replace(data)
+        store.close()
+
+        mapped = []
+        read = snapshot.read
+        def record_mapping(path):
+            state = read(path)
+            mapped.append(state["mmap"])
+            return state
+        snapshot.read = record_mapping
+        try:
+            store = storage.CardStore(path, snapshot_format="binary")
+            store.add_card(helper.generate_new_uid())
+            store.compact()   # 壓縮時讀的 snapshot 寫完就 unmap
+            assert len(mapped) == 2 and not mapped[0].closed and mapped[1].closed
+            store.replace(data)   # 換掉整個資料庫: 舊的 mapping 也 unmap
+            assert mapped[0].closed
+            store.close()
+
+            store = storage.CardStore(path, snapshot_format="binary")
+            assert store.get_card(data["cards"][1]["uid"])["counter"] == 1
+            store.close()
+            assert len(mapped) == 3 and mapped[2].closed
+        finally:
+            snapshot.read = read
+
+
+def test_json_import_export():
+    data = make_data()
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "database.json")
+        snap_path = os.path.join(workdir, "database.snap")
+        with open(json_path, "w") as file:
+            json.dump(data, file)
+
+        assert storage.import_json(json_path, snap_path) == (len(data["cards"]), 2)
+        store = storage.CardStore(snap_path, snapshot_format="binary")
+        assert store.advance_counter(data["cards"][0]["uid"], 0)
+        store.close()
+
+        assert storage.export_json(snap_path, json_path) == (len(data["cards"]), 2)
+        data["cards"][0]["counter"] = 1
+        with open(json_path) as file:
+            assert json.load(file) == data
+
+
+def test_rejects_files_that_are_not_snapshots():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.snap")
+        with open(path, "w") as file:
+            json.dump(make_data(10), file)
+        try:
+            snapshot.read(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a JSON file was read as a binary snapshot")
+
+
+if __name__ == "__main__":
+    test_binary_snapshot_round_trip()
+    test_mappings_are_closed()
+    test_json_import_export()
+    test_rejects_files_that_are_not_snapshots()
+    print("Snapshot tests passed.")
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import sqlite_storage
+
+
+def test_readding_an_owned_card_keeps_its_owner():
+    with tempfile.TemporaryDirectory() as workdir:
+        store = sqlite_storage.SQLiteStore(os.path.join(workdir, "database.sqlite3"))
+        uids = [helper.generate_new_uid() for _ in range(3)]
+        store.add_cards(uids)
+        store.add_user("alice", "pw")
+        for uid in reversed(uids):
+            assert store.register_card("alice", uid)
+        assert store.cards_for_user("alice") == list(reversed(uids))
+
+        # upsert 更新欄位，不會刪掉 row 而碰到 ownership 的 foreign key
+        store.add_card(uids[0], counter=5, registered=True)
+        store.add_cards(uids[1:], counter=7, registered=True)
+        assert store.get_card(uids[0]) == {"uid": uids[0], "counter": 5, "registered": True}
+        assert store.get_card(uids[2])["counter"] == 7
+        assert store.get_owner(uids[0]) == "alice" and store.cards_for_user("alice") == list(reversed(uids))
+        store.close()
+
+
+def test_next_ownership_seq_uses_an_index():
+    with tempfile.TemporaryDirectory() as workdir:
+        store = sqlite_storage.SQLiteStore(os.path.join(workdir, "database.sqlite3"))
+        plan = " ".join(row[-1] for row in store._conn.execute(
+            "EXPLAIN QUERY PLAN " + sqlite_storage.NEXT_OWNERSHIP_SEQ))
+        assert "ownership_seq" in plan, plan
+        store.close()
+
+
+def test_filter_survives_commits_from_other_processes():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.sqlite3")
+        server, provisioner = sqlite_storage.SQLiteStore(path), sqlite_storage.SQLiteStore(path)
+        server.filter_ready.wait()
+        uid = helper.generate_new_uid()
+        provisioner.add_card(uid)
+        assert server.may_contain(uid)   # 別人加了卡 -> 查資料庫，背景重建 filter
+        server._filter_builder.join()
+        with server._lock:
+            assert server._filter_current()
+
+        # 別的 process 只更新 counter: filter 不用重建，miss 也不用回去查資料庫
+        provisioner.set_counter(uid, 9)
+        with server._lock:
+            assert server._filter_current() and not server._building
+        assert not server.may_contain(helper.generate_new_uid())
+
+        server.add_card(helper.generate_new_uid())   # 自己加的卡也不會讓 filter 失效
+        provisioner.set_counter(uid, 10)
+        with server._lock:
+            assert server._filter_current()
+        server.close()
+        provisioner.close()
+
+
+if __name__ == "__main__":
+    test_readding_an_owned_card_keeps_its_owner()
+    test_next_ownership_seq_uses_an_index()
+    test_filter_survives_commits_from_other_processes()
+    print("SQLite storage tests passed.")
@@ -0,0 +1,166 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import storage
+
+
+def test_changes_survive_reopen():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.json")
+        uids = [helper.generate_new_uid() for _ in range(5)]
+        store = storage.CardStore(path)
+        store.add_card(uids[0])
+        store.add_cards(uids[1:])
+        store.add_user("alice", "pw")
+        assert store.advance_counter(uids[0], 3)
+        assert store.advance_counter(uids[0], 3) is False  # replay
+        assert store.advance_counter("04FFFFFFFFFFFF", 1) is None
+        assert store.register_card("alice", uids[1])
+        assert not store.register_card("alice", uids[1])
+        # 不存在的 user / 卡片: 什麼都不改
+        assert not store.register_card("ghost", uids[2])
+        assert not store.register_card("alice", "04FFFFFFFFFFFF")
+        assert not store.get_card(uids[2])["registered"] and store.get_owner(uids[2]) is None
+        store.set_password("alice", "pw2")
+        store.close()
+
+        store = storage.CardStore(path)
+        assert store.get_card(uids[0]) == {"uid": uids[0], "counter": 4, "registered": False}
+        assert store.get_owner(uids[1]) == "alice" and store.cards_for_user("alice") == [uids[1]]
+        assert not store.get_card(uids[2])["registered"]
+        assert store.get_user("alice")["password"] == "pw2"
+        assert sorted(store.uids()) == sorted(uids)
+        assert all(store.may_contain(uid) for uid in uids)
+        store.close()
+
+
+def test_torn_log_line_is_truncated_before_appending():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.json")
+        uid, later = helper.generate_new_uid(), helper.generate_new_uid()
+        store = storage.CardStore(path)
+        store.add_card(uid)
+        assert store.advance_counter(uid, 1)
+        store.close()
+
+        # crash: 最後一個 entry 只寫了一半
+        with open(f"{path}.log", "a") as log:
+            log.write('{"op": "set_coun')
+
+        store = storage.CardStore(path)
+        assert store.get_card(uid)["counter"] == 2
+        assert store.advance_counter(uid, 5)
+        store.add_card(later)
+        store.close()
+
+        store = storage.CardStore(path)
+        # 截斷後寫入的 entry 重開後都還在: counter 不會倒退，新卡不會消失
+        assert store.get_card(uid)["counter"] == 6
+        assert store.advance_counter(uid, 5) is False
+        assert store.get_card(later) is not None
+        store.close()
+        with open(f"{path}.log") as log:
+            assert all(line.startswith('{"op"') for line in log)
+
+
+def test_failed_register_entry_leaves_state_unchanged():
+    state = storage._empty_state()
+    uid = helper.generate_new_uid()
+    state["cards"].put(uid)
+    try:
+        storage._apply(state, {"op": "register", "username": "ghost", "uid": uid})
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("expected an unknown user to be rejected")
+    assert not state["cards"].is_registered(uid) and state["owners"] == {}
+
+
+def test_compaction_folds_log_into_snapshot():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.json")
+        uids = [helper.generate_new_uid() for _ in range(30)]
+        store = storage.CardStore(path, compact_threshold=10)
+        for uid in uids:
+            store.add_card(uid)
+        store.compact()
+        assert os.path.getsize(f"{path}.log") == 0
+        store.close()
+
+        store = storage.CardStore(path)
+        assert sorted(store.uids()) == sorted(uids)
+        store.close()
+
+
+def test_concurrent_taps_accept_each_counter_once():
+    with tempfile.TemporaryDirectory() as workdir:
+        store = storage.CardStore(os.path.join(workdir, "database.json"), fsync=False)
+        uids = [helper.generate_new_uid() for _ in range(4)]
+        store.add_cards(uids)
+        accepted = []
+
+        def tap():
+            for ctr in range(50):
+                for uid in uids:
+                    if store.advance_counter(uid, ctr):
+                        accepted.append((uid, ctr))
+
+        threads = [threading.Thread(target=tap) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(accepted) == sorted((uid, ctr) for uid in uids for ctr in range(50))
+        store.close()
+
+
+def test_concurrent_commits_share_fsyncs():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.json")
+        store = storage.CardStore(path)
+        uids = [helper.generate_new_uid() for _ in range(8)]
+        store.add_cards(uids)
+
+        fsyncs = []
+        fsync = os.fsync
+        def slow_fsync(fd):
+            fsyncs.append(fd)
+            time.sleep(0.005)
+            fsync(fd)
+
+        def tap(uid):
+            for ctr in range(20):
+                assert store.advance_counter(uid, ctr)
+
+        os.fsync = slow_fsync
+        try:
+            threads = [threading.Thread(target=tap, args=(uid,)) for uid in uids]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.fsync = fsync
+        # 160 個 commit，fsync 時排隊的 entry 一起寫
+        assert 0 < len(fsyncs) < 120, len(fsyncs)
+        store.close()
+
+        store = storage.CardStore(path)
+        assert all(store.get_card(uid)["counter"] == 20 for uid in uids)
+        store.close()
+
+
+if __name__ == "__main__":
+    test_changes_survive_reopen()
+    test_torn_log_line_is_truncated_before_appending()
+    test_failed_register_entry_leaves_state_unchanged()
+    test_compaction_folds_log_into_snapshot()
+    test_concurrent_taps_accept_each_counter_once()
+    test_concurrent_commits_share_fsyncs()
+    print("Storage tests passed.")
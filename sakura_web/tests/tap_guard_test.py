@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import bloom
+import helper
+import main
+import ratelimit
+import sqlite_storage
+
+
+def test_bloom_filter_has_no_false_negatives():
+    uids = [helper.generate_new_uid() for _ in range(5000)]
+    uid_filter = bloom.BloomFilter(len(uids), error_rate=0.01)
+    for uid in uids:
+        uid_filter.add(uid)
+
+    assert all(uid in uid_filter for uid in uids)
+    false_positives = sum(helper.generate_new_uid() in uid_filter for _ in range(20000))
+    assert false_positives < 20000 * 0.03, false_positives
+
+
+def test_sqlite_filter_sees_cards_added_by_other_connections():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "database.db")
+        server, provisioner = sqlite_storage.SQLiteStore(path), sqlite_storage.SQLiteStore(path)
+        server.filter_ready.wait()
+        uid = helper.generate_new_uid()
+        assert not server.may_contain(uid)
+
+        provisioner.add_card(uid)
+        assert server.may_contain(uid)   # data_version 變了 -> 回去查資料庫
+        assert not server.may_contain(helper.generate_new_uid())
+        server.close()
+        provisioner.close()
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    limiter = ratelimit.TokenBucketLimiter(rate=2, burst=3, clock=lambda: now[0])
+    for _ in range(3):
+        assert limiter.allowed("a")
+        limiter.charge("a")
+    assert not limiter.allowed("a")
+    assert limiter.allowed("b")
+
+    now[0] += 0.5   # +1 token
+    assert limiter.allowed("a")
+
+
+def test_reject_flood_is_throttled_but_valid_taps_are_not():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+        main.reject_limiter = ratelimit.RejectLimiter(source_rate=0.001, source_burst=5,
+                                                      card_rate=0.001, card_burst=5)
+        try:
+            uid = helper.generate_new_uid()
+            helper.add_card(uid)
+            url = helper.generate_new_sdm_url(uid, 0)
+            for _ in range(10):
+                url = helper.generate_next_sdm_url(helper.BASE_URL, url)
+                assert main.verify_tap(url, source="10.0.0.1")["valid"]
+
+            stranger = helper.generate_new_uid()
+            stages = [main.verify_tap(helper.generate_new_sdm_url(stranger, i), source="10.0.0.2")
+                      for i in range(10)]
+            assert [s["flag"] for s in stages[:5]] == [1] * 5
+            assert all(s["stage"] == "rate_limit" for s in stages[5:])
+
+            # 被限流的只有那個 source
+            url = helper.generate_next_sdm_url(helper.BASE_URL, url)
+            assert main.verify_tap(url, source="10.0.0.1")["valid"]
+            assert main.verify_tap(url)["flag"] == 0   # in-process 呼叫不限流
+        finally:
+            main.reject_limiter = None
+            helper.close_store()
+
+
+if __name__ == "__main__":
+    test_bloom_filter_has_no_false_negatives()
+    test_sqlite_filter_sees_cards_added_by_other_connections()
+    test_token_bucket_refills_over_time()
+    test_reject_flood_is_throttled_but_valid_taps_are_not()
+    print("Tap guard tests passed.")
@@ -0,0 +1,216 @@
+import itertools
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import main
+import sdm
+import tap_analytics
+import tap_log
+
+MINUTE = 60 * 10**9
+START = 1_700_000_000 * 10**9  # 2023-11-14 22:13:20 UTC, 星期二
+
+
+class FakeClock:
+    def __init__(self, now=START):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_buffered_rotating_writes():
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, "taps")
+        record_bytes = tap_log.RECORD.size
+        log = tap_log.TapLog(directory, max_bytes=tap_log.HEADER.size + 8 * record_bytes, buffer_records=4,
+                             flush_interval=None)
+        for i in range(3):
+            log.record(helper.generate_new_uid(), i, "valid", 2, source="10.0.0.1")
+        assert tap_log.segments(directory) == []  # 還在 buffer 裡
+        log.record("not-a-uid", 3, "enc", source="2001:db8::1", username="alice")
+        assert len(tap_log.segments(directory)) == 1
+
+        for i in range(13):
+            log.record(None, None, "parse")
+        log.close()
+        # 8 筆一個 segment: 4 + 4 | 4 + 4 | 1
+        assert len(tap_log.segments(directory)) == 3
+
+        # crash 時只寫了一半的最後一筆不算
+        with open(tap_log.segments(directory)[-1], "ab") as file:
+            file.write(b"\x01" * (record_bytes // 2))
+        events = list(tap_analytics.read_chunks(directory, chunk_rows=5))
+        assert [len(chunk) for chunk in events] == [5, 3, 5, 3, 1]
+        first = events[0]
+        assert tap_log.source_label(int(first["source"][0])) == "10.0.0.1"
+        assert first["uid"][3] == 0 and first["source"][3] >= tap_log.HASHED and first["user"][3] != 0
+        assert list(first["outcome"][:4]) == [0, 0, 0, tap_log.OUTCOMES.index("enc")]
+        assert list(events[-1]["flag"]) == [-1]
+
+        # 重新打開: 新的 segment，不接在舊檔案後面
+        log = tap_log.TapLog(directory, flush_interval=None)
+        log.record(None, None, "parse")
+        log.close()
+        assert os.path.basename(tap_log.segments(directory)[-1]) == "taps-000004.bin"
+
+        log = tap_log.TapLog(directory, max_bytes=tap_log.HEADER.size + 4 * record_bytes, buffer_records=4,
+                             flush_interval=None, max_segments=2)
+        for i in range(12):
+            log.record(None, None, "parse")
+        log.close()
+        assert [os.path.basename(path) for path in tap_log.segments(directory)] == ["taps-000006.bin",
+                                                                                    "taps-000007.bin"]
+
+
+def test_verify_tap_records_every_outcome():
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.DATABASE_DRIVER = "json"
+        helper.close_store()
+        uid = helper.generate_new_uid()
+        helper.add_card(uid)
+        helper.add_user("alice", "pw")
+        helper.add_user("bob", "pw")
+        url = lambda ctr, enc=None: helper.format_sdm_url(1, uid, ctr, enc or sdm.compute_sdm_mac(uid, ctr))
+
+        main.event_log = tap_log.TapLog(os.path.join(workdir, "taps"), flush_interval=None)
+        try:
+            main.verify_tap(url(1), "alice", source="10.0.0.1")
+            main.verify_tap(url(2), "bob", source="10.0.0.2")
+            main.verify_tap(url(2), source="10.0.0.2")
+            main.verify_tap(url(3, "0" * 16))
+            main.verify_tap(helper.format_sdm_url(1, "04" + "0" * 12, 1, sdm.compute_sdm_mac("04" + "0" * 12, 1)))
+            main.verify_tap("https://example.com/nope")
+        finally:
+            main.event_log.close()
+            main.event_log = None
+            helper.close_store()
+
+        chunk = next(tap_analytics.read_chunks(os.path.join(workdir, "taps")))
+        assert [tap_log.OUTCOMES[code] for code in chunk["outcome"]] == ["valid", "ownership", "replay", "enc",
+                                                                          "unknown", "parse"]
+        assert list(chunk["flag"]) == [2, 2, 0, -1, 1, -1]
+        assert list(chunk["ctr"]) == [1, 2, 2, 3, 1, 0]
+        assert chunk["user"][0] == tap_log.user_key("alice") and chunk["user"][2] == 0
+
+
+def write_events(directory, events, buffer_records=64):
+    """events: (minutes after START, uid, ctr, outcome, flag, source)"""
+    clock = FakeClock()
+    log = tap_log.TapLog(directory, buffer_records=buffer_records, flush_interval=None, clock=clock)
+    for minutes, uid, ctr, outcome, flag, source in events:
+        clock.now = START + int(minutes * MINUTE)
+        log.record(uid, ctr, outcome, flag, source)
+    log.close()
+
+
+def test_analytics_across_chunks():
+    card, clone, quiet = "04AAAAAAAAAAAA", "04BBBBBBBBBBBB", "04CCCCCCCCCCCC"
+    events = []
+    # card: counter 1..10 但 4, 5 和 8 沒有回報到 server
+    for ctr in (1, 2, 3, 6, 7, 9, 10):
+        events.append((ctr, card, ctr, "valid", 2, "10.0.0.1"))
+    # 第 20 分鐘有人一直重送 card 舊的 URL
+    for i in range(8):
+        events.append((20 + i * 0.05, card, 3, "replay", 0, f"10.0.1.{i % 2}"))
+    # clone 在 22:40 - 22:44 之間同時從 4 個地方出現 (每分鐘的 replay 不到 5 次)
+    for i in range(12):
+        events.append((27 + i * 0.3, clone, i + 1, "valid" if i < 3 else "replay", 2 if i < 3 else 0,
+                       f"192.168.0.{i % 4}"))
+    # quiet: 每 10 分鐘一次，同一個地方
+    for i in range(6):
+        events.append((40 + 10 * i, quiet, i + 1, "valid", 2, "10.0.0.9"))
+    events.sort(key=lambda event: event[0])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, "taps")
+        write_events(directory, events)
+        for chunk_rows in (3, 7, 1000):
+            gaps, bursts, clones, heatmap = tap_analytics.analyze(
+                directory, [tap_analytics.CounterGaps(), tap_analytics.ReplayBursts("1min", min_taps=5),
+                            tap_analytics.CloneSuspects("5min", min_sources=3), tap_analytics.TapHeatmap()],
+                chunk_rows=chunk_rows)
+
+            assert gaps[["uid", "previous", "ctr", "missing"]].values.tolist() == [[card, 3, 6, 2], [card, 7, 9, 1]]
+            assert str(gaps["time"][0]) == "2023-11-14 22:19:20"
+
+            assert bursts[["uid", "taps", "sources"]].values.tolist() == [[card, 8, 2]]
+            assert str(bursts["window"][0]) == "2023-11-14 22:33:00"
+
+            assert clones["uid"].tolist() == [clone]
+            assert clones[["sources", "taps", "accepted"]].values.tolist() == [[4, 12, 3]]
+
+            assert heatmap.to_numpy().sum() == len(events)
+            assert heatmap.loc["Tue", 22] + heatmap.loc["Tue", 23] == len(events)
+
+        heatmap = tap_analytics.analyze(directory, [tap_analytics.TapHeatmap(["replay"], utc_offset="8h")])[0]
+        assert heatmap.loc["Wed"].sum() == heatmap.to_numpy().sum() == 17
+
+
+def test_counter_gaps_carry_across_chunks():
+    # 很多張卡交錯，每張卡跳過一個 counter; 小 chunk 讓每張卡的前後兩次 tap 分在不同 chunk
+    uids = [f"04{i:012X}" for i in range(50)]
+    events = [(step, uid, ctr, "valid", 2, None) for step, ctr in enumerate((1, 2, 4)) for uid in uids]
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, "taps")
+        write_events(directory, events, buffer_records=16)
+        for chunk_rows in (1, 16, 49, 10**6):
+            gaps = tap_analytics.analyze(directory, [tap_analytics.CounterGaps()], chunk_rows=chunk_rows)[0]
+            assert sorted(gaps["uid"]) == uids
+            assert set(gaps["missing"]) == {1}
+        assert len(tap_analytics.analyze(directory, [tap_analytics.CounterGaps(min_missing=2)])[0]) == 0
+        assert np.array_equal(tap_analytics.analyze(directory, [tap_analytics.CloneSuspects()])[0].columns,
+                              list(tap_analytics.CloneSuspects.columns))
+
+
+def test_concurrent_batches_are_written_in_order():
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, "taps")
+        clock = itertools.count(START)
+        log = tap_log.TapLog(directory, buffer_records=4, flush_interval=None, clock=lambda: next(clock))
+
+        def tap():
+            for i in range(500):
+                log.record(None, i, "parse")
+                if i % 50 == 0:
+                    log.flush()
+
+        threads = [threading.Thread(target=tap) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.close()
+        # clock 在 buffer lock 裡讀取: 檔案裡的時間必須嚴格遞增
+        times = np.concatenate([chunk["time"].to_numpy() for chunk in tap_analytics.read_chunks(directory)])
+        assert len(times) == 2000 and (np.diff(times) > 0).all()
+
+
+def test_taps_without_a_uid_are_not_attributed():
+    # 4-byte UID 沒辦法放進 uid 欄位，記成 0
+    events = [(i * 0.1, "04A1B2C3", ctr, "valid", 2, "10.0.0.1") for i, ctr in enumerate((1, 5, 9))]
+    events += [(1 + i * 0.05, "04A1B2C3", 1, "replay", 0, "10.0.0.2") for i in range(10)]
+    with tempfile.TemporaryDirectory() as workdir:
+        directory = os.path.join(workdir, "taps")
+        write_events(directory, events)
+        gaps, bursts = tap_analytics.analyze(directory, [tap_analytics.CounterGaps(),
+                                                         tap_analytics.ReplayBursts("1min", min_taps=5)])
+        assert len(gaps) == 0 and len(bursts) == 0
+
+
+if __name__ == "__main__":
+    test_buffered_rotating_writes()
+    test_verify_tap_records_every_outcome()
+    test_analytics_across_chunks()
+    test_counter_gaps_carry_across_chunks()
+    test_concurrent_batches_are_written_in_order()
+    test_taps_without_a_uid_are_not_attributed()
+    print("Tap log tests passed.")
@@ -1,12 +1,16 @@
-import hashlib
+import os
 import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+import sdm
 
 def parse_sdm_url(url):
     """ 解析 SDM URL，提取 prefix（流水號）、UID 和 CTR """
-    match = re.search(r"https://[^/]+(/a/\d+)\?uid=([A-F0-9]+)&ctr=(\d+)&enc=([a-f0-9]+)", url)
+    match = re.search(r"https://[^/]+(/a/\d+)\?uid=([0-9A-Fa-f]+)&ctr=([0-9A-Fa-f]{6})&enc=([0-9A-Fa-f]{16})", url)
     if match:
         prefix, uid, ctr, enc = match.groups()
-        return prefix, uid, int(ctr), enc  # 轉換 CTR 為整數
+        return prefix, uid.upper(), int(ctr, 16), enc  # CTR 是 6 位 hex
     else:
         raise ValueError("URL 格式錯誤，無法解析 prefix, UID 和 CTR")
 
@@ -18,11 +22,10 @@ def generate_next_sdm_url(base_url, url):
 
     # 增加 CTR（模擬下一次 Tap）
     ctr += 1
-    ctr_str = f"{ctr:08d}"  # 保持 8 位數格式
+    ctr_str = f"{ctr:06X}"  # 和卡片一樣: 6 位大寫 hex
 
-    # 重新計算 ENC（模擬加密驗證碼，實際應該用 AES-CMAC）
-    enc_data = f"{uid}{ctr_str}".encode()
-    enc = hashlib.sha256(enc_data).hexdigest()[:16]  # 取前16位當作加密碼
+    # 重新計算 ENC（AES-CMAC SDMMAC）
+    enc = sdm.compute_sdm_mac(uid, ctr).upper()
 
     # 生成新的 SDM URL（prefix 跟著變）
     new_sdm_url = f"{base_url}{prefix}?uid={uid}&ctr={ctr_str}&enc={enc}"
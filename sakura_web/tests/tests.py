@@ -1,17 +1,29 @@
-from smartcard.System import readers
-from smartcard.util import toHexString
 from Crypto.Cipher import AES
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from ndef_template import NDEFTemplate
+
+try:
+    from smartcard.System import readers
+    from smartcard.util import toHexString
+except ImportError:
+    # 沒裝 pyscard: 只能接模擬器 (card_simulator.install)
+    from card_simulator import readers, toHexString
 
 # Developer AES key (replace with your actual key)
 DEVELOPER_AES_KEY = bytes.fromhex("00112233445566778899AABBCCDDEEFF")
 
-def connect_to_reader():
-    """Connect to the NFC reader."""
+# 每張卡只有 num / uid / ctr / enc 不同: 編碼一次，寫卡時只 patch 欄位
+SDM_URL_TEMPLATE = NDEFTemplate("https://nfc.sakurahighschool.com/a/{num}?uid={uid}&ctr={ctr}&enc={enc}")
+
+def connect_to_reader(index=0):
+    """Connect to the NFC reader (the first one unless `index` is given)."""
     r = readers()
-    if not r:
+    if len(r) <= index:
         raise Exception("No NFC reader found.")
-    reader = r[0]
+    reader = r[index]
     connection = reader.createConnection()
     connection.connect()
     print(f"Connected to reader: {reader}")
@@ -116,8 +128,8 @@ def main():
 
         # Write URL link
         print("\nWriting URL Link...")
-        url_data = [0x03, 0x0F, 0xD1, 0x01, 0x0B, 0x55, 0x03] + [ord(c) for c in "example.com"]
-        write_ndef_data(connection, url_data)
+        ndef_file = SDM_URL_TEMPLATE.patch(num=1, uid=bytes(uid), ctr=counter_value, enc="0" * 16)
+        write_ndef_data(connection, list(ndef_file))
 
         # Write token and timer
         print("\nWriting Token and Timer...")
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from uid_registry import UIDRegistry
+
+
+def test_allocations_survive_a_restart():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "uid_registry.csv")
+        registry = UIDRegistry(path, fsync=False)
+        assert registry.get_or_allocate("04A1B2C3D4E5F6") == (1, True)
+        assert registry.get_or_allocate("04A1B2C3D4E5F6") == (1, False)
+        assert registry.bind("04A1B2C3", 10) == 10
+        registry.close()
+
+        registry = UIDRegistry(path, fsync=False)
+        assert registry.items() == [(1, "04A1B2C3D4E5F6"), (10, "04A1B2C3")]
+        assert registry.get_or_allocate("0400112233445566778A") == (11, True)
+        registry.close()
+
+
+def test_bad_rows_and_a_torn_last_line():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "uid_registry.csv")
+        with open(path, "w") as file:
+            file.write("1,04A1B2C3D4E5F6\n"
+                       "x2,04A1B2C3D4E5F7\n"    # 流水號不是數字
+                       "3,04a1b2c3d4e5f8\n"     # 小寫
+                       "4,04A1B2C3D4E\n"        # 長度不對
+                       "5,04A1B2C3D4E5F9\n"
+                       "6,04A")                 # 寫到一半就 crash
+
+        registry = UIDRegistry(path, fsync=False)
+        assert registry.items() == [(1, "04A1B2C3D4E5F6"), (5, "04A1B2C3D4E5F9")]
+        assert registry.skipped == 3 and "04A" not in registry
+        assert registry.get_or_allocate("04FFFFFFFFFFFF") == (6, True)
+        registry.close()
+
+        with open(path) as file:
+            assert file.read().endswith("5,04A1B2C3D4E5F9\n6,04FFFFFFFFFFFF\n")
+        registry = UIDRegistry(path, fsync=False)
+        assert registry.get("04FFFFFFFFFFFF") == 6 and registry.peek_next_number() == 7
+        registry.close()
+
+
+if __name__ == "__main__":
+    test_allocations_survive_a_restart()
+    test_bad_rows_and_a_torn_last_line()
+    print("UID registry tests passed.")
@@ -0,0 +1,145 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prototype"))
+
+import helper
+import main
+
+NUM_CARDS = 20
+TAPS_PER_CARD = 50
+REPLAYS_PER_TAP = 3
+NUM_THREADS = 16
+
+
+def build_tap_urls(uids):
+    """Every valid tap URL for every card, each one submitted several times (replays)."""
+    urls = []
+    for num, uid in enumerate(uids):
+        url = helper.generate_new_sdm_url(uid, num)
+        for _ in range(TAPS_PER_CARD):
+            urls.extend([url] * REPLAYS_PER_TAP)
+            url = helper.generate_next_sdm_url(helper.BASE_URL, url)
+    random.shuffle(urls)
+    return urls
+
+
+def hammer(urls):
+    """Run the verification pipeline on all URLs from many threads at once."""
+    accepted = Counter()
+    accepted_lock = threading.Lock()
+    start = threading.Barrier(NUM_THREADS)
+
+    def worker(chunk):
+        start.wait()
+        for url in chunk:
+            result = main.verify_tap(url)
+            if result["valid"]:
+                with accepted_lock:
+                    accepted[(result["uid"], result["ctr"])] += 1
+
+    threads = [threading.Thread(target=worker, args=(urls[i::NUM_THREADS],)) for i in range(NUM_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return accepted
+
+
+def run_stress(driver):
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.SQLITE_DATABASE = os.path.join(workdir, "database.db")
+        helper.DATABASE_DRIVER = driver
+        helper.close_store()
+
+        for _ in range(NUM_CARDS):
+            helper.add_card(helper.generate_new_uid())
+        uids = helper.get_all_uid()
+
+        accepted = hammer(build_tap_urls(uids))
+
+        # 同一個 (UID, CTR) 最多只能被接受一次
+        replays = {tap: count for tap, count in accepted.items() if count > 1}
+        assert not replays, f"Replayed taps accepted: {replays}"
+
+        # 每張卡最後一個 CTR 一定會被接受，且沒有任何 counter 更新遺失
+        for uid in uids:
+            assert accepted[(uid, TAPS_PER_CARD - 1)] == 1, f"Last tap of {uid} was not accepted"
+            assert helper.get_card(uid)["counter"] == TAPS_PER_CARD, f"Lost counter update on {uid}"
+
+        helper.close_store()
+        return sum(accepted.values())
+
+
+def run_registration_race(driver):
+    """Many users race to register the same cards; each card ends up with exactly one owner."""
+    with tempfile.TemporaryDirectory() as workdir:
+        helper.DATABASE = os.path.join(workdir, "database.json")
+        helper.SQLITE_DATABASE = os.path.join(workdir, "database.db")
+        helper.DATABASE_DRIVER = driver
+        helper.close_store()
+
+        uids = [helper.generate_new_uid() for _ in range(NUM_CARDS)]
+        for uid in uids:
+            helper.add_card(uid)
+        usernames = [f"user{i}" for i in range(NUM_THREADS)]
+        for username in usernames:
+            helper.add_user(username, "pw")
+
+        start = threading.Barrier(NUM_THREADS)
+
+        def worker(username):
+            start.wait()
+            for uid in uids:
+                main.verify_card_ownership(username, uid)
+
+        threads = [threading.Thread(target=worker, args=(username,)) for username in usernames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        def check():
+            owned = {username: helper.get_user_cards(username) for username in usernames}
+            assert sorted(uid for cards in owned.values() for uid in cards) == sorted(uids)
+            for username, cards in owned.items():
+                for uid in cards:
+                    assert helper.get_card_owner(uid) == username
+                    assert helper.is_card_owner(username, uid)
+                    assert not helper.is_card_owner("nobody", uid)
+
+        check()
+        # 重新開啟 (json: snapshot + log replay) 後 owner index 一樣
+        helper.close_store()
+        check()
+        assert helper.get_user_cards("nobody") == []
+
+        helper.close_store()
+
+
+def test_concurrent_taps_json_store():
+    run_stress("json")
+
+
+def test_concurrent_taps_sqlite_store():
+    run_stress("sqlite")
+
+
+def test_registration_race_json_store():
+    run_registration_race("json")
+
+
+def test_registration_race_sqlite_store():
+    run_registration_race("sqlite")
+
+
+if __name__ == "__main__":
+    for driver in ("json", "sqlite"):
+        run_registration_race(driver)
+        total = run_stress(driver)
+        print(f"[{driver}] {NUM_CARDS * TAPS_PER_CARD * REPLAYS_PER_TAP} taps, {total} accepted, no replay accepted, no update lost")